@@ -10,6 +10,7 @@ from pathlib import Path
 from edscrapers.scrapers.base import config as scrape_config
 from edscrapers.scrapers.base import helpers as scrape_base
 from edscrapers.scrapers.base import helpers as scrape_helpers
+from edscrapers.scrapers.base.shared import load_crawler
 
 from edscrapers.tools.dashboard import app as dash_app
 from edscrapers.tools.stats.stats import Statistics
@@ -89,9 +90,41 @@ def cli():
 @cli.command(context_settings=CONTEXT_SETTINGS)
 @click.option('--cache/--no-cache', default=True, help='Do not use Scrapy cache (i.e. "live" scrape)')
 @click.option('--resume/--no-resume', default=False, help='Resume a previously interrupted scrape')
+@click.option('--parse-cache/--no-parse-cache', default=True,
+              help='Reuse the parser output of pages whose content and parser code are unchanged')
+@click.option('--prune/--no-prune', default=False,
+              help='Skip the url prefixes which led to no dataset in the previous crawls')
+@click.option('--refresh-known', is_flag=True, default=False,
+              help='Only crawl the dataset pages found by the previous crawl')
+@click.option('--refresh-depth', type=click.INT, default=0,
+              help='Number of link levels to follow from the known dataset pages (default is 0)')
+@click.option('--retry-failed', is_flag=True, default=False,
+              help='Only retry the requests which failed in the previous crawl')
+@click.option('--discovery/--no-discovery', default=False,
+              help='''Discover pages from the sitemaps and listings of the crawler, where it has any,
+              rather than following every link (faster, but the pages which are only linked to
+              are missed, unless the crawler also follows the links from its start urls)''')
+@click.option('--http2/--no-http2', default=False,
+              help='Download https pages with HTTP/2, where the host supports it')
+@click.option('--record', 'record_path', type=click.Path(dir_okay=False), default=None,
+              help='Record every response in a WARC file (e.g. out.warc.gz), to replay the crawl later')
+@click.option('-w', '--workers', type=click.INT, default=1,
+              help='Number of worker processes the url space is sharded across (default is 1)')
+@click.option('--memory-budget', type=click.INT, default=0,
+              help='''Memory (RSS, in MB) the crawl (or each worker) must stay within: requests are
+              spilled to disk as it gets close, and the crawl is stopped (to be resumed with
+              --resume) when it is over the budget (default is no budget)''')
+@click.option('--output-layout', type=click.Choice(['files', 'segments'], case_sensitive=False),
+              default='files',
+              help='''Write each dataset to a JSON file of its own ('files', the default), or append
+              the datasets to a few buffered segment files ('segments', see `eds export`)''')
+@click.option('--dedup/--no-dedup', default=True,
+              help='''Drop the datasets which duplicate a dataset scraped before (by any scraper,
+              in any run) rather than writing them''')
 @add_options(global_options)
 @click.argument('name')
-def scrape(cache, resume, name, **kwargs):
+def scrape(cache, resume, parse_cache, prune, refresh_known, refresh_depth, retry_failed, discovery,
+           http2, record_path, workers, memory_budget, output_layout, dedup, name, **kwargs):
     '''Run a Scrapy pipeline for crawling / parsing / dumping output'''
 
     setup_logger(kwargs['quiet'], kwargs['verbosity'], 'scrapers', name)
@@ -101,13 +134,41 @@ def scrape(cache, resume, name, **kwargs):
     conf = scrape_helpers.get_variables(scrape_config, str.isupper)
 
     # Get the crawler & start the scrape
-    crawler = importlib.import_module(f'edscrapers.scrapers.{name}').Crawler
+    # (several comma-separated names share a single crawl, see `scrapers.base.shared`)
+    crawler = load_crawler(name)
 
     if not cache:
         conf['SCRAPY_SETTINGS']['HTTPCACHE_ENABLED'] = False
     else:
         conf['SCRAPY_SETTINGS']['HTTPCACHE_ENABLED'] = True
 
+    conf['SCRAPY_SETTINGS']['PARSE_CACHE_ENABLED'] = parse_cache
+    conf['SCRAPY_SETTINGS']['YIELD_PRUNE_ENABLED'] = prune
+
+    conf['SCRAPY_SETTINGS']['REFRESH_KNOWN_ENABLED'] = refresh_known
+    if refresh_known:
+        # the known dataset pages are requested at depth 1
+        conf['SCRAPY_SETTINGS']['DEPTH_LIMIT'] = 1 + refresh_depth
+
+    conf['SCRAPY_SETTINGS']['RETRY_FAILED_ENABLED'] = retry_failed
+    conf['SCRAPY_SETTINGS']['DISCOVERY_ENABLED'] = discovery
+
+    if http2:
+        conf['SCRAPY_SETTINGS']['DOWNLOAD_HANDLERS'] = {
+            'https': 'edscrapers.scrapers.base.handlers.Http2DownloadHandler'
+        }
+
+    if record_path:
+        if workers > 1:
+            raise click.UsageError('--record cannot be used with several --workers')
+        conf['SCRAPY_SETTINGS']['WARC_RECORD_PATH'] = record_path
+        # every page is parsed, so the requests made by the parsers are recorded too
+        conf['SCRAPY_SETTINGS']['PARSE_CACHE_ENABLED'] = False
+
+    conf['SCRAPY_SETTINGS']['MEMORY_BUDGET_MB'] = memory_budget
+    conf['SCRAPY_SETTINGS']['OUTPUT_LAYOUT'] = output_layout.lower()
+    conf['SCRAPY_SETTINGS']['DEDUP_ENABLED'] = dedup
+
     if kwargs['verbosity']:
         conf['SCRAPY_SETTINGS']['LOG_ENABLED'] = True
     else:
@@ -123,6 +184,50 @@ def scrape(cache, resume, name, **kwargs):
         conf['SCRAPY_SETTINGS']['JOBDIR'] = job_dir
         conf['SCRAPY_SETTINGS']['HTTPCACHE_DIR'] = cache_dir
 
+    if workers > 1:
+        from edscrapers.scrapers.base.fleet import run_fleet
+        run_fleet(name, conf['SCRAPY_SETTINGS'], workers,
+                  quiet=kwargs['quiet'], verbosity=kwargs['verbosity'])
+        return
+
+    process = CrawlerProcess(conf['SCRAPY_SETTINGS'])
+    process.crawl(crawler)
+    process.start()
+
+
+@cli.command(context_settings=CONTEXT_SETTINGS)
+@click.option('--parse-cache/--no-parse-cache', default=False,
+              help='Use the parse cache (default is to parse every replayed response)')
+@add_options(global_options)
+@click.argument('name')
+@click.argument('warc_path', type=click.Path(exists=True, dir_okay=False))
+def replay(parse_cache, name, warc_path, **kwargs):
+    '''Replay a crawl recorded with `scrape --record` through the parsers and pipelines'''
+
+    setup_logger(kwargs['quiet'], kwargs['verbosity'], 'scrapers', name)
+    _check_environment()
+
+    conf = scrape_helpers.get_variables(scrape_config, str.isupper)
+    crawler = load_crawler(name)
+
+    handler = 'edscrapers.scrapers.base.handlers.WarcReplayDownloadHandler'
+    conf['SCRAPY_SETTINGS'].update({
+        'WARC_REPLAY_PATH': warc_path,
+        'DOWNLOAD_HANDLERS': {'http': handler, 'https': handler},
+        'PARSE_CACHE_ENABLED': parse_cache,
+        # nothing is downloaded, so nothing needs to be throttled, retried, cached or discovered
+        'HTTPCACHE_ENABLED': False,
+        'ROBOTSTXT_OBEY': False,
+        'DOWNLOAD_DELAY': 0,
+        'ADAPTIVE_THROTTLE_ENABLED': False,
+        'RETRY_LANE_ENABLED': False,
+        'DISCOVERY_ENABLED': False,
+        'YIELD_PRIORITY_ENABLED': False,
+        'REFRESH_KNOWN_ENABLED': False,
+        # one response at a time, in the recorded order
+        'CONCURRENT_REQUESTS': 1,
+        'LOG_ENABLED': bool(kwargs['verbosity']),
+    })
 
     process = CrawlerProcess(conf['SCRAPY_SETTINGS'])
     process.crawl(crawler)
@@ -136,14 +241,45 @@ def scrape(cache, resume, name, **kwargs):
               traversed recursivelly to obtain the list of files.''')
 @click.option('-n', '--name', default=None,
               help='''If specified, the transformer will only act on the mentioned output (i.e. a scraper's name)''')
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=1, show_default=True,
+              help='''The number of processes transforming the datasets (sanitize, datajson and rag on raw datasets)''')
+@click.option('--overlay', is_flag=True, default=False,
+              help='''Have sanitize write its changes to an overlay store rather than to the scraped datasets''')
 @click.argument('transformer')
 @add_options(global_options)
-def transform(in_file_path, name, transformer, **kwargs):
-    '''Run a transformer on a scraper output to generate data in a format useful for other applications'''
-    setup_logger(kwargs['quiet'], kwargs['verbosity'], 'transformers', transformer)
+def transform(in_file_path, name, jobs, overlay, transformer, **kwargs):
+    '''Run a transformer (or a comma-separated chain of transformers, run in a single pass
+    over the datasets) on a scraper output to generate data in a format useful for other applications'''
+    setup_logger(kwargs['quiet'], kwargs['verbosity'], 'transformers', transformer.replace(',', '-'))
     _check_environment()
+    from edscrapers.transformers.base import chain
+    if ',' in transformer:
+        try:
+            chain.transform(transformer.split(','), name, in_file_path, jobs=jobs, overlay=overlay)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        return
     transformer = importlib.import_module(f"edscrapers.transformers.{transformer}.transform")
-    transformer.transform(name, in_file_path)
+    chain.run_transformer(transformer, name, in_file_path, jobs=jobs, overlay=overlay)
+
+
+@cli.command(context_settings=CONTEXT_SETTINGS)
+@click.option('-n', '--name', default=None,
+              help='''If specified, only export the mentioned output (i.e. a scraper's name)''')
+@add_options(global_options)
+def export(name, **kwargs):
+    '''Write the datasets of a `scrape --output-layout segments` output to a JSON file each'''
+    setup_logger(kwargs['quiet'], kwargs['verbosity'], 'scrapers', name or 'export')
+    _check_environment()
+
+    from edscrapers.scrapers.base.segments import export_datasets
+    output_dir = Path(os.getenv('ED_OUTPUT_PATH'), 'scrapers')
+    if name in ['oese', 'osers', 'oela', 'octae', 'ope', 'opepd']:
+        output_dir = Path(output_dir, 'edgov', name)
+    elif name:
+        output_dir = Path(output_dir, name)
+    count = export_datasets(output_dir)
+    logger.success(f'Exported {count} datasets to {output_dir}')
 
 
 @cli.command(context_settings=CONTEXT_SETTINGS)
@@ -180,5 +316,169 @@ def dash(detached, port, host, debug, **kwargs):
 
 
 
+@cli.group()
+def bench():
+    ''' Run a benchmark of the scraping kit against a local test server. '''
+
+
+@bench.command('http2', context_settings=CONTEXT_SETTINGS)
+@click.option('--pages', type=click.INT, default=500, help='Number of pages of the test site (default is 500)')
+@click.option('--latency', type=click.FLOAT, default=0.05,
+              help='Seconds the test server waits before each response (default is 0.05)')
+@click.option('-c', '--concurrency', type=click.INT, default=16,
+              help='Number of concurrent requests (default is 16)')
+@click.option('-p', '--port', type=click.INT, default=8443, help='Port of the test server (default is 8443)')
+@add_options(global_options)
+def bench_http2(pages, latency, concurrency, port, **kwargs):
+    ''' Compare the HTTP/2 download handler with HTTP/1.1 (pages/sec and connections). '''
+    setup_logger(kwargs['quiet'], kwargs['verbosity'], 'bench', 'http2')
+    _check_environment()
+    from edscrapers.tools.bench.http2 import run_benchmark, write_benchmark
+
+    benchmark = run_benchmark(pages=pages, latency=latency, concurrency=concurrency, port=port)
+    click.echo(f"{'Mode':<20}{'Pages':>8}{'Seconds':>10}{'Pages/sec':>12}{'Connections':>14}")
+    for result in benchmark:
+        click.echo(f"{result['mode']:<20}{result['pages']:>8}{result['seconds']:>10}"
+                   f"{result['pages_per_second']:>12}{result['connections']:>14}")
+    logger.success(f'Benchmark written to {write_benchmark(benchmark)}')
+
+
+@bench.command('crawl', context_settings=CONTEXT_SETTINGS)
+@click.option('--depth', type=click.INT, default=3,
+              help='Levels of pages of the mirror below each start url (default is 3)')
+@click.option('--fanout', type=click.INT, default=5,
+              help='Number of child pages each page of the mirror links to (default is 5)')
+@click.option('--dataset-ratio', type=click.FLOAT, default=0.3,
+              help='Share of the pages of the mirror which list resources (default is 0.3)')
+@click.option('--latency', type=click.FLOAT, default=0,
+              help='Seconds the mirror waits before each response (default is 0)')
+@click.option('-c', '--concurrency', type=click.INT, default=16,
+              help='Number of concurrent requests (default is 16)')
+@click.option('-p', '--port', type=click.INT, default=8769, help='Port of the mirror (default is 8769)')
+@click.option('--save-baseline', is_flag=True, default=False,
+              help='Store the results as the baseline later runs are compared with')
+@click.option('--tolerance', type=click.FLOAT, default=0.2,
+              help='Change from the baseline above which a metric has regressed (default is 0.2)')
+@add_options(global_options)
+@click.argument('names', nargs=-1)
+def bench_crawl(depth, fanout, dataset_ratio, latency, concurrency, port, save_baseline,
+                tolerance, names, **kwargs):
+    ''' Measure the throughput of the crawlers against a local synthetic mirror of the sites. '''
+    setup_logger(kwargs['quiet'], kwargs['verbosity'], 'bench', 'crawl')
+    _check_environment()
+    from edscrapers.tools.bench.crawl import run_benchmark, read_baseline,\
+        compare_with_baseline, write_benchmark
+
+    site = {'depth': depth, 'fanout': fanout, 'dataset_ratio': dataset_ratio,
+            'latency': latency, 'concurrency': concurrency}
+    benchmark = run_benchmark(names=list(names), depth=depth, fanout=fanout,
+                              dataset_ratio=dataset_ratio, latency=latency,
+                              concurrency=concurrency, port=port)
+    compare_with_baseline(benchmark, site, read_baseline(), tolerance=tolerance)
+
+    click.echo(f"{'Crawler':<14}{'Pages':>7}{'Items':>7}{'Pages/sec':>11}{'Items/sec':>11}"
+               f"{'CPU ms/page':>13}{'Peak MB':>9}  vs baseline")
+    for result in benchmark:
+        changes = ', '.join(f'{metric} {change:+.0%}'
+                            for metric, change in result.get('changes', {}).items())
+        if result.get('regressions'):
+            changes += ' REGRESSED'
+        click.echo(f"{result['crawler']:<14}{result['pages']:>7}{result['items']:>7}"
+                   f"{result['pages_per_second']:>11}{result['items_per_second']:>11}"
+                   f"{result['cpu_ms_per_page']:>13}{result['peak_memory_mb']:>9}  {changes or '-'}")
+    logger.success(f'Benchmark written to {write_benchmark(benchmark, site, save_baseline)}')
+
+    if any(result.get('regressions') for result in benchmark):
+        sys.exit(1)
+
+
+@bench.command('items', context_settings=CONTEXT_SETTINGS)
+@click.option('--resources', type=click.INT, default=500,
+              help='Number of resources of the dataset page (default is 500)')
+@click.option('--repeat', type=click.INT, default=20,
+              help='Number of runs each step is timed over (default is 20)')
+@add_options(global_options)
+def bench_items(resources, repeat, **kwargs):
+    ''' Measure the allocations of building and serializing the items of a dataset page. '''
+    setup_logger(kwargs['quiet'], kwargs['verbosity'], 'bench', 'items')
+    _check_environment()
+    from edscrapers.tools.bench.items import run_benchmark, write_benchmark
+
+    benchmark = run_benchmark(resources=resources, repeat=repeat)
+    click.echo(f"{'Model':<8}{'Step':<22}{'Peak KB':>10}{'Held KB':>10}{'Blocks':>8}{'ms':>9}")
+    for result in benchmark:
+        click.echo(f"{result['model']:<8}{result['step']:<22}{result['peak_kilobytes']:>10}"
+                   f"{result['kilobytes']:>10}{result['blocks']:>8}{result['milliseconds']:>9}")
+    logger.success(f'Benchmark written to {write_benchmark(benchmark)}')
+
+
+@bench.command('sanitize', context_settings=CONTEXT_SETTINGS)
+@click.option('--datasets', type=click.INT, default=5000,
+              help='Number of datasets of the corpus (default is 5000)')
+@click.option('--resources', type=click.INT, default=10,
+              help='Number of resources of each dataset (default is 10)')
+@click.option('--group-resources', type=click.INT, default=300000,
+              help='Number of resources the group matching is measured on (default is 300000)')
+@click.option('--repeat', type=click.INT, default=3,
+              help='Number of runs each implementation is timed over (default is 3)')
+@add_options(global_options)
+def bench_sanitize(datasets, resources, group_resources, repeat, **kwargs):
+    ''' Measure the throughput of the sanitize rules on a synthetic corpus of datasets. '''
+    setup_logger(kwargs['quiet'], kwargs['verbosity'], 'bench', 'sanitize')
+    _check_environment()
+    from edscrapers.tools.bench.sanitize import run_benchmark, write_benchmark
+
+    benchmark = run_benchmark(datasets=datasets, resources=resources,
+                              group_resources=group_resources, repeat=repeat)
+    click.echo(f"{'Step':<10}{'Implementation':<16}{'Count':>8}{'ms':>10}{'Per sec':>10}{'Identical':>11}")
+    for result in benchmark:
+        click.echo(f"{result['step']:<10}{result['implementation']:<16}{result['count']:>8}"
+                   f"{result['milliseconds']:>10}{result['per_second']:>10}{str(result['identical']):>11}")
+    logger.success(f'Benchmark written to {write_benchmark(benchmark)}')
+
+
+@bench.command('datajson', context_settings=CONTEXT_SETTINGS)
+@click.option('--datasets', type=click.INT, default=100000,
+              help='Number of datasets the models are measured on (default is 100000)')
+@click.option('--distributions', type=click.INT, default=10,
+              help='Number of distributions of each dataset (default is 10)')
+@click.option('--memory-sample', type=click.INT, default=10000,
+              help='Number of datasets held at once to measure their memory (default is 10000)')
+@click.option('--sizes', default='5000,10000,20000,40000',
+              help='Comma-separated numbers of datasets measured (default is 5000,10000,20000,40000)')
+@click.option('--legacy-max', type=click.INT, default=20000,
+              help='Largest number of datasets the legacy lists are measured on (default is 20000)')
+@click.option('--repeat', type=click.INT, default=3,
+              help='Number of runs each implementation is timed over (default is 3)')
+@add_options(global_options)
+def bench_datajson(datasets, distributions, memory_sample, sizes, legacy_max, repeat, **kwargs):
+    ''' Measure the datajson models, and how the transformer scales with the number of datasets. '''
+    setup_logger(kwargs['quiet'], kwargs['verbosity'], 'bench', 'datajson')
+    _check_environment()
+    from edscrapers.tools.bench.datajson import run_models_benchmark, run_benchmark, write_benchmark
+
+    try:
+        sizes = [int(size) for size in sizes.split(',')]
+    except ValueError:
+        raise click.BadParameter('the sizes must be comma-separated numbers', param_hint='--sizes')
+    models_benchmark = run_models_benchmark(datasets=datasets, distributions=distributions,
+                                            memory_sample=memory_sample)
+    click.echo(f"{'Step':<10}{'Implementation':<16}{'Count':>8}{'Bytes/dataset':>15}"
+               f"{'Build us':>10}{'Serialize us':>14}{'Identical':>11}")
+    for result in models_benchmark:
+        click.echo(f"{result['step']:<10}{result['implementation']:<16}{result['count']:>8}"
+                   f"{result['bytes_per_dataset']:>15}{result['build_microseconds_per_dataset']:>10}"
+                   f"{result['serialize_microseconds_per_dataset']:>14}{str(result['identical']):>11}")
+
+    benchmark = run_benchmark(sizes=sizes, legacy_max=legacy_max, repeat=repeat)
+    click.echo()
+    click.echo(f"{'Step':<10}{'Implementation':<16}{'Count':>8}{'ms':>10}{'us/dataset':>12}{'Identical':>11}")
+    for result in benchmark:
+        click.echo(f"{result['step']:<10}{result['implementation']:<16}{result['count']:>8}"
+                   f"{result['milliseconds']:>10}{result['microseconds_per_dataset']:>12}"
+                   f"{str(result['identical']):>11}")
+    logger.success(f'Benchmark written to {write_benchmark(models_benchmark + benchmark)}')
+
+
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,247 @@
+""" module contains the parse-result cache used by edscrapers.
+
+The output of a parser callback is memoized against a key made up of
+the hash of the response body, the parser module and the arguments the parser
+was called with. Each cache entry also records the code version of the parser
+(and of any other memoized parser it delegated to), so that entries become stale
+as soon as the parser code they were produced with changes """
+
+import copy
+import json
+import pickle
+import sqlite3
+import hashlib
+import functools
+import importlib
+from pathlib import Path
+
+
+# fields which are NOT derived from the page body and
+# so should never be stored in (or returned from) the cache
+VOLATILE_FIELDS = ('saved_as_file', 'collection')
+
+# the files (relative to the 'scrapers' package) every parser depends on
+BASE_PARSER_FILES = ('base/helpers.py', 'base/parser.py', 'base/models.py')
+
+
+class ParseCache():
+    """ class provides the singleton parse-result cache used by the
+    `memoize_parse` decorator.
+
+    The cache is disabled (i.e. every lookup misses and nothing is stored)
+    until `ParseCache.open()` is called """
+
+    connection = None
+    hits = 0
+    misses = 0
+    # number of writes since the last commit
+    pending_writes = 0
+    # number of writes after which the cache is committed to disk
+    commit_every = 100
+
+    # memoized code versions, keyed by parser module name
+    versions = dict()
+
+    # stack of dependency dicts for the memoized parsers currently running
+    # (used to track which memoized parsers delegate to others)
+    active_dependencies = list()
+
+    @classmethod
+    def open(cls, file_dir_path, file_stem_name='parsecache'):
+        """ open (creating it if necessary) the cache database
+        located in 'file_dir_path' """
+
+        file_dir_path = Path(file_dir_path)
+        file_dir_path.mkdir(parents=True, exist_ok=True)
+
+        # the cache may be shared by several crawler processes (see `fleet`)
+        cls.connection = sqlite3.connect(str(Path(file_dir_path,
+                                                  f'{file_stem_name}.sqlite')),
+                                         timeout=60)
+        cls.connection.execute('''CREATE TABLE IF NOT EXISTS parse_cache
+                                  (key TEXT PRIMARY KEY, payload BLOB)''')
+        cls.connection.commit()
+        cls.hits = 0
+        cls.misses = 0
+        cls.pending_writes = 0
+
+    @classmethod
+    def close(cls):
+        """ commit outstanding writes and close the cache database """
+
+        if cls.connection is None:
+            return
+        cls.connection.commit()
+        cls.connection.close()
+        cls.connection = None
+
+    @classmethod
+    def is_open(cls):
+        return cls.connection is not None
+
+    @classmethod
+    def get(cls, key):
+        """ returns the unpickled payload stored against 'key' or None """
+
+        row = cls.connection.execute('SELECT payload FROM parse_cache WHERE key = ?',
+                                     (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return pickle.loads(row[0])
+        except (pickle.UnpicklingError, AttributeError, ImportError, TypeError):
+            # the entry holds items of models which have changed since (so the
+            # version of its parser has changed too), and is replaced as a miss
+            return None
+
+    @classmethod
+    def put(cls, key, payload):
+        """ store 'payload' against 'key', replacing any previous entry """
+
+        cls.connection.execute('INSERT OR REPLACE INTO parse_cache (key, payload) VALUES (?, ?)',
+                               (key, pickle.dumps(payload, protocol=4)))
+        cls.pending_writes += 1
+        if cls.pending_writes >= cls.commit_every:
+            cls.connection.commit()
+            cls.pending_writes = 0
+
+    @classmethod
+    def get_version(cls, module_name):
+        """ returns the code version of the parser contained in 'module_name'.
+
+        The version is a hash of all the modules in the parser's package
+        directory, its 'parsers' subpackage and the base parser helpers.
+        Subpackages other than 'parsers' (e.g. the edgov offices) are NOT
+        included, as they are versioned on their own """
+
+        if module_name not in cls.versions:
+            module = importlib.import_module(module_name)
+            package_dir = Path(module.__file__).parent
+            scrapers_dir = Path(importlib.import_module('edscrapers.scrapers').__file__).parent
+
+            source_files = sorted(package_dir.glob('*.py')) +\
+                           sorted(package_dir.glob('parsers/*.py')) +\
+                           [Path(scrapers_dir, f) for f in BASE_PARSER_FILES]
+
+            md5 = hashlib.md5()
+            for source_file in source_files:
+                md5.update(str(source_file.relative_to(source_file.parent.parent)).encode('utf-8'))
+                md5.update(source_file.read_bytes())
+            cls.versions[module_name] = md5.hexdigest()
+
+        return cls.versions[module_name]
+
+
+def memoize_parse(parse_func):
+    """ decorator memoizes the output of a parser callback.
+
+    The decorated function ALWAYS returns a list of the items produced by the
+    parser (an empty list if the parser returned None). When the cache is not open,
+    the parser is simply called and its output collected into a list.
+
+    As the key is the hash of the body (the url of the entry being replaced by that of
+    the response where it is the whole value), a parser must not depend on the url in
+    any other way: what it checks or derives from the url (e.g. the publisher in its
+    path) is to be done before, and passed as an argument (which is in the key) """
+
+    module_name = parse_func.__module__
+
+    @functools.wraps(parse_func)
+    def wrapper(res, *args, **kwargs):
+
+        if not ParseCache.is_open():
+            return _collect(parse_func(res, *args, **kwargs))
+
+        version = ParseCache.get_version(module_name)
+        # let any enclosing memoized parser know it depends on this one
+        if ParseCache.active_dependencies:
+            ParseCache.active_dependencies[-1][module_name] = version
+
+        key = '-'.join([hashlib.sha1(res.body).hexdigest(), module_name,
+                        _get_arguments_hash(args, kwargs)])
+
+        entry = ParseCache.get(key)
+        if entry and _is_entry_valid(entry, version):
+            ParseCache.hits += 1
+            if ParseCache.active_dependencies:
+                ParseCache.active_dependencies[-1].update(entry['dependencies'])
+            return _rebind_url(entry['items'], entry['url'], res.url)
+
+        ParseCache.misses += 1
+        ParseCache.active_dependencies.append(dict())
+        try:
+            items = _collect(parse_func(res, *args, **kwargs))
+        finally:
+            dependencies = ParseCache.active_dependencies.pop()
+
+        if ParseCache.active_dependencies:
+            ParseCache.active_dependencies[-1].update(dependencies)
+
+        ParseCache.put(key, {'version': version,
+                             'dependencies': dependencies,
+                             'url': res.url,
+                             'items': [_strip_volatile_fields(item) for item in items]})
+        return items
+
+    return wrapper
+
+
+def _collect(result):
+    """ private helper.
+    collects the (None, single item or iterable) output of a parser into a list """
+
+    if result is None:
+        return []
+    if isinstance(result, dict):
+        return [result]
+    return list(result)
+
+
+def _is_entry_valid(entry, version):
+    """ private helper.
+    checks that the parser (and all the parsers it delegated to) which
+    produced the cache 'entry' have not changed since """
+
+    if entry['version'] != version:
+        return False
+    for module_name, module_version in entry['dependencies'].items():
+        if ParseCache.get_version(module_name) != module_version:
+            return False
+    return True
+
+
+def _get_arguments_hash(args, kwargs):
+    """ private helper.
+    returns a hash of the extra arguments a parser was called with """
+
+    arguments = json.dumps([args, kwargs], sort_keys=True,
+                           default=lambda o: dict(o))
+    return hashlib.md5(arguments.encode('utf-8')).hexdigest()
+
+
+def _strip_volatile_fields(item):
+    """ private helper.
+    returns a copy of 'item' without the VOLATILE_FIELDS """
+
+    item = copy.deepcopy(item)
+    for field in VOLATILE_FIELDS:
+        item.pop(field, None)
+    return item
+
+
+def _rebind_url(value, cached_url, url):
+    """ private helper.
+    replaces every occurrence of 'cached_url' within 'value' by 'url'.
+    This allows entries produced from a page to be reused for mirror
+    pages (i.e. different urls) serving an identical body """
+
+    if cached_url == url:
+        return value
+    if isinstance(value, str):
+        return url if value == cached_url else value
+    if isinstance(value, list):
+        return [_rebind_url(v, cached_url, url) for v in value]
+    if isinstance(value, dict):
+        for key in list(value.keys()):
+            value[key] = _rebind_url(value[key], cached_url, url)
+    return value
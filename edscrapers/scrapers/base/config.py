@@ -3,6 +3,9 @@ import os
 import logging
 import logging.config
 
+# the responses recorded in the retry queue (see `RetryLaneMiddleware`); Scrapy's default
+RETRY_HTTP_CODES = [500, 502, 503, 504, 522, 524, 408, 429]
+
 # Scrapy
 SCRAPY_SETTINGS = {
     'SPIDER_MODULES': [
@@ -23,17 +26,44 @@ SCRAPY_SETTINGS = {
         'scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware': 1,
         'edscrapers.scrapers.base.middlewares.RegexOffsiteMiddleware': 2,
         'scrapy.spidermiddlewares.offsite.OffsiteMiddleware': 3,
+        'edscrapers.scrapers.base.middlewares.AdaptiveThrottleMiddleware': 560,
+        # records the failures left once the throttle has given up on a request
+        'edscrapers.scrapers.base.middlewares.RetryLaneMiddleware': 550,
+        # records the responses once redirected and decompressed, as the spider gets them
+        'edscrapers.scrapers.base.middlewares.WarcRecorderMiddleware': 540,
     },
     'ITEM_PIPELINES': {
+        'edscrapers.scrapers.base.pipelines.DuplicatesPipeline': 0,
         'edscrapers.scrapers.base.pipelines.JsonWriterPipeline': 1,
         'edscrapers.scrapers.base.pipelines.GraphItemPipeline': 2,
     },
     'SPIDER_MIDDLEWARES': {
-        'edscrapers.scrapers.base.middlewares.GraphMiddleWare': 1000
+        'edscrapers.scrapers.base.middlewares.RefreshKnownMiddleware': 800,
+        'edscrapers.scrapers.base.middlewares.RetryFailedMiddleware': 810,
+        'edscrapers.scrapers.base.middlewares.DiscoveryMiddleware': 820,
+        'edscrapers.scrapers.base.middlewares.YieldPriorityMiddleware': 900,
+        'edscrapers.scrapers.base.middlewares.GraphMiddleWare': 1000,
+        # closest to the spider, so the requests it yields while replaying are dropped first
+        'edscrapers.scrapers.base.middlewares.WarcReplayMiddleware': 1100,
+        # runs after the offsite middleware, so offsite requests are not handed over
+        'edscrapers.scrapers.base.middlewares.FleetShardMiddleware': 450,
+    },
+    'EXTENSIONS': {
+        'edscrapers.scrapers.base.extensions.ParseCacheExtension': 500,
+        'edscrapers.scrapers.base.extensions.MemoryWatchdogExtension': 510,
     },
     'SCHEDULER_PRIORITY_QUEUE': 'scrapy.pqueues.DownloaderAwarePriorityQueue',
     # 'REDIRECT_ENABLED': False,
+    # Failed requests are retried in the retry lane, once the crawl has nothing else to do
     'RETRY_ENABLED': False,
+    'RETRY_LANE_ENABLED': True,
+    'RETRY_LANE_MAX_ATTEMPTS': 4, # in total, including the first attempt
+    'RETRY_LANE_BACKOFF': 30, # seconds before the first retry, doubled for every retry
+    'RETRY_LANE_PRIORITY': -100,
+    # This is set by the CLI
+    # 'RETRY_FAILED_ENABLED': False,
+    # This is set by the CLI (i.e. `--http2`)
+    # 'DOWNLOAD_HANDLERS': {'https': 'edscrapers.scrapers.base.handlers.Http2DownloadHandler'},
     'COOKIES_ENABLED': False,
 
     # We have custom logging
@@ -41,8 +71,82 @@ SCRAPY_SETTINGS = {
 
     # This is set by the CLI
     # 'HTTPCACHE_ENABLED': True,
+    # 'PARSE_CACHE_ENABLED': True,
+
+    # Prioritize requests using the dataset yield of previous crawls
+    'YIELD_PRIORITY_ENABLED': True,
+    'YIELD_PRIORITY_SCALE': 100, # priority given to a url prefix where every page leads to datasets
+    'YIELD_PREFIX_DEPTH': 3, # number of path segments used for the most specific url prefixes
+    'YIELD_MIN_PAGES': 5, # pages a prefix needs in a crawl for its yield to be trusted
+    'YIELD_LOOKAHEAD': 2, # page hops within which a page must reach a dataset to be productive
+    'YIELD_PRUNE_RUNS': 3, # crawls without datasets after which a prefix is considered barren
+    # This is set by the CLI
+    # 'YIELD_PRUNE_ENABLED': False,
+
+    # This is set by the CLI (a refresh crawl also sets 'DEPTH_LIMIT')
+    # 'REFRESH_KNOWN_ENABLED': False,
+
+    # Discover pages from the crawlers' 'sitemap_urls' and 'listings' (see `DiscoveryMiddleware`)
+    'DISCOVERY_PRIORITY': 200,
+    'DISCOVERY_FOLLOW_DEPTH': 0, # link levels followed from the discovered pages
+    'DISCOVERY_MAX_LISTING_PAGES': 1000, # per listing
+    # also follow links from the start urls when pages were discovered
+    'DISCOVERY_CRAWL_START_URLS': False,
+    # This is set by the CLI (discovery is opt-in, as the pages which are only
+    # linked to are missed unless DISCOVERY_CRAWL_START_URLS is set)
+    # 'DISCOVERY_ENABLED': False,
+
+    # This is set by the CLI (see `edscrapers.scrapers.base.warc`)
+    # 'WARC_RECORD_PATH': None,
+    # 'WARC_REPLAY_PATH': None,
+
+    # This is set by the CLI (see `edscrapers.scrapers.base.fleet`)
+    # 'FLEET_WORKERS': 1,
+    # 'FLEET_WORKER_INDEX': 0,
+    # 'FLEET_FRONTIER_PATH': None,
+
+    # Keep the memory (RSS) of a crawl within a budget (see `MemoryWatchdogExtension`)
+    'MEMORY_BUDGET_CHECK_INTERVAL': 30, # seconds
+    'MEMORY_BUDGET_TRACE_RATIO': 0.6, # of the budget, from which memory allocations are traced
+    'MEMORY_BUDGET_SPILL_RATIO': 0.8, # of the budget, from which requests are spilled to disk
+    'MEMORY_BUDGET_TOP_CONSUMERS': 10, # lines of code logged as the top memory consumers
+    # This is set by the CLI (0 means no budget)
+    # 'MEMORY_BUDGET_MB': 0,
+    # 'MEMORY_SPILL_DIR': None,
+
+    # This is set by the CLI (drop the duplicate datasets as they
+    # are scraped, see `edscrapers.scrapers.base.dedup`)
+    # 'DEDUP_ENABLED': True,
+
+    # Write the datasets (and graphs) of the item pipelines in a
+    # background thread (see `edscrapers.scrapers.base.writer`)
+    'BACKGROUND_WRITER_ENABLED': True,
+    'BACKGROUND_WRITER_QUEUE_SIZE': 100, # pending writes, from which the crawl waits for the writer
+
+    # Write the datasets to segments (see `edscrapers.scrapers.base.segments`)
+    'SEGMENT_MAX_BYTES': 64 * 1024 * 1024, # from which a new segment is started
+    'SEGMENT_FLUSH_ITEMS': 100, # datasets buffered before they are written to disk
+    'SEGMENT_FLUSH_INTERVAL': 5, # seconds after which the buffered datasets are written anyway
+    # This is set by the CLI ('files' or 'segments')
+    # 'OUTPUT_LAYOUT': 'files',
 
-    'AUTOTHROTTLE_ENABLED': True,
+    # Adapt the delay and concurrency of each host to its latency (replaces AutoThrottle).
+    # 'DOWNLOAD_DELAY' is the delay each host starts with
+    'AUTOTHROTTLE_ENABLED': False,
+    'ADAPTIVE_THROTTLE_ENABLED': True,
+    'ADAPTIVE_THROTTLE_TARGET_LATENCY': 2.0, # seconds, above which a host is considered overloaded
+    'ADAPTIVE_THROTTLE_MIN_DELAY': 0.25, # seconds
+    'ADAPTIVE_THROTTLE_MAX_DELAY': 60.0, # seconds (unless a longer Retry-After is requested)
+    'ADAPTIVE_THROTTLE_MAX_CONCURRENCY': 4, # concurrent requests per host
+    'ADAPTIVE_THROTTLE_DECREASE_FACTOR': 0.5,
+    'ADAPTIVE_THROTTLE_MAX_RETRIES': 3, # for 429 and 503 responses
+    # per host 'target_latency', 'min_delay' and 'max_concurrency'
+    # (usually set in a crawler's 'custom_settings')
+    'ADAPTIVE_THROTTLE_HOSTS': {},
+    'RETRY_HTTP_CODES': RETRY_HTTP_CODES,
+    # don't cache the responses of overloaded hosts, nor any other response
+    # which is retried (a cached error would be returned to every attempt)
+    'HTTPCACHE_IGNORE_HTTP_CODES': RETRY_HTTP_CODES,
     'LOG_LEVEL': 'INFO',
     'DEPTH_LIMIT': 0
 }
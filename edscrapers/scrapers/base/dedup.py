@@ -0,0 +1,115 @@
+""" module contains the persistent store of the datasets scraped so far, by which
+duplicate datasets are dropped as they are scraped (see `DuplicatesPipeline`).
+
+Datasets are keyed as the deduplicate transformer keys them, on their normalized
+source url (without its protocol, 'www.' or 'referrer' parameter) and name. The store
+keeps a fingerprint (the md5 digest) of each key, and the file the dataset was saved as
+(its `saved_as_file`). It is shared by the crawls of all the scrapers and by later runs.
+A dataset is a duplicate when its key already belongs to another file, which is still
+in the output; a dataset scraped again to the same file is not, so it is updated """
+
+import os
+import sqlite3
+import hashlib
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit, parse_qs, urlencode
+
+from edscrapers.scrapers.base import segments
+
+
+def get_dedup_store_path():
+    """ returns the path of the database of the datasets scraped so far """
+
+    return Path(os.getenv('ED_OUTPUT_PATH'), 'scrapy', 'dedup', 'datasets.sqlite')
+
+
+def normalize_url(url):
+    """ returns 'url' normalized as the deduplicate transformer normalizes source urls """
+
+    # strip the 'referrer' query parameter, which may cause duplicate datasets
+    split_url = urlsplit(url)
+    if split_url.query:
+        query = parse_qs(split_url.query)
+        query.pop('referrer', None)
+        url = urlunsplit(split_url._replace(query=urlencode(query, doseq=True)))
+    else:
+        url = urlunsplit(split_url)
+    # strip the protocol and www or www2
+    url = url.replace('https://', '').replace('http://', '')
+    url = url.replace('www2.', '').replace('www.', '')
+    return url.lower()
+
+
+def get_dataset_key(source_url, name):
+    """ returns the key a dataset is deduplicated on """
+
+    return normalize_url(source_url) + '_' + name
+
+
+def output_file_exists(saved_as_file):
+    """ returns whether the dataset saved as 'saved_as_file' (relative
+    to ED_OUTPUT_PATH) is in the output, in either output layout """
+
+    file_path = Path(os.getenv('ED_OUTPUT_PATH'), saved_as_file)
+    return file_path.exists() or segments.has_dataset(file_path)
+
+
+class FingerprintStore():
+    """ class provides access to the store of the datasets scraped so far.
+
+    New datasets are buffered and only written by `flush()` (or `close()`),
+    which is done every 'commit_every' datasets """
+
+    def __init__(self, file_path, commit_every=100):
+        file_path = Path(file_path)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        # the store may be shared by several crawler processes (see `fleet`)
+        self.connection = sqlite3.connect(str(file_path), timeout=60)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS datasets
+                                   (fingerprint BLOB PRIMARY KEY, file TEXT) WITHOUT ROWID''')
+        self.connection.commit()
+        self.commit_every = commit_every
+        self.pending = dict()
+        # the files recorded by this store (which may not be written yet)
+        self.recorded = set()
+
+    def get(self, fingerprint):
+        """ returns the file of the dataset with 'fingerprint', or None """
+
+        if fingerprint in self.pending:
+            return self.pending[fingerprint]
+        row = self.connection.execute('SELECT file FROM datasets WHERE fingerprint = ?',
+                                      (fingerprint,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, fingerprint, saved_as_file):
+        self.pending[fingerprint] = saved_as_file
+        if len(self.pending) >= self.commit_every:
+            self.flush()
+
+    def check(self, source_url, name, saved_as_file):
+        """ records the dataset which is saved as 'saved_as_file' (relative to ED_OUTPUT_PATH).
+        Returns the file of the dataset it duplicates, or None if it is not a duplicate """
+
+        fingerprint = hashlib.md5(get_dataset_key(source_url, name).encode('utf-8')).digest()
+        known_file = self.get(fingerprint)
+        if known_file == saved_as_file:
+            return None
+        if known_file is not None and\
+            (known_file in self.recorded or output_file_exists(known_file)):
+            return known_file
+
+        # the dataset is new, or the dataset it duplicated is no longer in the output
+        self.set(fingerprint, saved_as_file)
+        self.recorded.add(saved_as_file)
+        return None
+
+    def flush(self):
+        self.connection.executemany('INSERT OR REPLACE INTO datasets (fingerprint, file) VALUES (?, ?)',
+                                    self.pending.items())
+        self.connection.commit()
+        self.pending = dict()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
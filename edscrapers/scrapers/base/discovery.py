@@ -0,0 +1,86 @@
+""" module contains the helpers used to discover the pages of a crawl from
+sitemaps and paginated listings (see `DiscoveryMiddleware`), rather than
+by following every link from the start urls.
+
+The 'lastmod' of each page discovered from a sitemap is recorded in a
+per-crawl database, so pages whose 'lastmod' has not changed since they
+were last crawled can be skipped """
+
+import os
+import gzip
+import sqlite3
+from pathlib import Path
+
+from scrapy.utils.sitemap import Sitemap, sitemap_urls_from_robots
+
+
+def get_lastmod_path(name):
+    """ returns the path of the lastmod database for the 'name' crawl """
+
+    return Path(os.getenv('ED_OUTPUT_PATH'), 'scrapy', 'discovery', f'{name}.sqlite')
+
+
+class LastmodStore():
+    """ class provides access to the 'lastmod' recorded for
+    each page crawled after being discovered from a sitemap.
+
+    Updates are buffered and only written by `flush()` (or `close()`) """
+
+    def __init__(self, file_path):
+        file_path = Path(file_path)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(file_path), timeout=60)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS pages
+                                   (url TEXT PRIMARY KEY, lastmod TEXT)''')
+        self.connection.commit()
+        self.pending = dict()
+
+    def get(self, url):
+        """ returns the 'lastmod' recorded for 'url' or None """
+
+        if url in self.pending:
+            return self.pending[url]
+        row = self.connection.execute('SELECT lastmod FROM pages WHERE url = ?',
+                                      (url,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, url, lastmod):
+        self.pending[url] = lastmod
+
+    def flush(self):
+        self.connection.executemany('INSERT OR REPLACE INTO pages (url, lastmod) VALUES (?, ?)',
+                                    self.pending.items())
+        self.connection.commit()
+        self.pending = dict()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+def get_sitemap_entries(response):
+    """ returns a (type, entries) tuple for a sitemap (or robots.txt) 'response'.
+
+    'type' is 'sitemapindex' (the entries are sitemaps) or 'urlset' (the entries
+    are pages) and each entry is a dict with a 'loc' and (maybe) a 'lastmod'.
+    A robots.txt is handled as a sitemap index of the sitemaps it lists.
+    Returns (None, []) if 'response' is not a sitemap """
+
+    if response.url.endswith('/robots.txt'):
+        return 'sitemapindex', [{'loc': url} for url in
+                                sitemap_urls_from_robots(response.text, base_url=response.url)]
+
+    body = response.body
+    if body[:2] == b'\x1f\x8b': # a gzipped sitemap (e.g. sitemap.xml.gz)
+        try:
+            body = gzip.decompress(body)
+        except (OSError, EOFError):
+            return None, []
+
+    try:
+        sitemap = Sitemap(body)
+    except Exception:
+        return None, []
+    if sitemap.type not in ('sitemapindex', 'urlset'):
+        return None, []
+    return sitemap.type, [entry for entry in sitemap if entry.get('loc')]
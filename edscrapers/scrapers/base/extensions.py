@@ -0,0 +1,224 @@
+import os
+import gc
+import resource
+import tracemalloc
+from pathlib import Path
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from edscrapers.cli import logger
+from edscrapers.scrapers.base.cache import ParseCache
+from edscrapers.scrapers.base.graph import GraphWrapper
+from edscrapers.scrapers.base.shared import get_consumers
+
+
+class ParseCacheExtension():
+    """ extension opens the parse-result cache (see `edscrapers.scrapers.base.cache`)
+    when a spider starts and closes it when the spider finishes.
+
+    The extension is enabled by the PARSE_CACHE_ENABLED setting. The cache
+    is stored in the PARSE_CACHE_DIR setting or, by default,
+    in '<ED_OUTPUT_PATH>/scrapy/parsecache' """
+
+    def __init__(self, cache_dir, stats):
+        self.cache_dir = cache_dir
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('PARSE_CACHE_ENABLED'):
+            raise NotConfigured
+
+        cache_dir = crawler.settings.get('PARSE_CACHE_DIR') or\
+                    Path(os.getenv('ED_OUTPUT_PATH'), 'scrapy', 'parsecache')
+
+        extension = cls(cache_dir, crawler.stats)
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        ParseCache.open(file_dir_path=self.cache_dir)
+
+    def spider_closed(self, spider):
+        self.stats.set_value('parse_cache/hit', ParseCache.hits, spider=spider)
+        self.stats.set_value('parse_cache/miss', ParseCache.misses, spider=spider)
+        logger.info(f'Parse cache: {ParseCache.hits} hits, {ParseCache.misses} misses')
+        ParseCache.close()
+
+
+class MemoryWatchdogExtension():
+    """ extension keeps the memory (RSS) of a crawl within the MEMORY_BUDGET_MB setting.
+
+    The RSS is checked every MEMORY_BUDGET_CHECK_INTERVAL seconds and, as it grows:
+
+    - at MEMORY_BUDGET_TRACE_RATIO of the budget, tracing the memory allocations starts
+    - at MEMORY_BUDGET_SPILL_RATIO of the budget, the memory is spilled: the requests
+      waiting in the (memory) queue of the scheduler are moved to a disk queue (as
+      with JOBDIR), the graphs are checkpointed and the top memory consumers are logged
+    - over the budget, the crawl is closed ('memory_budget_exceeded'), as a last resort
+
+    The requests are spilled to the job directory of the crawl (JOBDIR, MEMORY_SPILL_DIR or,
+    by default, the directory used by `eds scrape --resume`), so a crawl closed by the
+    watchdog is resumed by running it again with --resume (and the same budget).
+    The graphs are restored from their checkpoints when the crawl is resumed
+    (a crawl which is not resumed discards them) """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.budget = settings.getint('MEMORY_BUDGET_MB')
+        self.interval = settings.getfloat('MEMORY_BUDGET_CHECK_INTERVAL')
+        self.trace_ratio = settings.getfloat('MEMORY_BUDGET_TRACE_RATIO')
+        self.spill_ratio = settings.getfloat('MEMORY_BUDGET_SPILL_RATIO')
+        self.top_consumers = settings.getint('MEMORY_BUDGET_TOP_CONSUMERS')
+
+        self.job_dir = Path(settings.get('JOBDIR') or settings.get('MEMORY_SPILL_DIR') or\
+                            Path(os.getenv('ED_OUTPUT_PATH'), 'scrapy', 'jobs'))
+        self.resume = bool(settings.get('JOBDIR')) # the graphs are only restored on --resume
+
+        self.spilled = False
+        self.exceeded = False
+        self.max_rss = 0
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if crawler.settings.getint('MEMORY_BUDGET_MB') <= 0:
+            raise NotConfigured
+
+        extension = cls(crawler)
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        for consumer in get_consumers(spider):
+            checkpoint_path = Path(self.job_dir, 'graphs', f'{consumer.name}.pickle')
+            if not self.resume:
+                # a fresh crawl doesn't carry on from the graph of a previous one
+                if checkpoint_path.exists():
+                    checkpoint_path.unlink()
+                continue
+            # carry on from the graphs of the crawl the watchdog closed, if any
+            graph_wrapper = getattr(consumer, 'graph_wrapper', GraphWrapper)
+            if graph_wrapper.load_graph_checkpoint(file_dir_path=checkpoint_path.parent,
+                                                   file_stem_name=consumer.name):
+                logger.info(f'Resuming the graph of {consumer.name} from its checkpoint')
+
+        self.task = task.LoopingCall(self.check, spider)
+        self.task.start(self.interval, now=True)
+
+    def spider_closed(self, spider, reason):
+        if self.task and self.task.running:
+            self.task.stop()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+        self.stats.set_value('memory_watchdog/max_rss_mb', self.max_rss, spider=spider)
+        for consumer in get_consumers(spider):
+            checkpoint_path = Path(self.job_dir, 'graphs', f'{consumer.name}.pickle')
+            if self.exceeded:
+                getattr(consumer, 'graph_wrapper', GraphWrapper).\
+                    write_graph_checkpoint(file_dir_path=checkpoint_path.parent,
+                                           file_stem_name=consumer.name)
+            elif checkpoint_path.exists():
+                # the crawl is complete, so there is nothing left to resume
+                checkpoint_path.unlink()
+
+        if self.exceeded:
+            logger.warning(f'The crawl was closed to stay within its memory budget '\
+                           f'({self.budget} MB). Resume it by running the same '\
+                           '`eds scrape` command with --resume')
+
+    def check(self, spider):
+        """ checks the RSS of the crawl against the budget """
+
+        rss = get_rss_mb()
+        self.max_rss = max(self.max_rss, rss)
+        if self.exceeded:
+            return
+
+        if rss >= self.budget * self.trace_ratio and not tracemalloc.is_tracing():
+            logger.info(f'Memory at {rss} MB (budget is {self.budget} MB), '\
+                        'tracing the memory allocations')
+            tracemalloc.start()
+
+        if rss >= self.budget * self.spill_ratio and not self.spilled:
+            logger.warning(f'Memory at {rss} MB (budget is {self.budget} MB), spilling to disk')
+            self.spill(spider)
+            self.log_top_consumers()
+            gc.collect()
+            rss = get_rss_mb()
+
+        if rss >= self.budget:
+            logger.error(f'Memory at {rss} MB, over the budget of {self.budget} MB. '\
+                         'Closing the crawl')
+            self.log_top_consumers()
+            self.exceeded = True
+            self.stats.set_value('memory_watchdog/exceeded_rss_mb', rss, spider=spider)
+            self.crawler.engine.close_spider(spider, 'memory_budget_exceeded')
+
+    def spill(self, spider):
+        """ moves the requests waiting in the memory queue of the scheduler to a disk
+        queue (which then gets the new requests too), records the requests seen so far
+        in the job directory and checkpoints the graphs """
+
+        self.spilled = True
+        scheduler = self.crawler.engine.slot.scheduler
+        if scheduler.dqs is None:
+            self.job_dir.mkdir(parents=True, exist_ok=True)
+            scheduler.dqdir = scheduler._dqdir(str(self.job_dir))
+            scheduler.dqs = scheduler._dq()
+
+            spilled, unserializable = 0, []
+            request = scheduler.mqs.pop()
+            while request is not None:
+                if scheduler._dqpush(request):
+                    spilled += 1
+                else:
+                    unserializable.append(request)
+                request = scheduler.mqs.pop()
+            for request in unserializable:
+                scheduler._mqpush(request)
+
+            self.stats.set_value('memory_watchdog/spilled_requests', spilled, spider=spider)
+            logger.info(f'Moved {spilled} requests to the disk queue in {scheduler.dqdir}')
+
+        dupefilter = scheduler.df
+        if getattr(dupefilter, 'file', None) is None and hasattr(dupefilter, 'fingerprints'):
+            # as the RFPDupeFilter does with JOBDIR, so a resumed crawl skips these requests
+            dupefilter.file = open(Path(self.job_dir, 'requests.seen'), 'a+')
+            dupefilter.file.writelines(f'{fingerprint}\n' for fingerprint in dupefilter.fingerprints)
+            dupefilter.file.flush()
+
+        for consumer in get_consumers(spider):
+            getattr(consumer, 'graph_wrapper', GraphWrapper).\
+                write_graph_checkpoint(file_dir_path=Path(self.job_dir, 'graphs'),
+                                       file_stem_name=consumer.name)
+
+    def log_top_consumers(self):
+        """ logs the lines of code which allocated the most memory (since tracing started) """
+
+        if not tracemalloc.is_tracing():
+            return
+        statistics = tracemalloc.take_snapshot().statistics('lineno')
+        logger.warning(f'Top {self.top_consumers} memory consumers (since tracing started):')
+        for statistic in statistics[:self.top_consumers]:
+            logger.warning(f'\t{statistic}')
+
+
+def get_rss_mb():
+    """ returns the resident memory (RSS) of this process, in MB """
+
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize() // (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # the peak RSS (in kilobytes on linux, in bytes on macOS)
+        # is the best there is without procfs
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
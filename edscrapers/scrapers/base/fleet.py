@@ -0,0 +1,207 @@
+""" module contains the classes and functions used to run a crawl
+as a fleet of worker processes.
+
+The url space of the crawl is sharded (by host and first path segment) across
+the workers. Requests discovered by a worker for another worker's shard are handed
+over through a shared frontier (a SQLite database), which also acts as the
+fleet-wide seen-set. Each worker writes its own graph fragment, and the fragments
+are merged into the crawl graph once all workers are done """
+
+import os
+import time
+import sqlite3
+import hashlib
+import multiprocessing as mp
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from w3lib.url import canonicalize_url
+from scrapy.crawler import CrawlerProcess
+
+from edscrapers.cli import logger
+from edscrapers.scrapers.base.graph import GraphWrapper
+from edscrapers.scrapers.base.shared import load_crawler
+
+
+def get_shard(url, workers):
+    """ returns the index of the worker (out of 'workers') whose shard contains 'url' """
+
+    split_url = urlsplit(url)
+    path_segments = [segment for segment in split_url.path.split('/') if segment]
+    shard_key = f"{split_url.netloc.lower()}/{path_segments[0] if path_segments else ''}"
+    return int(hashlib.md5(shard_key.encode('utf-8')).hexdigest(), 16) % workers
+
+
+def get_frontier_path(name):
+    """ returns the path of the shared frontier database for the 'name' crawl """
+
+    return Path(os.getenv('ED_OUTPUT_PATH'), 'scrapy', 'fleet', f'{name}.frontier.sqlite')
+
+
+class SharedFrontier():
+    """ class provides access to the frontier shared by the workers of a fleet.
+
+    The 'requests' table records every url seen by the fleet, along with the
+    shard it belongs to and its status:
+    - 'local': the url was scheduled by the worker that discovered it
+    - 'pending': the url was handed over to another worker, which has not claimed it yet
+    - 'claimed': the url was claimed (and scheduled) by the worker of its shard
+
+    The 'workers' table records the status ('busy', 'idle' or 'failed') of each worker """
+
+    def __init__(self, file_path, worker_index=None):
+        self.worker_index = worker_index
+        # autocommit mode; every statement is its own transaction
+        self.connection = sqlite3.connect(str(file_path), timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+
+    @classmethod
+    def create(cls, file_path, workers, resume=False):
+        """ create the frontier database for a fleet of 'workers'.
+        Unless 'resume' is True, any previous frontier is discarded """
+
+        file_path = Path(file_path)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        if file_path.exists() and not resume:
+            file_path.unlink()
+
+        frontier = cls(file_path)
+        frontier.connection.execute('''CREATE TABLE IF NOT EXISTS requests
+                                       (url TEXT PRIMARY KEY, shard INTEGER, referer TEXT,
+                                        depth INTEGER, rule INTEGER, status TEXT)''')
+        frontier.connection.execute('''CREATE INDEX IF NOT EXISTS requests_shard_status
+                                       ON requests (shard, status)''')
+        frontier.connection.execute('''CREATE TABLE IF NOT EXISTS workers
+                                       (worker_index INTEGER PRIMARY KEY, status TEXT)''')
+        frontier.connection.execute('DELETE FROM workers')
+        frontier.connection.executemany('INSERT INTO workers (worker_index, status) VALUES (?, ?)',
+                                        [(index, 'busy') for index in range(workers)])
+        return frontier
+
+    def add(self, url, shard, referer=None, depth=0, rule=0, status='local'):
+        """ add 'url' to the frontier.
+        Returns False if the url had already been seen by the fleet """
+
+        cursor = self.connection.execute('''INSERT OR IGNORE INTO requests
+                                            (url, shard, referer, depth, rule, status)
+                                            VALUES (?, ?, ?, ?, ?, ?)''',
+                                         (canonicalize_url(url), shard, referer,
+                                          depth, rule, status))
+        return cursor.rowcount > 0
+
+    def claim(self, limit=1000):
+        """ claims (at most 'limit') pending urls of this worker's shard.
+        If any, the worker is flagged as busy in the same transaction, so no other
+        worker can see the fleet as finished while the urls are being scheduled.
+        Returns a list of (url, referer, depth, rule) tuples """
+
+        self.connection.execute('BEGIN IMMEDIATE')
+        rows = self.connection.execute('''SELECT url, referer, depth, rule FROM requests
+                                          WHERE shard = ? AND status = 'pending' LIMIT ?''',
+                                       (self.worker_index, limit)).fetchall()
+        if rows:
+            self.connection.executemany("UPDATE requests SET status = 'claimed' WHERE url = ?",
+                                        [(row[0],) for row in rows])
+            self.set_worker_status('busy')
+        self.connection.execute('COMMIT')
+        return rows
+
+    def set_worker_status(self, status, worker_index=None):
+        worker_index = self.worker_index if worker_index is None else worker_index
+        self.connection.execute('UPDATE workers SET status = ? WHERE worker_index = ?',
+                                (status, worker_index))
+
+    def is_finished(self):
+        """ checks if the fleet is done, i.e. no worker is busy and
+        there are no pending urls for a worker that can still claim them """
+
+        # both counts are read from the same snapshot of the database
+        self.connection.execute('BEGIN')
+        busy_workers = self.connection.execute('''SELECT COUNT(*) FROM workers
+                                                  WHERE status = 'busy' ''').fetchone()[0]
+        pending_requests = self.connection.execute('''SELECT COUNT(*) FROM requests
+                                                      WHERE status = 'pending' AND shard IN
+                                                      (SELECT worker_index FROM workers
+                                                       WHERE status != 'failed')''').fetchone()[0]
+        self.connection.execute('COMMIT')
+        return busy_workers == 0 and pending_requests == 0
+
+    def close(self):
+        self.connection.close()
+
+
+def run_worker(name, settings, worker_index, quiet, verbosity):
+    """ runs the crawl for the shard of the 'worker_index' worker.
+    This is the entry point of each worker process """
+
+    # the logger has to be setup again in the (spawned) worker process
+    from edscrapers.cli import setup_logger
+    setup_logger(quiet, verbosity, 'scrapers', f'{name}.worker-{worker_index}')
+
+    settings = dict(settings)
+    settings['FLEET_WORKER_INDEX'] = worker_index
+    if settings.get('JOBDIR'):
+        # each worker keeps its own scheduler state
+        settings['JOBDIR'] = os.path.join(settings['JOBDIR'], f'{name}.worker-{worker_index}')
+    elif settings.get('MEMORY_BUDGET_MB'):
+        # where the worker spills its requests (see `MemoryWatchdogExtension`),
+        # i.e. the JOBDIR it gets when the fleet is resumed
+        settings['MEMORY_SPILL_DIR'] = os.path.join(os.getenv('ED_OUTPUT_PATH'), 'scrapy', 'jobs',
+                                                    f'{name}.worker-{worker_index}')
+
+    crawler = load_crawler(name)
+    process = CrawlerProcess(settings)
+    process.crawl(crawler)
+    process.start()
+
+
+def run_fleet(name, settings, workers, quiet=False, verbosity=0):
+    """ runs the 'name' crawl with a fleet of 'workers' worker processes and
+    merges the graph fragments they produce into the crawl graph """
+
+    frontier_path = get_frontier_path(name)
+    frontier = SharedFrontier.create(frontier_path, workers,
+                                     resume=bool(settings.get('JOBDIR')))
+
+    # discard the graph fragments of any previous fleet
+    # (a shared crawl has the graph fragments of each of its scrapers)
+    graph_names = [graph_name.strip() for graph_name in name.split(',') if graph_name.strip()]
+    for graph_name in graph_names:
+        fragment_dir_path = Path(os.getenv('ED_OUTPUT_PATH'), 'graphs', graph_name, 'fragments')
+        for fragment_path in fragment_dir_path.glob(f'{graph_name}.worker-*.pickle'):
+            fragment_path.unlink()
+
+    settings = dict(settings)
+    settings['FLEET_WORKERS'] = workers
+    settings['FLEET_FRONTIER_PATH'] = str(frontier_path)
+
+    # spawn (rather than fork) the workers, so each gets a fresh twisted reactor
+    context = mp.get_context('spawn')
+    processes = [context.Process(target=run_worker,
+                                 args=(name, settings, worker_index, quiet, verbosity))
+                 for worker_index in range(workers)]
+    for process in processes:
+        process.start()
+    logger.info(f'Started {workers} workers for {name}')
+
+    running = dict(enumerate(processes))
+    while running:
+        for worker_index, process in list(running.items()):
+            if process.is_alive():
+                continue
+            del running[worker_index]
+            if process.exitcode != 0:
+                # let the other workers finish without waiting for this worker's shard
+                frontier.set_worker_status('failed', worker_index=worker_index)
+                logger.error(f'Worker {worker_index} of {name} failed (exit code {process.exitcode})')
+        time.sleep(1)
+    frontier.close()
+
+    # merge the graph fragments into the crawl graph
+    for graph_name in graph_names:
+        graph_dir_path = Path(os.getenv('ED_OUTPUT_PATH'), 'graphs', graph_name)
+        GraphWrapper.load_graph_fragments(file_dir_path=Path(graph_dir_path, 'fragments'),
+                                          file_stem_name=graph_name)
+        GraphWrapper.write_graph(file_dir_path=graph_dir_path, file_stem_name=graph_name)
+        GraphWrapper.create_graph_page_legend(file_dir_path=graph_dir_path, file_stem_name=graph_name)
+    logger.success(f'Merged the graph fragments of {workers} workers for {name}')
@@ -4,6 +4,7 @@ the graphs used by edscrapers """
 from pathlib import Path
 import multiprocessing as mp
 from datetime import datetime
+from urllib.parse import urlsplit
 
 import igraph
 import pandas as pd
@@ -37,6 +38,20 @@ class GraphWrapper():
         with cls.graph_lock:
             return cls.graph
 
+    @classmethod
+    def create_wrapper(cls):
+        """ returns a new GraphWrapper class which provides its own singleton graph
+        object (and lock), distinct from the one provided by this class.
+        This is used when several scrapers share the same process (see `shared`) """
+
+        graph = igraph.Graph(directed=True)
+        graph_lock = mp.Lock()
+        graph.graph_lock = graph_lock
+        with graph.graph_lock:
+            graph.add_vertex(name='base_vertex', label='START', title='START POINT', color='orange', shape=1)
+
+        return type(cls.__name__, (cls,), {'graph': graph, 'graph_lock': graph_lock})
+
     @classmethod
     def write_graph(cls, file_dir_path, file_stem_name,
                     graph_width=2800, graph_height=2800,
@@ -112,3 +127,300 @@ class GraphWrapper():
             # attach the Lock object to the newly loaded graph object
             cls.graph.graph_lock = cls.graph_lock
 
+    @classmethod
+    def write_graph_fragment(cls, file_dir_path, file_stem_name, worker_index):
+        """ write the graph built by the 'worker_index' worker of a
+        crawl fleet to a fragment file (see `load_graph_fragments()`) """
+
+        file_dir_path = Path(file_dir_path)
+        file_dir_path.mkdir(parents=True, exist_ok=True)
+
+        with cls.graph.graph_lock:
+            # destroy access to the lock object, so it's not pickled
+            del cls.graph.graph_lock
+            cls.graph.write_pickle(fname=Path(file_dir_path,
+            f'{file_stem_name}.worker-{worker_index}.pickle'),
+            version=4)
+            #reinstate the previously destroyed process lock since pickling is complete
+            cls.graph.graph_lock = cls.graph_lock
+
+    @classmethod
+    def write_graph_checkpoint(cls, file_dir_path, file_stem_name):
+        """ write the graph built so far to a checkpoint file, from which
+        a resumed crawl carries on (see `load_graph_checkpoint()`) """
+
+        file_dir_path = Path(file_dir_path)
+        file_dir_path.mkdir(parents=True, exist_ok=True)
+
+        with cls.graph.graph_lock:
+            # destroy access to the lock object, so it's not pickled
+            del cls.graph.graph_lock
+            cls.graph.write_pickle(fname=Path(file_dir_path, f'{file_stem_name}.pickle'),
+                                   version=4)
+            #reinstate the previously destroyed process lock since pickling is complete
+            cls.graph.graph_lock = cls.graph_lock
+
+    @classmethod
+    def load_graph_checkpoint(cls, file_dir_path, file_stem_name):
+        """ copies the graph of the checkpoint file written by `write_graph_checkpoint()`
+        into the singleton Graph object for this class. The checkpoint file is removed.
+        Returns True if there was a checkpoint """
+
+        file_path = Path(file_dir_path, f'{file_stem_name}.pickle')
+        if not file_path.exists():
+            return False
+
+        checkpoint_graph = igraph.Graph.Read_Pickle(fname=file_path)
+        with cls.graph_lock:
+            copy_graph(checkpoint_graph, cls.graph)
+        file_path.unlink()
+        return True
+
+    @classmethod
+    def load_graph_fragments(cls, file_dir_path, file_stem_name):
+        """ loads the graph fragments written by the workers of a crawl fleet,
+        and merges them into the singleton Graph object for this class """
+
+        fragment_paths = sorted(Path(file_dir_path).glob(f'{file_stem_name}.worker-*.pickle'),
+                                key=lambda path: int(path.stem.rsplit('-', 1)[-1]))
+        merged_graph = merge_graphs([igraph.Graph.Read_Pickle(fname=path)
+                                     for path in fragment_paths])
+
+        with cls.graph_lock:
+            del cls.graph.graph_lock
+            cls.graph = merged_graph
+            cls.graph.graph_lock = cls.graph_lock
+
+
+def merge_graphs(graphs):
+    """ merges 'graphs' (e.g. the fragments written by the workers of
+    a crawl fleet) into a new graph.
+
+    Vertices are identified by name. A placeholder vertex (i.e. a page crawled by
+    another worker) takes the attributes of the crawled page, and the datasets
+    of a page are combined across graphs. The vertices (and edges) of the merged
+    graph are sorted by name, so the result does not depend on the order in which
+    the workers crawled pages. Page and dataset labels are recomputed """
+
+    vertices = dict()
+    edges = []
+    for graph in graphs:
+        attribute_names = graph.vs.attributes()
+        for vertex in graph.vs:
+            attributes = {attribute_name: vertex[attribute_name]
+                          for attribute_name in attribute_names
+                          if vertex[attribute_name] is not None}
+            merged_attributes = vertices.get(vertex['name'])
+            if merged_attributes is None or\
+               (merged_attributes.get('is_placeholder') and not attributes.get('is_placeholder')):
+                datasets = (merged_attributes or dict()).get('datasets')
+                vertices[vertex['name']] = merged_attributes = attributes
+                if datasets:
+                    merged_attributes['datasets'] = set(datasets) |\
+                                                    set(attributes.get('datasets') or ())
+                continue
+            for attribute_name, value in attributes.items():
+                if attribute_name == 'datasets':
+                    merged_attributes['datasets'] = set(merged_attributes.get('datasets') or ()) |\
+                                                    set(value)
+                elif attribute_name == 'is_dataset_page':
+                    merged_attributes['is_dataset_page'] = True
+                else:
+                    merged_attributes.setdefault(attribute_name, value)
+        edges.extend((graph.vs[source]['name'], graph.vs[target]['name'])
+                     for source, target in graph.get_edgelist())
+
+    # the start point is always the first vertex
+    names = sorted(vertices.keys(), key=lambda name: (name != 'base_vertex', name))
+    indices = {name: index for index, name in enumerate(names)}
+    attribute_names = sorted({attribute_name for attributes in vertices.values()
+                              for attribute_name in attributes} - {'name', 'is_placeholder'})
+
+    merged_graph = igraph.Graph(directed=True)
+    merged_graph.add_vertices(len(names))
+    merged_graph.vs['name'] = names
+    for attribute_name in attribute_names:
+        merged_graph.vs[attribute_name] = [vertices[name].get(attribute_name) for name in names]
+    for vertex in merged_graph.vs.select(name_ne='base_vertex'):
+        vertex['label'] = f"D{vertex.index}" if vertices[vertex['name']].get('is_dataset')\
+                          else f"P{vertex.index}"
+    merged_graph.add_edges(sorted((indices[source], indices[target])
+                                  for source, target in edges))
+
+    return merged_graph
+
+
+def load_graph_history(file_dir_path, file_stem_name, runs=1):
+    """ loads (at most) the 'runs' most recent graphs written by
+    `GraphWrapper.write_graph()` for 'file_stem_name'.
+
+    The dated graphs are used when available,
+    otherwise the general (i.e. latest) graph is used.
+    Returns a list of graphs, most recent first """
+
+    file_dir_path = Path(file_dir_path)
+    # the dated directories are named YYYY-MM-DD, so they sort chronologically
+    dated_graph_paths = sorted(file_dir_path.glob(f'*/*.{file_stem_name}.pickle'),
+                               key=lambda path: path.name, reverse=True)
+    if not dated_graph_paths and Path(file_dir_path, f'{file_stem_name}.pickle').exists():
+        dated_graph_paths = [Path(file_dir_path, f'{file_stem_name}.pickle')]
+
+    return [igraph.Graph.Read_Pickle(fname=path) for path in dated_graph_paths[:runs]]
+
+
+def get_url_prefix(url, depth):
+    """ returns the url prefix (i.e. host plus the first 'depth' path segments) for 'url' """
+
+    split_url = urlsplit(url)
+    path_segments = [segment for segment in split_url.path.split('/') if segment]
+    # the last segment of the path is a page, not a 'directory'
+    path_segments = path_segments[:-1] if not split_url.path.endswith('/') else path_segments
+    return '/'.join([split_url.netloc.lower()] + path_segments[:depth])
+
+
+def get_url_prefix_yields(graph, prefix_depth=3, lookahead=2):
+    """ computes the dataset yield of the url prefixes found in 'graph'.
+
+    A page is considered 'productive' if a dataset vertex can be reached from it
+    within 'lookahead' page hops (a dataset page itself is 0 hops away).
+    Prefixes are computed at every depth from 0 to 'prefix_depth'.
+
+    Returns a dict mapping each url prefix to a dict
+    with the number of 'pages' and 'productive' pages for the prefix """
+
+    attributes = graph.vs.attributes()
+    if 'is_dataset' not in attributes:
+        return dict()
+
+    # distance (in page hops) from each vertex to the nearest dataset page
+    distances = dict()
+    frontier = [vertex.index for vertex in graph.vs.select(is_dataset_page_eq=True)]
+    for index in frontier:
+        distances[index] = 0
+    predecessors = graph.get_adjlist(mode='in')
+    for hop in range(1, lookahead + 1):
+        next_frontier = []
+        for index in frontier:
+            for parent_index in predecessors[index]:
+                if parent_index not in distances:
+                    distances[parent_index] = hop
+                    next_frontier.append(parent_index)
+        frontier = next_frontier
+
+    prefix_yields = dict()
+    for vertex in graph.vs.select(is_dataset_eq=None, name_ne='base_vertex'):
+        for depth in range(0, prefix_depth + 1):
+            prefix_yield = prefix_yields.setdefault(get_url_prefix(vertex['name'], depth),
+                                                    {'pages': 0, 'productive': 0})
+            prefix_yield['pages'] += 1
+            if vertex.index in distances:
+                prefix_yield['productive'] += 1
+
+    return prefix_yields
+
+
+def get_dataset_page_referers(graph):
+    """ returns a dict mapping the url of each dataset page
+    in 'graph' to the url of the page it was reached from.
+    Dataset pages which were reached from a start url are mapped to None """
+
+    if 'is_dataset_page' not in graph.vs.attributes():
+        return dict()
+
+    dataset_page_referers = dict()
+    for vertex in graph.vs.select(is_dataset_page_eq=True):
+        referer = None
+        for parent_vertex in vertex.predecessors():
+            if parent_vertex['name'] != 'base_vertex':
+                referer = parent_vertex['name']
+                break
+        dataset_page_referers[vertex['name']] = referer
+    return dataset_page_referers
+
+
+def copy_page_ancestry(source_graph, target_graph, page_url):
+    """ copies the chain of pages that led to 'page_url' (i.e. the page itself,
+    its referer, the referer's referer etc. up to the start point) from
+    'source_graph' to 'target_graph'.
+
+    Pages and links already in 'target_graph' are not duplicated.
+    The caller MUST hold the lock of 'target_graph' """
+
+    try:
+        vertex = source_graph.vs.find(name=page_url)
+    except ValueError:
+        return
+
+    # collect the chain of pages, from 'page_url' up to the start point
+    chain = []
+    while vertex is not None and vertex not in chain:
+        chain.append(vertex)
+        vertex = vertex.predecessors()[0] if vertex.predecessors() else None
+
+    for vertex in chain:
+        try:
+            target_graph.vs.find(name=vertex['name'])
+        except ValueError:
+            target_vertex = target_graph.add_vertex(name=vertex['name'], color='pink', shape=1)
+            target_vertex['label'] = f"P{target_vertex.index}"
+            target_vertex['title'] = vertex['title']
+
+    for vertex, parent_vertex in zip(chain, chain[1:]):
+        if not target_graph.are_connected(parent_vertex['name'], vertex['name']):
+            target_graph.add_edge(source=parent_vertex['name'], target=vertex['name'])
+
+
+def copy_page(source_graph, target_graph, page_url):
+    """ copies the page 'page_url', the chain of pages that led to it
+    (see `copy_page_ancestry()`) and the datasets found on it from
+    'source_graph' to 'target_graph'. This is used for pages which were
+    not crawled again, because they had not changed since the previous crawl.
+    The caller MUST hold the lock of 'target_graph' """
+
+    copy_page_ancestry(source_graph, target_graph, page_url)
+    try:
+        vertex = source_graph.vs.find(name=page_url)
+    except ValueError:
+        return
+    if 'is_dataset_page' not in source_graph.vs.attributes() or not vertex['is_dataset_page']:
+        return
+
+    target_vertex = target_graph.vs.find(name=page_url)
+    target_vertex['is_dataset_page'] = True
+    target_vertex['datasets'] = set(vertex['datasets'] or ())
+    for dataset_vertex in vertex.successors():
+        if not dataset_vertex['is_dataset']:
+            continue
+        try:
+            target_graph.vs.find(name=dataset_vertex['name'])
+        except ValueError:
+            target_dataset_vertex = target_graph.add_vertex(name=dataset_vertex['name'],
+                                                            color='blue', shape=1, is_dataset=True,
+                                                            title=dataset_vertex['title'],
+                                                            dataset_url=dataset_vertex['dataset_url'])
+            target_dataset_vertex['label'] = f"D{target_dataset_vertex.index}"
+            target_graph.add_edge(source=page_url, target=dataset_vertex['name'])
+
+def copy_graph(source_graph, target_graph):
+    """ copies the vertices (with their attributes) and edges of 'source_graph'
+    which are not already in 'target_graph' to 'target_graph'.
+    The caller MUST hold the lock of 'target_graph' """
+
+    target_names = set(target_graph.vs['name'])
+    attribute_names = source_graph.vs.attributes()
+    for vertex in source_graph.vs:
+        if vertex['name'] in target_names:
+            continue
+        attributes = {attribute_name: vertex[attribute_name]
+                      for attribute_name in attribute_names
+                      if vertex[attribute_name] is not None}
+        if isinstance(attributes.get('datasets'), set):
+            attributes['datasets'] = set(attributes['datasets'])
+        target_graph.add_vertex(**attributes)
+
+    source_names = source_graph.vs['name']
+    target_edges = {(target_graph.vs[source]['name'], target_graph.vs[target]['name'])
+                    for source, target in target_graph.get_edgelist()}
+    target_graph.add_edges([(source_names[source], source_names[target])
+                            for source, target in source_graph.get_edgelist()
+                            if (source_names[source], source_names[target]) not in target_edges])
@@ -0,0 +1,162 @@
+""" module contains the download handlers used by edscrapers """
+
+from OpenSSL import SSL
+from twisted.internet import defer
+from twisted.web.client import ResponseFailed
+from scrapy.http import Response
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+
+from edscrapers.cli import logger
+from edscrapers.scrapers.base import helpers
+from edscrapers.scrapers.base.warc import open_archive
+
+try:
+    from h2.exceptions import H2Error
+    from scrapy.core.http2.stream import InactiveStreamClosed
+    from scrapy.core.downloader.handlers.http2 import H2DownloadHandler
+except ImportError:
+    # HTTP/2 downloads need Scrapy >= 2.5 and the 'h2' package
+    H2DownloadHandler = None
+
+
+class Http2DownloadHandler():
+    """ download handler for https requests, which uses HTTP/2 (i.e. a single
+    connection per host, multiplexing all the requests to the host).
+
+    Hosts which do not negotiate HTTP/2 are downloaded from with HTTP/1.1 for
+    the rest of the crawl, as are requests through a proxy (not supported by
+    the HTTP/2 handler). If HTTP/2 is not available at all, the handler logs a
+    warning and behaves as the default (HTTP/1.1) https handler """
+
+    def __init__(self, settings, crawler=None):
+        self.crawler = crawler
+        self.http11_handler = HTTP11DownloadHandler.from_crawler(crawler)
+        self.h2_handler = None
+        if H2DownloadHandler is None:
+            logger.warning('HTTP/2 is not available (it needs Scrapy >= 2.5 and the h2 package), '\
+                           'falling back to HTTP/1.1')
+        else:
+            self.h2_handler = H2DownloadHandler.from_crawler(crawler)
+        # the hosts which did not negotiate HTTP/2
+        self.http11_hosts = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler)
+
+    def download_request(self, request, spider):
+        host = urlparse_cached(request).netloc
+        if self.h2_handler is None or host in self.http11_hosts or request.meta.get('proxy'):
+            self._inc_stats('http2/http11_request_count', spider)
+            return self.http11_handler.download_request(request, spider)
+
+        self._inc_stats('http2/request_count', spider)
+        dfd = self.h2_handler.download_request(request, spider)
+        dfd.addErrback(self._fall_back, request, spider, host)
+        return dfd
+
+    def close(self):
+        if self.h2_handler is not None:
+            self.h2_handler.close()
+        return self.http11_handler.close()
+
+    def _fall_back(self, failure, request, spider, host):
+        """ private helper.
+        downloads 'request' with HTTP/1.1 if its HTTP/2 download
+        failed because the host does not support HTTP/2 """
+
+        if not _is_protocol_failure(failure):
+            return failure
+
+        if host not in self.http11_hosts:
+            self.http11_hosts.add(host)
+            self._inc_stats('http2/fallback_host_count', spider)
+            logger.info(f'{host} does not support HTTP/2, falling back to HTTP/1.1')
+        self._inc_stats('http2/http11_request_count', spider)
+        return self.http11_handler.download_request(request, spider)
+
+    def _inc_stats(self, key, spider):
+        """ private helper. """
+
+        if self.crawler is not None:
+            self.crawler.stats.inc_value(key, spider=spider)
+
+
+def _is_protocol_failure(failure):
+    """ private helper.
+    checks if 'failure' was caused by a host which did not negotiate
+    (or speak) HTTP/2, rather than by e.g. a timeout """
+
+    errors = [failure.value]
+    if failure.check(ResponseFailed):
+        # the errors which caused the HTTP/2 connection to be lost
+        errors = [getattr(reason, 'value', reason) for reason in failure.value.reasons]
+    # a stream closed before its request was sent, or a TLS handshake which failed,
+    # means the connection was lost before HTTP/2 could be negotiated
+    return any(isinstance(error, (H2Error, InactiveStreamClosed, SSL.Error)) for error in errors)
+
+
+class WarcReplayDownloadHandler():
+    """ download handler (for http and https requests) which never
+    accesses the network: it returns the response recorded (in the WARC_REPLAY_PATH
+    file) at the 'replay_offset' of the request (see `WarcReplayMiddleware`).
+
+    Requests without a recorded response get an empty 404 response """
+
+    lazy = False
+
+    def __init__(self, settings, crawler=None):
+        self.crawler = crawler
+        self.archive = open_archive(settings.get('WARC_REPLAY_PATH'))
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler)
+
+    def download_request(self, request, spider):
+        offset = request.meta.get('replay_offset')
+        if offset is None:
+            logger.debug(f'No recorded response for {request.url}')
+            self._inc_stats('replay/missing_count', spider)
+            return defer.succeed(Response(request.url, status=404, request=request))
+
+        return defer.succeed(self.archive.read_response(offset, request=request))
+
+    def close(self):
+        self.archive.close()
+
+    def _inc_stats(self, key, spider):
+        """ private helper. """
+
+        if self.crawler is not None:
+            self.crawler.stats.inc_value(key, spider=spider)
+
+
+class MirrorDownloadHandler():
+    """ download handler (for http and https requests) which downloads every page
+    from a local mirror of the scraped sites (MIRROR_URL, see `edscrapers.tools.bench.mirror`)
+    rather than from the sites themselves. The responses keep the urls of the sites.
+
+    The requests made by the parsers are sent to the mirror too (see `helpers.request_url()`) """
+
+    lazy = False
+
+    def __init__(self, settings, crawler=None):
+        self.mirror_url = settings.get('MIRROR_URL')
+        self.http11_handler = HTTP11DownloadHandler.from_crawler(crawler)
+        helpers.mirror_url = self.mirror_url
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler)
+
+    def download_request(self, request, spider):
+        mirror_request = request.replace(url=helpers.get_mirror_url(request.url, self.mirror_url))
+        dfd = self.http11_handler.download_request(mirror_request, spider)
+        dfd.addCallback(lambda response: response.replace(url=request.url, request=request))
+        return dfd
+
+    def close(self):
+        helpers.mirror_url = None
+        return self.http11_handler.close()
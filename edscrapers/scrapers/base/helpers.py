@@ -14,6 +14,7 @@ from urllib.parse import urlparse
 from urllib.parse import urljoin
 from scrapy.linkextractors.lxmlhtml import LxmlLinkExtractor
 from edscrapers.scrapers.base.models import Resource, Collection, Source
+from edscrapers.scrapers.base.warc import WarcWriter, WarcArchive
 
 import pathlib
 import importlib
@@ -30,6 +31,14 @@ NUMBER_OF_RETRIES_AFTER_LIMIT = 10 # total number of times to retry a rate-limit
 TOTAL_BACKOFF_TIME = sum(itertools.accumulate(itertools.repeat(RATE_LIMIT_WINDOW, 
                                     NUMBER_OF_RETRIES_AFTER_LIMIT+1)))
 
+# the WARC file of the crawl being recorded (a WarcWriter) or replayed (a WarcArchive),
+# if any. The requests made by the parsers are recorded in it, or replayed from it
+warc_archive = None
+
+# the url of a local mirror of the scraped sites (see `edscrapers.tools.bench.mirror`),
+# if any. The requests made by the parsers are then sent to the mirror
+mirror_url = None
+
 def get_data_extensions():
     return {
         '.xls': 'Excel data file',
@@ -104,18 +113,61 @@ def get_meta_value(soup, meta_name):
     return meta_tag['content']
 
 
+def request_url(url, method='GET'):
+    """ function requests 'url' for a parser (i.e. outside of Scrapy) and
+    returns the (requests) response.
+
+    While a crawl is recorded (see `edscrapers.scrapers.base.warc`), the response
+    is recorded with it. While a crawl is replayed, the response recorded
+    by the crawl is returned instead (None if there is none) """
+
+    if isinstance(warc_archive, WarcArchive):
+        return warc_archive.get_lookup(method, url)
+    if mirror_url:
+        # the mirror is local, so its requests are not rate limited
+        return requests.request(method, get_mirror_url(url, mirror_url))
+
+    if method == 'HEAD':
+        # the resources' headers are requested as they always were: no redirect is followed
+        # (the headers are the resource's own), the certificate is verified and no rate limit applies
+        response = requests.head(url)
+    else:
+        response = _request_url(url, method)
+    if isinstance(warc_archive, WarcWriter):
+        warc_archive.record_lookup(method, url, response)
+    return response
+
+
+def get_mirror_url(url, mirror_url):
+    """ function returns the url of the page at 'url' in the mirror at 'mirror_url'
+    (i.e. '<mirror_url>/<host>/<path>') """
+
+    parts = urllib.parse.urlsplit(url)
+    mirrored_url = f'{mirror_url.rstrip("/")}/{parts.netloc}{parts.path or "/"}'
+    if parts.query:
+        mirrored_url += f'?{parts.query}'
+    return mirrored_url
+
+
 @backoff.on_exception(backoff.expo, Exception,
                       max_time=TOTAL_BACKOFF_TIME,
                       max_tries=NUMBER_OF_RETRIES_AFTER_LIMIT) # exponential backoff
 @ratelimit.limits(calls=NUMBER_OF_CALLS_PER_LIMIT_WINDOWS,
                   period=RATE_LIMIT_WINDOW) # apply rate-limit throttling
+def _request_url(url, method):
+    """ private helper. """
+
+    return requests.request(method, url, verify=False)
+
+
 def get_resource_headers(source_url, url):
     headers = dict()
     #return headers
     if urlparse(url).scheme:
-        raw_headers = requests.head(url).headers
+        response = request_url(url, method='HEAD')
     else:
-        raw_headers = requests.head(urljoin(source_url, url)).headers
+        response = request_url(urljoin(source_url, url), method='HEAD')
+    raw_headers = response.headers if response is not None else dict()
 
     headers['content-type'] = raw_headers.get('Content-Type', None)
     headers['last-modified'] = raw_headers.get('Last-Modified', None)
@@ -138,7 +190,7 @@ def retrieve_crawlers_allowed_domains(except_crawlers=[]) -> list:
     value is an empty list (which means no crawler is excluded) """
 
     # get the path to the scrapers package
-    scrapers_path = pathlib.Path('./edscrapers/scrapers')
+    scrapers_path = pathlib.Path(__file__).resolve().parent.parent
     allowed_domains = set() # collection of allowed domains
     except_allowed_domains = set() # domains to be exempted from collection
 
@@ -166,11 +218,6 @@ def retrieve_crawlers_allowed_domains(except_crawlers=[]) -> list:
     return list(allowed_domains) # return allowed_domains
 
 
-@backoff.on_exception(backoff.expo, Exception,
-                      max_time=TOTAL_BACKOFF_TIME,
-                      max_tries=NUMBER_OF_RETRIES_AFTER_LIMIT) # exponential backoff
-@ratelimit.limits(calls=NUMBER_OF_CALLS_PER_LIMIT_WINDOWS,
-                  period=RATE_LIMIT_WINDOW) # apply rate-limit throttling
 def extract_dataset_collection_from_url(collection_url,
                                         namespace, source_url=None):
     """ function is used to generate/extract a dataset 'Collection' from
@@ -214,7 +261,7 @@ def extract_dataset_collection_from_url(collection_url,
 
 
     # make a request for html page contained in the provided url
-    res = requests.get(collection_url, verify=False)
+    res = request_url(collection_url)
 
     # ensure that the response text gotten is a string
     if not isinstance(getattr(res, 'text', None), str):
@@ -245,11 +292,6 @@ def extract_dataset_collection_from_url(collection_url,
     return collection
 
 
-@backoff.on_exception(backoff.expo, Exception,
-                      max_time=TOTAL_BACKOFF_TIME,
-                      max_tries=NUMBER_OF_RETRIES_AFTER_LIMIT) # exponential backoff
-@ratelimit.limits(calls=NUMBER_OF_CALLS_PER_LIMIT_WINDOWS,
-                  period=RATE_LIMIT_WINDOW) # apply rate-limit throttling
 def extract_dataset_source_from_url(source_url, namespace):
     """ function is used to generate/extract a dataset 'Source' from
     the provided source_url.
@@ -277,7 +319,7 @@ def extract_dataset_source_from_url(source_url, namespace):
     source_url = url_query_param_cleanup(source_url, include_query_param=[])
     
     # make a request for html page contained in the provided url
-    res = requests.get(source_url, verify=False)
+    res = request_url(source_url)
 
     # ensure that the response text gotten is a string
     if not isinstance(getattr(res, 'text', None), str):
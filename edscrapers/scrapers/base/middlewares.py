@@ -1,7 +1,37 @@
+import os
 import re
+import json
+import time
+from pathlib import Path
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from collections import Counter
+
+from scrapy import signals, Request
+from scrapy.link import Link
+from scrapy.linkextractors import LinkExtractor
+from scrapy.exceptions import NotConfigured, DontCloseSpider
+from scrapy.core.downloader.handlers.http11 import TunnelError
+from twisted.internet import defer
+from twisted.internet.error import TimeoutError, DNSLookupError, ConnectionRefusedError,\
+    ConnectionDone, ConnectError, ConnectionLost, TCPTimedOutError
+from twisted.web.client import ResponseFailed
 from scrapy.spidermiddlewares.offsite import OffsiteMiddleware
+from w3lib.url import add_or_replace_parameter, url_query_parameter
 
 import bs4
+import pandas as pd
+
+from edscrapers.cli import logger
+from edscrapers.scrapers.base.graph import GraphWrapper, load_graph_history, get_url_prefix,\
+    get_url_prefix_yields, get_dataset_page_referers, copy_page_ancestry, copy_graph, copy_page
+from edscrapers.scrapers.base.fleet import SharedFrontier, get_shard
+from edscrapers.scrapers.base.shared import get_consumers, get_consumer_rule
+from edscrapers.scrapers.base.retry import RetryQueue, get_retry_queue_path
+from edscrapers.scrapers.base.discovery import LastmodStore, get_lastmod_path, get_sitemap_entries
+from edscrapers.scrapers.base.warc import WarcWriter, open_archive
+from edscrapers.scrapers.base import helpers
+from edscrapers.transformers.base.helpers import traverse_output, read_file
 
 class RegexOffsiteMiddleware(OffsiteMiddleware):
     def get_host_regex(self, spider):
@@ -24,6 +54,10 @@ class GraphMiddleWare():
     
     def process_spider_input(self, response, spider):
 
+        # sitemaps are not pages (see `DiscoveryMiddleware`)
+        if response.meta.get('discovery') == 'sitemap':
+            return
+
         # ensure that the response text gotten is a string
         #if not isinstance(getattr(response, 'text', None), str):
         #    raise TypeError("invalid response type gotten. Expected 'str' type")
@@ -35,16 +69,25 @@ class GraphMiddleWare():
             soup_parser = bs4.BeautifulSoup(response_text, 'html5lib')
             #raise exc
 
+        # update the graph of each scraper whose scope includes this response
+        # (there is more than one scraper when several scrapers share a crawl)
+        for consumer in get_consumers(spider, url=response.url):
+            self._add_response(consumer.scraper_graph, response, soup_parser)
+
+    def _add_response(self, scraper_graph, response, soup_parser):
+        """ private helper.
+        adds the vertex (and the edge from its parent) for 'response' to 'scraper_graph' """
+
         current_vertex = None # holds the current vertex which represents the current Response
         
-        with spider.scraper_graph.graph_lock:
+        with scraper_graph.graph_lock:
             # check if this particular vertex already exist
             try:
-                current_vertex = spider.scraper_graph.vs.find(name=response.url)
+                current_vertex = scraper_graph.vs.find(name=response.url)
             except:
                 pass
             if not current_vertex: # if the current vertex does NOTalready exist, create it
-                current_vertex = spider.scraper_graph.add_vertex(name=response.url, color='pink', shape=1)
+                current_vertex = scraper_graph.add_vertex(name=response.url, color='pink', shape=1)
                 current_vertex['label'] = f"P{current_vertex.index}" # add label for the vertex
                 # set the title for the vertex
                 if soup_parser.head.find(name='title'):
@@ -54,13 +97,968 @@ class GraphMiddleWare():
                     current_vertex['title'] = '[no title]'
 
             if response.meta.get('depth', 0) == 0: # this is a response from a start url
-                spider.scraper_graph.add_edge(source='base_vertex', target=current_vertex['name'])
+                scraper_graph.add_edge(source='base_vertex', target=current_vertex['name'])
 
             elif str(response.request.headers.get(b'Referer', b''), encoding='utf-8') == response.url:
                 # this is also a response from a start url
-                spider.scraper_graph.add_edge(source='base_vertex', target=current_vertex['name'])
+                scraper_graph.add_edge(source='base_vertex', target=current_vertex['name'])
             
             else:
                 # get the parent vertex this response
-                parent_vertex = spider.scraper_graph.vs.find(name=str(response.request.headers.get(b'Referer', b''), encoding='utf-8'))
-                spider.scraper_graph.add_edge(source=parent_vertex['name'], target=current_vertex['name'])
\ No newline at end of file
+                referer = str(response.request.headers.get(b'Referer', b''), encoding='utf-8')
+                try:
+                    parent_vertex = scraper_graph.vs.find(name=referer)
+                except ValueError:
+                    # the parent page was crawled by another worker of the crawl fleet
+                    # (or is outside the scope of this scraper, in a shared crawl).
+                    # add a placeholder, which is resolved when the graph fragments are merged
+                    parent_vertex = scraper_graph.add_vertex(name=referer, color='pink', shape=1,
+                                                             title='[no title]',
+                                                             is_placeholder=True)
+                    parent_vertex['label'] = f"P{parent_vertex.index}"
+                scraper_graph.add_edge(source=parent_vertex['name'], target=current_vertex['name'])
+
+class YieldPriorityMiddleware():
+    """ spider middleware prioritizes requests for the url prefixes which,
+    according to the graphs of previous crawls, lead to datasets.
+
+    Requests for url prefixes which produced no datasets over the last
+    YIELD_PRUNE_RUNS crawls are deprioritized or,
+    if YIELD_PRUNE_ENABLED is set, dropped altogether.
+    Dropped prefixes are reported in '<ED_OUTPUT_PATH>/graphs/<name>/<name>_pruned.csv' """
+
+    def __init__(self, settings):
+        self.scale = settings.getint('YIELD_PRIORITY_SCALE')
+        self.prefix_depth = settings.getint('YIELD_PREFIX_DEPTH')
+        self.min_pages = settings.getint('YIELD_MIN_PAGES')
+        self.lookahead = settings.getint('YIELD_LOOKAHEAD')
+        self.prune_runs = settings.getint('YIELD_PRUNE_RUNS')
+        self.prune = settings.getbool('YIELD_PRUNE_ENABLED')
+
+        self.prefix_yields = dict() # yields computed from the latest graph
+        self.barren_prefixes = set() # prefixes with no datasets over the last 'prune_runs' crawls
+        self.pruned = Counter() # number of requests pruned per prefix
+        self.priorities = dict() # memoized priority adjustments per url prefix
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('YIELD_PRIORITY_ENABLED'):
+            raise NotConfigured
+
+        middleware = cls(crawler.settings)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        # twice the pruning window is loaded so that prefixes pruned in
+        # the latest crawls (which are then missing from their graphs) remain pruned
+        graphs = load_graph_history(file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'),
+                                                       'graphs', spider.name),
+                                    file_stem_name=spider.name,
+                                    runs=max(self.prune_runs * 2, 1))
+        if not graphs:
+            logger.info(f'No previous crawl graph found for {spider.name}. Requests will not be prioritized')
+            return
+
+        runs_yields = [get_url_prefix_yields(graph, prefix_depth=self.prefix_depth,
+                                             lookahead=self.lookahead) for graph in graphs]
+        self.prefix_yields = runs_yields[0]
+
+        if self.prune_runs > 0:
+            for prefix in set().union(*runs_yields):
+                # the yields of the prefix in the crawls where it was actually crawled
+                crawled_yields = [run_yields[prefix] for run_yields in runs_yields
+                                  if run_yields.get(prefix, {}).get('pages', 0) >= self.min_pages]
+                # a prefix is barren when it did not lead to a dataset
+                # in any of the last 'prune_runs' crawls it was crawled in
+                if len(crawled_yields) >= self.prune_runs and\
+                    all(prefix_yield['productive'] == 0
+                        for prefix_yield in crawled_yields[:self.prune_runs]):
+                    self.barren_prefixes.add(prefix)
+
+        logger.info(f'Loaded dataset yields for {len(self.prefix_yields)} url prefixes '\
+                    f'({len(self.barren_prefixes)} barren)')
+
+    def spider_closed(self, spider):
+        if not self.pruned:
+            return
+
+        df = pd.DataFrame(self.pruned.most_common(), columns=['URL Prefix', 'Requests Pruned'])
+        df.to_csv(Path(os.getenv('ED_OUTPUT_PATH'), 'graphs', spider.name,
+                       f'{spider.name}_pruned.csv'),
+                  header=True, index=False)
+        logger.info(f'Pruned {sum(self.pruned.values())} requests '\
+                    f'from {len(self.pruned)} barren url prefixes')
+
+    def process_spider_output(self, response, result, spider):
+        for request_or_item in result:
+            if isinstance(request_or_item, Request) and\
+                (self.prefix_yields or self.barren_prefixes):
+                prefix, priority = self._get_priority(request_or_item.url)
+                if priority is None: # the request is for a pruned prefix
+                    self.pruned[prefix] += 1
+                    continue
+                request_or_item.priority += priority
+            yield request_or_item
+
+    def _get_priority(self, url):
+        """ returns the most specific known prefix for 'url' and the priority adjustment
+        for its requests (or None if requests for the prefix should be dropped) """
+
+        for depth in range(self.prefix_depth, -1, -1):
+            prefix = get_url_prefix(url, depth)
+            if prefix in self.barren_prefixes:
+                return prefix, (None if self.prune else -self.scale)
+
+            prefix_yield = self.prefix_yields.get(prefix)
+            if prefix_yield and prefix_yield['pages'] >= self.min_pages:
+                if prefix not in self.priorities:
+                    self.priorities[prefix] = int(self.scale * prefix_yield['productive'] /\
+                                                  prefix_yield['pages'])
+                return prefix, self.priorities[prefix]
+
+        return None, 0 # nothing (reliable) is known about this url
+
+
+class RefreshKnownMiddleware():
+    """ spider middleware replaces the start urls of a crawl by the dataset pages
+    found in the previous crawl (as recorded in the crawl graph or,
+    if no graph is available, in the scraper output).
+
+    Each dataset page is requested with the page it was previously reached from as Referer
+    and the chain of pages which led to it is copied into the new crawl graph,
+    so that collections can still be identified from a refresh crawl.
+    How far links are followed from the dataset pages is controlled by DEPTH_LIMIT """
+
+    def __init__(self):
+        self.dataset_page_referers = dict()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('REFRESH_KNOWN_ENABLED'):
+            raise NotConfigured
+
+        middleware = cls()
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        return middleware
+
+    def spider_opened(self, spider):
+        graphs = load_graph_history(file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'),
+                                                       'graphs', spider.name),
+                                    file_stem_name=spider.name)
+        if graphs:
+            previous_graph = graphs[0]
+            self.dataset_page_referers = get_dataset_page_referers(previous_graph)
+            # copy the chain of pages leading to each dataset page into this crawl's graph
+            graph = GraphWrapper.get_graph()
+            with graph.graph_lock:
+                for referer in set(self.dataset_page_referers.values()):
+                    if referer:
+                        copy_page_ancestry(previous_graph, graph, referer)
+        else:
+            # fall back to the dataset pages recorded in the scraper output
+            for file_path in traverse_output(spider.name):
+                source_url = read_file(file_path).get('source_url')
+                if source_url:
+                    self.dataset_page_referers[source_url] = None
+
+        logger.info(f'Refreshing {len(self.dataset_page_referers)} known dataset pages for {spider.name}')
+
+    def process_start_requests(self, start_requests, spider):
+        for url, referer in self.dataset_page_referers.items():
+            # build the request as the crawler's rule would have, so the page is parsed
+            request = spider._build_request(0, Link(url))
+            # a Referer identical to the url marks a page reached from a start url
+            request.headers['Referer'] = referer or url
+            # the dataset pages are one level below the start point
+            request.meta['depth'] = 1
+            yield request
+
+
+class FleetShardMiddleware():
+    """ spider middleware restricts a worker of a crawl fleet
+    (see `edscrapers.scrapers.base.fleet`) to its shard of the url space.
+
+    Requests for the worker's own shard are kept (unless already seen by the fleet),
+    requests for other shards are handed over through the shared frontier.
+    When idle, the worker claims the requests handed over to it and only lets the
+    spider close once the whole fleet is done """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.workers = crawler.settings.getint('FLEET_WORKERS')
+        self.worker_index = crawler.settings.getint('FLEET_WORKER_INDEX')
+        self.frontier = SharedFrontier(crawler.settings.get('FLEET_FRONTIER_PATH'),
+                                       worker_index=self.worker_index)
+        self.finished = False # set once the whole fleet is done
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if crawler.settings.getint('FLEET_WORKERS', 1) < 2:
+            raise NotConfigured
+
+        middleware = cls(crawler)
+        crawler.signals.connect(middleware.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_idle(self, spider):
+        claimed_requests = self.frontier.claim()
+        if claimed_requests:
+            for url, referer, depth, rule in claimed_requests:
+                # build the request as the crawler's rule would have, so the page is parsed
+                request = spider._build_request(rule, Link(url))
+                request.headers['Referer'] = referer or url
+                request.meta['depth'] = depth
+                self.crawler.engine.crawl(request, spider)
+            logger.debug(f'Worker {self.worker_index} claimed {len(claimed_requests)} requests')
+            raise DontCloseSpider
+
+        self.frontier.set_worker_status('idle')
+        if not self.frontier.is_finished():
+            # other workers may still hand requests over to this one
+            raise DontCloseSpider
+        self.finished = True
+
+    def spider_closed(self, spider):
+        if not self.finished:
+            # don't let the other workers wait for this one
+            self.frontier.set_worker_status('failed')
+        self.frontier.close()
+
+    def process_start_requests(self, start_requests, spider):
+        # every worker generates the same start requests, and keeps those of its shard
+        for request in start_requests:
+            if get_shard(request.url, self.workers) == self.worker_index and\
+                self.frontier.add(request.url, self.worker_index):
+                yield request
+
+    def process_spider_output(self, response, result, spider):
+        for request_or_item in result:
+            if not isinstance(request_or_item, Request):
+                yield request_or_item
+                continue
+
+            shard = get_shard(request_or_item.url, self.workers)
+            if shard == self.worker_index:
+                if self.frontier.add(request_or_item.url, shard):
+                    yield request_or_item
+            else:
+                referer = request_or_item.headers.get(b'Referer')
+                self.frontier.add(request_or_item.url, shard,
+                                  referer=str(referer, encoding='utf-8') if referer else None,
+                                  depth=request_or_item.meta.get('depth', 0),
+                                  rule=request_or_item.meta.get('rule', 0),
+                                  status='pending')
+
+
+class AdaptiveThrottleMiddleware():
+    """ downloader middleware adapts the delay and concurrency of each host
+    (i.e. download slot) to how the host copes with the crawl.
+
+    Concurrency is controlled AIMD-style: it is increased by one per 'window' of
+    responses within the host's target latency, and multiplied by
+    ADAPTIVE_THROTTLE_DECREASE_FACTOR when responses exceed it. The download delay
+    decays towards the host's minimum delay while the host keeps up, and moves towards
+    its latency when it doesn't. 429 and 503 responses pause the host (for at least their Retry-After)
+    and are retried up to ADAPTIVE_THROTTLE_MAX_RETRIES times.
+
+    Hosts can be given their own 'target_latency', 'min_delay' and 'max_concurrency'
+    in the ADAPTIVE_THROTTLE_HOSTS setting (e.g. from a crawler's custom_settings).
+    A profile applies to the host it names and to its subdomains """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+
+        self.default_profile = {
+            'target_latency': settings.getfloat('ADAPTIVE_THROTTLE_TARGET_LATENCY'),
+            'min_delay': settings.getfloat('ADAPTIVE_THROTTLE_MIN_DELAY'),
+            'max_concurrency': settings.getint('ADAPTIVE_THROTTLE_MAX_CONCURRENCY'),
+        }
+        self.host_profiles = settings.getdict('ADAPTIVE_THROTTLE_HOSTS')
+        self.max_delay = settings.getfloat('ADAPTIVE_THROTTLE_MAX_DELAY')
+        self.decrease_factor = settings.getfloat('ADAPTIVE_THROTTLE_DECREASE_FACTOR')
+        self.max_retries = settings.getint('ADAPTIVE_THROTTLE_MAX_RETRIES')
+
+        self.slot_states = dict() # throttling state, per download slot
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('ADAPTIVE_THROTTLE_ENABLED'):
+            raise NotConfigured
+
+        middleware = cls(crawler)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_closed(self, spider):
+        for key, state in sorted(self.slot_states.items()):
+            logger.info(f"Throttle for {key}: concurrency {state['slot'].concurrency}, "\
+                        f"delay {state['slot'].delay:.2f}s")
+
+    def process_response(self, request, response, spider):
+        if 'cached' in response.flags: # nothing was downloaded
+            return response
+
+        key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return response
+        state = self._get_slot_state(key, slot)
+
+        if response.status in (429, 503):
+            # the host is overloaded (or rate limiting us), so back off
+            self._decrease(state, pause=self._get_retry_after(response))
+            return self._retry(request, response, spider)
+
+        latency = request.meta.get('download_latency')
+        if latency is None:
+            return response
+        if latency > state['profile']['target_latency']:
+            self._decrease(state, latency=latency)
+        else:
+            self._increase(state)
+        return response
+
+    def _get_slot_state(self, key, slot):
+        """ private helper.
+        returns the throttling state of the 'key' download slot,
+        creating it the first time the slot is seen """
+
+        if key not in self.slot_states:
+            profile = dict(self.default_profile)
+            host = str(key).lower()
+            for profile_host, host_profile in self.host_profiles.items():
+                if host == profile_host or host.endswith('.' + profile_host):
+                    profile.update(host_profile)
+                    break
+            # start with a single connection, concurrency is increased as the host keeps up
+            slot.concurrency = 1
+            self.slot_states[key] = {'slot': slot, 'profile': profile,
+                                     'credit': 0.0, 'last_decrease': 0.0}
+        return self.slot_states[key]
+
+    def _increase(self, state):
+        """ private helper.
+        additive increase: one more connection per window of (concurrency) responses
+        within the target latency, while the delay decays towards the minimum delay """
+
+        slot, profile = state['slot'], state['profile']
+
+        state['credit'] += 1 / slot.concurrency
+        if state['credit'] >= 1:
+            state['credit'] = 0.0
+            slot.concurrency = min(profile['max_concurrency'], slot.concurrency + 1)
+
+        slot.delay = slot.delay * 0.9
+        if slot.delay < max(profile['min_delay'], 0.01):
+            slot.delay = profile['min_delay']
+
+    def _decrease(self, state, latency=None, pause=None):
+        """ private helper.
+        multiplicative decrease of the concurrency.
+
+        For a slow host (i.e. 'latency' above the target), the delay moves towards the
+        latency and the decrease happens at most once per target latency, so a burst of
+        slow responses caused by the same overload only counts once. For an overloaded
+        host (i.e. no 'latency'), the delay is doubled (and is at least 'pause' seconds) """
+
+        slot, profile = state['slot'], state['profile']
+
+        now = time.time()
+        if latency is not None and now - state['last_decrease'] < profile['target_latency']:
+            return
+        state['last_decrease'] = now
+        state['credit'] = 0.0
+
+        slot.concurrency = max(1, int(slot.concurrency * self.decrease_factor))
+        if latency is not None:
+            delay = max(profile['min_delay'], (slot.delay + latency) / 2)
+        else:
+            delay = max(profile['min_delay'], slot.delay * 2,
+                        profile['target_latency'], pause or 0)
+        slot.delay = min(delay, max(self.max_delay, pause or 0))
+
+    def _retry(self, request, response, spider):
+        """ private helper.
+        returns a copy of 'request' to be retried, or 'response' if
+        the request was retried too many times already """
+
+        retries = request.meta.get('throttle_retry_times', 0) + 1
+        if retries > self.max_retries:
+            self.stats.inc_value('throttle/gave_up', spider=spider)
+            logger.warning(f'Gave up on {request.url} after {retries - 1} retries '\
+                           f'(status {response.status})')
+            return response
+
+        self.stats.inc_value('throttle/retry', spider=spider)
+        logger.debug(f'Retrying {request.url} (status {response.status}, retry {retries})')
+        retry_request = request.copy()
+        retry_request.meta['throttle_retry_times'] = retries
+        retry_request.dont_filter = True
+        retry_request.priority = request.priority - 1
+        return retry_request
+
+    @staticmethod
+    def _get_retry_after(response):
+        """ private helper.
+        returns the number of seconds requested by the
+        Retry-After header of 'response', or None """
+
+        value = response.headers.get(b'Retry-After')
+        if not value:
+            return None
+        value = value.decode('latin-1').strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            retry_at = parsedate_to_datetime(value)
+            return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+
+class RetryLaneMiddleware():
+    """ downloader middleware records the requests which fail (because of a timeout,
+    a connection error or one of the RETRY_HTTP_CODES) in the retry queue of the crawl
+    (see `edscrapers.scrapers.base.retry`), instead of losing them.
+
+    Once the crawl has nothing else to do, the failed requests are retried in
+    a low priority lane (RETRY_LANE_PRIORITY), with an exponential backoff starting
+    at RETRY_LANE_BACKOFF seconds, for up to RETRY_LANE_MAX_ATTEMPTS attempts in total.
+    The pages which were never recovered are reported in
+    '<ED_OUTPUT_PATH>/scrapy/retry/<name>_unrecovered.csv' """
+
+    EXCEPTIONS_TO_RETRY = (defer.TimeoutError, TimeoutError, DNSLookupError,
+                           ConnectionRefusedError, ConnectionDone, ConnectError,
+                           ConnectionLost, TCPTimedOutError, ResponseFailed,
+                           IOError, TunnelError)
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.http_codes = set(int(code) for code in settings.getlist('RETRY_HTTP_CODES'))
+        self.max_attempts = settings.getint('RETRY_LANE_MAX_ATTEMPTS')
+        self.backoff = settings.getfloat('RETRY_LANE_BACKOFF')
+        self.priority = settings.getint('RETRY_LANE_PRIORITY')
+        # the queue of a previous crawl is kept when resuming it or retrying its failures
+        self.reset = not (settings.get('JOBDIR') or settings.getbool('RETRY_FAILED_ENABLED'))
+        # each worker of a fleet keeps its own queue
+        self.worker_index = settings.get('FLEET_WORKER_INDEX')
+        self.queue = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('RETRY_LANE_ENABLED'):
+            raise NotConfigured
+
+        middleware = cls(crawler)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def _get_queue_name(self, spider):
+        """ private helper.
+        returns the name of the retry queue of the crawl """
+
+        if self.worker_index is None:
+            return spider.name
+        return f'{spider.name}.worker-{self.worker_index}'
+
+    def spider_opened(self, spider):
+        self.queue = RetryQueue(get_retry_queue_path(self._get_queue_name(spider)),
+                                reset=self.reset)
+        # make the queue available to the RetryFailedMiddleware
+        spider.retry_queue = self.queue
+
+    def spider_idle(self, spider):
+        due_requests = self.queue.schedule_due(self.max_attempts)
+        for url, referer, depth, rule in due_requests:
+            self.crawler.engine.crawl(build_retry_request(spider, url, referer, depth, rule,
+                                                          priority=self.priority), spider)
+        if due_requests:
+            self.stats.inc_value('retry_lane/retried', count=len(due_requests), spider=spider)
+            logger.info(f'Retrying {len(due_requests)} failed requests')
+            raise DontCloseSpider
+
+        if self.queue.has_pending(self.max_attempts):
+            # wait for the backoff of the remaining failed requests
+            raise DontCloseSpider
+
+    def spider_closed(self, spider):
+        unrecovered = self.queue.get_unrecovered()
+        self.stats.set_value('retry_lane/unrecovered', len(unrecovered), spider=spider)
+        if unrecovered:
+            df = pd.DataFrame(unrecovered, columns=['URL', 'Referer', 'Reason', 'Attempts'])
+            queue_name = self._get_queue_name(spider)
+            df.to_csv(Path(get_retry_queue_path(queue_name).parent,
+                           f'{queue_name}_unrecovered.csv'),
+                      header=True, index=False)
+            logger.warning(f'{len(unrecovered)} pages were never recovered '\
+                           f'(see {queue_name}_unrecovered.csv)')
+        self.queue.close()
+
+    def process_response(self, request, response, spider):
+        if response.status in self.http_codes:
+            self._record_failure(request, f'HTTP {response.status}', spider)
+        elif 'retry_url' in request.meta and\
+            self.queue.record_recovery(request.meta['retry_url']):
+            # recovered by the url which was retried, even if it redirected
+            self.stats.inc_value('retry_lane/recovered', spider=spider)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if isinstance(exception, self.EXCEPTIONS_TO_RETRY):
+            self._record_failure(request, exception.__class__.__name__, spider)
+        elif 'retry_url' in request.meta:
+            # e.g. an IgnoreRequest; another attempt would fail in the same way
+            self.queue.give_up(request.meta['retry_url'], exception.__class__.__name__)
+
+    def _record_failure(self, request, reason, spider):
+        """ private helper.
+        records the failure of 'request' in the retry queue """
+
+        referer = request.headers.get(b'Referer')
+        attempts = self.queue.record_failure(request.meta.get('retry_url', request.url),
+                                             reason, self.backoff,
+                                             referer=str(referer, encoding='utf-8') if referer else None,
+                                             depth=request.meta.get('depth', 0),
+                                             rule=request.meta.get('rule'))
+        self.stats.inc_value('retry_lane/failed', spider=spider)
+        logger.debug(f'{request.url} failed ({reason}, attempt {attempts})')
+
+
+class RetryFailedMiddleware():
+    """ spider middleware replaces the start urls of a crawl by the
+    requests left unrecovered in the retry queue of the previous crawl.
+
+    The graph of the previous crawl is extended (rather than replaced), and links to
+    pages the previous crawl already visited are not followed, so only the subtrees
+    lost to the failed requests are crawled """
+
+    def __init__(self, priority):
+        self.priority = priority
+        self.known_urls = set() # the pages visited by the previous crawl
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('RETRY_FAILED_ENABLED') or\
+            not crawler.settings.getbool('RETRY_LANE_ENABLED'):
+            raise NotConfigured
+
+        middleware = cls(crawler.settings.getint('RETRY_LANE_PRIORITY'))
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        return middleware
+
+    def spider_opened(self, spider):
+        for consumer in get_consumers(spider):
+            graphs = load_graph_history(file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'),
+                                                           'graphs', consumer.name),
+                                        file_stem_name=consumer.name)
+            if not graphs:
+                continue
+            self.known_urls.update(graphs[0].vs['name'])
+            with consumer.scraper_graph.graph_lock:
+                copy_graph(graphs[0], consumer.scraper_graph)
+
+    def process_start_requests(self, start_requests, spider):
+        failed_requests = spider.retry_queue.reset_attempts()
+        logger.info(f'Retrying {len(failed_requests)} failed requests for {spider.name}')
+        for url, referer, depth, rule in failed_requests:
+            self.known_urls.discard(url)
+            yield build_retry_request(spider, url, referer, depth, rule, priority=self.priority)
+
+    def process_spider_output(self, response, result, spider):
+        for request_or_item in result:
+            if isinstance(request_or_item, Request) and request_or_item.url in self.known_urls:
+                continue
+            yield request_or_item
+
+
+def build_retry_request(spider, url, referer, depth, rule, priority=0):
+    """ returns the request for retrying 'url', built as the crawler's rule
+    (or, for start urls, the crawler itself) would have built it """
+
+    if rule is None:
+        request = Request(url, dont_filter=True)
+    else:
+        request = spider._build_request(rule, Link(url))
+        request.dont_filter = True
+    if referer:
+        request.headers['Referer'] = referer
+    request.meta['depth'] = depth
+    # the url which is retried, kept through redirects to be recovered by it
+    request.meta['retry_url'] = url
+    # a cached error response would be returned to every attempt
+    request.meta['dont_cache'] = True
+    request.priority = priority
+    return request
+
+
+class DiscoveryMiddleware():
+    """ spider middleware discovers the pages of a crawl from the sitemaps
+    ('sitemap_urls', e.g. robots.txt files or sitemap indexes) and the paginated
+    listings ('listings') of its crawler, rather than by following every link
+    from the start urls.
+
+    Links are only followed DISCOVERY_FOLLOW_DEPTH levels from the discovered pages.
+    Following the links from the start urls remains the fallback, for the crawls in
+    which no page could be discovered (unless DISCOVERY_CRAWL_START_URLS is set,
+    in which case the links from the start urls are always followed). Discovery is
+    therefore opt-in (`eds scrape --discovery`): it trades the pages which are only
+    linked to (and in no sitemap or listing) for a much shorter crawl.
+
+    A page whose sitemap 'lastmod' has not changed since it was last crawled is
+    not requested again: its output is kept and the page (with its datasets)
+    is copied from the previous graph.
+
+    Each listing is a dict with the 'url' of its first page, the query parameter
+    ('page_param') holding the page number and the regex ('allow') the links to the
+    listed pages must match. The pages of a listing are requested until one
+    lists no new page (or DISCOVERY_MAX_LISTING_PAGES is reached) """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.priority = settings.getint('DISCOVERY_PRIORITY')
+        self.follow_depth = settings.getint('DISCOVERY_FOLLOW_DEPTH')
+        self.max_listing_pages = settings.getint('DISCOVERY_MAX_LISTING_PAGES')
+        self.crawl_start_urls = settings.getbool('DISCOVERY_CRAWL_START_URLS')
+
+        self.store = None
+        self.previous_graphs = dict() # the previous graph of each scraper
+        self.previous_pages = dict() # the urls in the previous graph of each scraper
+        self.previous_referers = dict() # the referer of each page in the previous graph of each scraper
+        self.listing_links = dict() # the links found so far on the pages of each listing
+        self.start_requests = [] # held back until nothing is left to discover
+        self.discovered = 0
+        self.unchanged = set() # the pages which are not requested again
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        # refresh and retry crawls have their own start requests
+        if not settings.getbool('DISCOVERY_ENABLED') or\
+            settings.getbool('REFRESH_KNOWN_ENABLED') or settings.getbool('RETRY_FAILED_ENABLED'):
+            raise NotConfigured
+
+        middleware = cls(crawler)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        if not _has_discovery(spider):
+            return
+
+        self.store = LastmodStore(get_lastmod_path(spider.name))
+        for consumer in get_consumers(spider):
+            graphs = load_graph_history(file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'),
+                                                           'graphs', consumer.name),
+                                        file_stem_name=consumer.name)
+            if not graphs:
+                continue
+            graph = graphs[0]
+            names = graph.vs['name']
+            referers = dict()
+            for source, target in graph.get_edgelist():
+                if names[source] != 'base_vertex' and names[target] not in referers:
+                    referers[names[target]] = names[source]
+            self.previous_graphs[consumer.name] = graph
+            self.previous_pages[consumer.name] = set(names)
+            self.previous_referers[consumer.name] = referers
+
+    def spider_idle(self, spider):
+        if not self.start_requests:
+            return
+
+        start_requests, self.start_requests = self.start_requests, []
+        if self.discovered:
+            logger.info(f'Discovered {self.discovered} pages for {spider.name}, '\
+                        'the links from the start urls are not followed')
+            return
+
+        logger.info(f'No page discovered for {spider.name}, '\
+                    'falling back to following the links from the start urls')
+        for request in start_requests:
+            self.crawler.engine.crawl(request, spider)
+        raise DontCloseSpider
+
+    def spider_closed(self, spider):
+        if self.store is None:
+            return
+
+        self.store.close()
+        self.stats.set_value('discovery/discovered', self.discovered, spider=spider)
+        self.stats.set_value('discovery/unchanged', len(self.unchanged), spider=spider)
+        pages = self.stats.get_value('response_received_count', 0, spider=spider)
+        datasets = self.stats.get_value('item_scraped_count', 0, spider=spider)
+        if datasets:
+            logger.info(f'{pages / datasets:.2f} pages fetched per dataset found')
+
+    def process_start_requests(self, start_requests, spider):
+        if not _has_discovery(spider):
+            yield from start_requests
+            return
+
+        for url in getattr(spider, 'sitemap_urls', []):
+            yield Request(url, priority=self.priority, meta={'discovery': 'sitemap'})
+        for index, listing in enumerate(getattr(spider, 'listings', [])):
+            page = int(url_query_parameter(listing['url'], listing['page_param'], '1'))
+            yield self._build_listing_request(listing, index, page)
+
+        if self.crawl_start_urls:
+            yield from start_requests
+        else:
+            # the start urls are only crawled if nothing is discovered (see `spider_idle()`)
+            self.start_requests = list(start_requests)
+
+    def process_spider_input(self, response, spider):
+        lastmod = response.meta.get('lastmod')
+        if lastmod and self.store is not None:
+            # record the 'lastmod' of the page once it has been crawled
+            self.store.set(*lastmod)
+
+    def process_spider_output(self, response, result, spider):
+        discovery = response.meta.get('discovery')
+        if discovery == 'sitemap':
+            # sitemaps have nothing for the spider to parse (or follow)
+            yield from self._parse_sitemap(response, spider)
+            return
+
+        if discovery == 'listing':
+            # only the listed pages (and the next page) are followed from a listing
+            for request_or_item in result:
+                if not isinstance(request_or_item, Request):
+                    yield request_or_item
+            yield from self._parse_listing(response, spider)
+            return
+
+        discovery_depth = response.meta.get('discovery_depth')
+        for request_or_item in result:
+            if isinstance(request_or_item, Request):
+                if request_or_item.url in self.unchanged:
+                    continue
+                if discovery_depth is not None:
+                    if discovery_depth >= self.follow_depth:
+                        continue
+                    request_or_item.meta['discovery_depth'] = discovery_depth + 1
+            yield request_or_item
+
+    def _parse_sitemap(self, response, spider):
+        """ private helper.
+        yields the requests for the sitemaps (of a sitemap index)
+        or for the pages (of a sitemap) listed in 'response' """
+
+        sitemap_type, entries = get_sitemap_entries(response)
+        if sitemap_type == 'sitemapindex':
+            for entry in entries:
+                yield Request(entry['loc'], priority=self.priority, meta={'discovery': 'sitemap'})
+            return
+
+        for entry in entries:
+            url = entry['loc']
+            rule = get_consumer_rule(spider, url)
+            if rule is None:
+                continue
+            self.discovered += 1
+            lastmod = entry.get('lastmod')
+            if lastmod and self._skip_unchanged(spider, url, lastmod):
+                continue
+
+            # build the request as the crawler's rule would have, so the page is parsed
+            request = spider._build_request(spider._rules.index(rule), Link(url))
+            # a Referer identical to the url marks a page reached from a start url
+            request.headers['Referer'] = self._get_previous_referer(spider, url) or url
+            request.meta['depth'] = 1
+            request.meta['discovery_depth'] = 0
+            if lastmod:
+                request.meta['lastmod'] = (url, lastmod)
+            request.priority = self.priority
+            yield request
+
+    def _parse_listing(self, response, spider):
+        """ private helper.
+        yields the requests for the pages listed in (and the next page of) the listing 'response' """
+
+        index = response.meta['listing']
+        listing = spider.listings[index]
+        listing_links = self.listing_links.setdefault(index, set())
+
+        new_links = 0
+        for link in LinkExtractor(allow=listing['allow']).extract_links(response):
+            rule = get_consumer_rule(spider, link.url)
+            if rule is None or link.url in listing_links:
+                continue
+            listing_links.add(link.url)
+            new_links += 1
+            self.discovered += 1
+
+            request = spider._build_request(spider._rules.index(rule), link)
+            request.meta['depth'] = response.meta.get('depth', 0) + 1
+            request.meta['discovery_depth'] = 0
+            request.priority = self.priority
+            yield request
+
+        pages = response.meta['listing_pages'] + 1
+        if new_links and pages < self.max_listing_pages:
+            yield self._build_listing_request(listing, index, response.meta['listing_page'] + 1,
+                                              pages=pages)
+
+    def _build_listing_request(self, listing, index, page, pages=0):
+        """ private helper.
+        returns the request for the 'page' page of a listing """
+
+        url = add_or_replace_parameter(listing['url'], listing['page_param'], str(page))
+        request = Request(url, priority=self.priority,
+                          meta={'discovery': 'listing', 'listing': index,
+                                'listing_page': page, 'listing_pages': pages})
+        # every page of a listing is handled as a start url
+        request.headers['Referer'] = url
+        return request
+
+    def _skip_unchanged(self, spider, url, lastmod):
+        """ private helper.
+        checks if the page 'url' has not changed since it was last crawled, in which
+        case the page (with its datasets) is copied from the previous graph(s) """
+
+        if self.store.get(url) != lastmod:
+            return False
+        consumers = get_consumers(spider, url=url)
+        if not consumers or any(url not in self.previous_pages.get(consumer.name, ())
+                                for consumer in consumers):
+            return False
+
+        for consumer in consumers:
+            with consumer.scraper_graph.graph_lock:
+                copy_page(self.previous_graphs[consumer.name], consumer.scraper_graph, url)
+        self.unchanged.add(url)
+        return True
+
+    def _get_previous_referer(self, spider, url):
+        """ private helper.
+        returns the page 'url' was reached from in the previous crawl (if any).
+        The chain of pages which led to it is copied into the graph(s) of this crawl """
+
+        referer = None
+        for consumer in get_consumers(spider, url=url):
+            consumer_referer = self.previous_referers.get(consumer.name, dict()).get(url)
+            if consumer_referer is None:
+                continue
+            with consumer.scraper_graph.graph_lock:
+                copy_page_ancestry(self.previous_graphs[consumer.name],
+                                   consumer.scraper_graph, consumer_referer)
+            referer = referer or consumer_referer
+        return referer
+
+
+class WarcRecorderMiddleware():
+    """ downloader middleware records every response of the crawl (as handed
+    to the spider, i.e. after redirects and decompression) in the WARC_RECORD_PATH
+    file (see `edscrapers.scrapers.base.warc`), so the crawl can be replayed
+    offline with `WarcReplayMiddleware` """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.get('WARC_RECORD_PATH') or\
+            crawler.settings.get('WARC_REPLAY_PATH'):
+            raise NotConfigured
+
+        middleware = cls(crawler.settings.get('WARC_RECORD_PATH'))
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.writer = WarcWriter(self.file_path)
+        # the requests made by the parsers are recorded too
+        helpers.warc_archive = self.writer
+
+    def spider_closed(self, spider):
+        helpers.warc_archive = None
+        self.writer.close()
+        logger.info(f'Recorded {self.writer.count} responses in {self.file_path}')
+
+    def process_response(self, request, response, spider):
+        referer = request.headers.get(b'Referer')
+        self.writer.record_response(response,
+                                    referer=str(referer, encoding='utf-8') if referer else None,
+                                    meta=request.meta)
+        return response
+
+
+class WarcReplayMiddleware():
+    """ spider middleware replaces the start urls of a crawl by the responses
+    recorded in the WARC_REPLAY_PATH file, in the order they were crawled and with
+    their Referer (the responses are then 'downloaded' by `WarcReplayDownloadHandler`).
+
+    The requests yielded by the spider are dropped (the pages they lead to are
+    replayed from the recording anyway), while its items go through the pipelines.
+    The requests made by the parsers are answered from the recording too """
+
+    def __init__(self, file_path, stats):
+        self.file_path = file_path
+        self.stats = stats
+        self.archive = open_archive(file_path)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.get('WARC_REPLAY_PATH'):
+            raise NotConfigured
+
+        middleware = cls(crawler.settings.get('WARC_REPLAY_PATH'), crawler.stats)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        helpers.warc_archive = self.archive
+
+    def spider_closed(self, spider):
+        helpers.warc_archive = None
+
+    def process_start_requests(self, start_requests, spider):
+        logger.info(f'Replaying the {len(self.archive.records)} responses '\
+                    f'recorded in {self.file_path}')
+        for index, record in enumerate(self.archive.records):
+            meta = record['meta']
+            if meta.get('discovery') == 'sitemap':
+                # sitemaps have nothing for the spider to parse
+                continue
+
+            if meta.get('rule') is None:
+                request = Request(record['url'], dont_filter=True)
+            else:
+                request = spider._build_request(meta['rule'], Link(record['url']))
+                request.dont_filter = True
+            if record['referer']:
+                request.headers['Referer'] = record['referer']
+            request.meta.update(meta)
+            request.meta['replay_offset'] = record['response_offset']
+            # the scheduler returns the earlier responses first
+            request.priority = -index
+            self.stats.inc_value('replay/response_count', spider=spider)
+            yield request
+
+    def process_spider_output(self, response, result, spider):
+        for request_or_item in result:
+            if not isinstance(request_or_item, Request):
+                yield request_or_item
+
+
+def _has_discovery(spider):
+    """ private helper.
+    checks if the crawler of 'spider' has sitemaps or listings to discover pages from """
+
+    return bool(getattr(spider, 'sitemap_urls', None) or getattr(spider, 'listings', None))
@@ -1,28 +1,126 @@
+""" module contains the items yielded by the parsers.
+
+A page may yield hundreds of resources, so the items are compact: they are dicts
+(which every Scrapy version passes to the spider middlewares and item pipelines) with
+no instance dict, restricted to their fields as scrapy Items are. They are serialized
+by `item_to_json()` straight from their values, without copying them """
+
 import os
 import json
 import hashlib
 
 from pathlib import Path
-from scrapy import Item, Field
+from scrapy import Field
+
+try:
+    # the faster encoder, for the compact JSON (e.g. of the 'segments' output layout)
+    import orjson
+except ImportError:
+    orjson = None
+
+# the fields which are not written out (e.g. the collection the
+# dataset belongs to, which the graph pipeline keeps track of)
+UNSERIALIZED_FIELDS = ('collection',)
+
+# the encoders, per (indent, separators)
+_encoders = dict()
+
+
+class Model(dict):
+    """ class is the base of the items.
+
+    The fields of an item are declared as scrapy Fields, and setting any other key
+    raises a KeyError, as with scrapy Items. The only attribute of an item is the
+    consumer which produced it, in a shared crawl (see `edscrapers.scrapers.base.shared`) """
+
+    # each model declares empty __slots__ too, so no item has an instance dict
+    __slots__ = ('_consumer',)
+
+    fields = dict()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        fields = dict(cls.fields)
+        for name, value in list(vars(cls).items()):
+            if isinstance(value, Field):
+                fields[name] = value
+                # as with scrapy Items, the fields are not attributes
+                delattr(cls, name)
+        cls.fields = fields
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        if args or kwargs:
+            self.update(*args, **kwargs)
+
+    def __setitem__(self, key, value):
+        if key not in self.fields:
+            raise KeyError(f'{self.__class__.__name__} does not support field: {key}')
+        super().__setitem__(key, value)
+
+    def update(self, *args, **kwargs):
+        values = dict(*args, **kwargs)
+        for key in values.keys() - self.fields.keys():
+            raise KeyError(f'{self.__class__.__name__} does not support field: {key}')
+        super().update(values)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def copy(self):
+        return self.__class__(self)
+
+    # as scrapy Items, the items are hashed by identity
+    __hash__ = object.__hash__
+
+
+def item_to_json(item, indent=2, separators=None):
+    """ returns the JSON of 'item', without its UNSERIALIZED_FIELDS.
+    The item is not changed, and its values (or those of its nested items) are not copied,
+    unless it has a field to leave out """
+
+    values = item
+    if any(item.get(field) for field in UNSERIALIZED_FIELDS):
+        values = {key: value for key, value in item.items() if key not in UNSERIALIZED_FIELDS}
+
+    if indent is None and separators == (',', ':') and orjson is not None:
+        return orjson.dumps(values).decode('utf-8')
+
+    if (indent, separators) not in _encoders:
+        _encoders[(indent, separators)] = json.JSONEncoder(indent=indent, separators=separators)
+    return _encoders[(indent, separators)].encode(values)
+
+
+class Source(Model):
+
+    __slots__ = ()
 
-class Source(Item):
     source_title = Field()
     source_id = Field()
     source_url = Field()
 
-class Collection(Item):
+class Collection(Model):
+
+    __slots__ = ()
 
     collection_title = Field()
     collection_id = Field()
     collection_url = Field()
     source = Field()
 
-class Publisher(Item):
+class Publisher(Model):
+
+    __slots__ = ()
+
     name = Field()
     subOrganizationOf = Field()
 
 
-class Dataset(Item):
+class Dataset(Model):
+
+    __slots__ = ()
 
     source_url = Field()
 
@@ -39,16 +137,13 @@ class Dataset(Item):
     saved_as_file = Field()
     publisher = Field()
 
-    def toJSON(self):
-        # dont convert the collection field to JSON
-        if self.__dict__['_values'].get('collection', None):
-            del self.__dict__['_values']['collection']
+    def toJSON(self, indent=2, separators=None):
+        return item_to_json(self, indent=indent, separators=separators)
 
-        return json.dumps(self, default=lambda o: o.__dict__['_values'],
-                          sort_keys=False, indent=2)
 
+class Resource(Model):
 
-class Resource(Item):
+    __slots__ = ()
 
     name = Field()
     url = Field()
@@ -56,3 +151,40 @@ class Resource(Item):
     description = Field()
     format = Field()
     headers = Field()
+
+
+class MetaHeader(Model):
+
+    __slots__ = ()
+
+    name = Field()
+    content = Field()
+
+
+class MetaItem(Model):
+
+    __slots__ = ()
+
+    name = Field()
+    content = Field()
+
+
+class MetaPage(Model):
+
+    __slots__ = ()
+
+    source_url = Field()
+
+    title = Field()
+    name = Field()
+    notes = Field()
+    resources = Field()
+
+    meta = Field()
+    headers = Field()
+    collection = Field()
+    saved_as_file = Field()
+    publisher = Field()
+
+    def toJSON(self, indent=2, separators=None):
+        return item_to_json(self, indent=indent, separators=separators)
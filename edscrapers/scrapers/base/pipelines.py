@@ -5,51 +5,126 @@ import hashlib
 from datetime import datetime
 from pathlib import Path
 from slugify import slugify
-from scrapy.exceptions import DropItem
+from scrapy.exceptions import DropItem, NotConfigured
 
 from edscrapers.cli import logger
+from edscrapers.scrapers.base import segments
+from edscrapers.scrapers.base.dedup import FingerprintStore, get_dedup_store_path
 from edscrapers.scrapers.base.graph import GraphWrapper
+from edscrapers.scrapers.base.writer import BackgroundWriter
+from edscrapers.scrapers.base.shared import get_consumers, get_consumer
 
 
+def get_dataset_file_path(dataset, scraper_name):
+    """ returns the (directory path, file name) of the JSON file the dataset
+    scraped by the 'scraper_name' scraper is written to (in the 'files' output layout) """
+
+    slug = slugify('-'.join(dataset['source_url'].split('/')[3:]))[:100] # restrict slug to 100 characters
+    hashed_url = hashlib.md5(dataset['source_url'].encode('utf-8')).hexdigest()
+    hashed_name = hashlib.md5(dataset['name'].encode('utf-8')).hexdigest()
+    file_name = f"{slug}-{hashed_url}-{hashed_name}.json"
+    if dataset.get('publisher') and (scraper_name == 'edgov' or scraper_name == 'sites'):
+        try:
+            name = dataset['publisher'].get('name', '')
+        except:
+            name = dataset['publisher']
+        dir_path = f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/{scraper_name}/{name}"
+    else:
+        if scraper_name in ['oese', 'osers', 'oela', 'octae', 'ope', 'opepd']:
+            dir_path = f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/edgov/{scraper_name}"
+        else:
+            dir_path = f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/{scraper_name}"
+    return dir_path, file_name
+
 
 class JsonWriterPipeline(object):
+    """ pipeline writes each dataset to the output, either as a JSON file of its own
+    (the 'files' OUTPUT_LAYOUT) or to the segments of the directory it belongs in
+    (the 'segments' OUTPUT_LAYOUT, see `edscrapers.scrapers.base.segments`).
+    The datasets are serialized here, and written by a background writer thread
+    (see `edscrapers.scrapers.base.writer`) """
 
     def open_spider(self, spider):
-        Path(f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/{spider.name}").\
-                                                  mkdir(parents=True, exist_ok=True)
+        self.layout = spider.settings.get('OUTPUT_LAYOUT', 'files')
+        self.created_dirs = set() # the output directories created so far
+        self.writers = dict() # the segment writers, per output directory
+        self.background_writer = BackgroundWriter.from_settings('datasets', spider.settings)
+        for consumer in get_consumers(spider):
+            Path(f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/{consumer.name}").\
+                                                      mkdir(parents=True, exist_ok=True)
 
     def close_spider(self, spider):
-        pass
+        # the segment writers are only used by the writer thread
+        self.background_writer.submit(self._close_writers)
+        return self.background_writer.close()
 
     def process_item(self, dataset, spider):
+        # the scraper which produced this dataset (when several scrapers share a crawl)
+        consumer = get_consumer(spider, dataset)
 
-        slug = slugify('-'.join(dataset['source_url'].split('/')[3:]))[:100] # restrict slug to 100 characters
-        hashed_url = hashlib.md5(dataset['source_url'].encode('utf-8')).hexdigest()
-        hashed_name = hashlib.md5(dataset['name'].encode('utf-8')).hexdigest()
-        file_name = f"{slug}-{hashed_url}-{hashed_name}.json"
-        if dataset.get('publisher') and (spider.name == 'edgov' or spider.name == 'sites'):
-            try:
-                name = dataset['publisher'].get('name', '')
-            except:
-                name = dataset['publisher']
-            Path(f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/{spider.name}/{name}").mkdir(parents=True, exist_ok=True)
-            file_path = f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/{spider.name}/{name}/{file_name}"
-        else:
-            if spider.name in ['oese', 'osers', 'oela', 'octae', 'ope', 'opepd']:
-                Path(f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/edgov/{spider.name}").mkdir(parents=True, exist_ok=True)
-                file_path = f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/edgov/{spider.name}/{file_name}"
-            else:
-                file_path = f"{os.getenv('ED_OUTPUT_PATH')}/scrapers/{spider.name}/{file_name}"
+        dir_path, file_name = get_dataset_file_path(dataset, consumer.name)
+        file_path = f"{dir_path}/{file_name}"
         self._log(dataset)
-        logger.debug(f"Dumping to {file_path}")
-        with open(file_path, 'w') as output:
-            output.write(dataset.toJSON())
+
+        if self.layout == 'segments':
+            logger.debug(f"Appending {file_name} to the segments of {dir_path}")
+            written = self.background_writer.submit(self._write_segment, dir_path, file_name,
+                                                    dataset.toJSON(indent=None, separators=(',', ':')),
+                                                    spider.settings)
+        else:
+            logger.debug(f"Dumping to {file_path}")
+            written = self.background_writer.submit(self._write_file, dir_path, file_path,
+                                                    dataset.toJSON())
         
         # add this attribute so that the saved (relative) location of datasets can be tracked
+        # (in the 'segments' layout, it is the id of the dataset in its segment store)
         dataset['saved_as_file'] = file_path[file_path.find("/scrapers/")+1 : ]
 
+        if self.background_writer.is_full:
+            # hold the dataset until it is written, so the crawl waits for the writer
+            return written.addCallback(lambda _: dataset)
         return dataset # return the dataset
 
+    def _write_file(self, dir_path, file_path, content):
+        """ private helper.
+        writes a dataset to its own file (on the writer thread) """
+
+        if dir_path not in self.created_dirs:
+            Path(dir_path).mkdir(parents=True, exist_ok=True)
+            self.created_dirs.add(dir_path)
+        with open(file_path, 'w') as output:
+            output.write(content)
+
+    def _write_segment(self, dir_path, file_name, line, settings):
+        """ private helper.
+        appends a dataset to the segments of its directory (on the writer thread) """
+
+        self._get_writer(dir_path, settings).write(file_name, line)
+
+    def _close_writers(self):
+        """ private helper.
+        closes the segment writers (on the writer thread) """
+
+        for writer in self.writers.values():
+            writer.close()
+        self.writers.clear()
+
+    def _get_writer(self, dir_path, settings):
+        """ private helper.
+        returns the segment writer of the 'dir_path' output directory """
+
+        if dir_path not in self.writers:
+            worker_index = None
+            if settings.getint('FLEET_WORKERS', 1) > 1:
+                # each worker of a crawl fleet writes its own segments
+                worker_index = settings.getint('FLEET_WORKER_INDEX')
+            self.writers[dir_path] = segments.SegmentWriter(segments.get_store_dir(dir_path),
+                                    max_bytes=settings.getint('SEGMENT_MAX_BYTES'),
+                                    flush_items=settings.getint('SEGMENT_FLUSH_ITEMS'),
+                                    flush_interval=settings.getfloat('SEGMENT_FLUSH_INTERVAL'),
+                                    worker_index=worker_index)
+        return self.writers[dir_path]
+
     def _log(self, d):
         logger.info("==================================================================================================")
         logger.success(f"{d['source_url']}")
@@ -64,8 +139,9 @@ class GraphItemPipeline:
 
     def open_spider(self, spider):
         # create the folder for storing graph files
-        Path(os.getenv('ED_OUTPUT_PATH'), "graphs", f"{spider.name}").\
-                                                  mkdir(parents=True, exist_ok=True)
+        for consumer in get_consumers(spider):
+            Path(os.getenv('ED_OUTPUT_PATH'), "graphs", f"{consumer.name}").\
+                                                      mkdir(parents=True, exist_ok=True)
         print("SPIDER STARTED")
         # setup the graph objet for this scraper
         # set the graph object as a class attribute
@@ -75,22 +151,48 @@ class GraphItemPipeline:
 
     def close_spider(self, spider):
         print("SPIDER CLOSED")
-        
-        # write the graph to files
-        # this method is explicitly thread/proccess safe, so no need for lock
-        GraphWrapper.write_graph(file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'), 
-                                                            "graphs", f"{spider.name}"),
-                                         file_stem_name=spider.name)
-        
-        # create the page legend file for this graph
-        # this method is explicitly thread/proccess safe, so no need for lock
-        GraphWrapper.create_graph_page_legend(file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'), 
-                                                            "graphs", f"{spider.name}"),
-                                         file_stem_name=spider.name)
+
+        # the graphs are written by a writer thread, so the reactor
+        # carries on (e.g. with the other spiders of the process)
+        background_writer = BackgroundWriter.from_settings('graphs', spider.settings)
+        background_writer.submit(self._write_graphs, spider)
+        return background_writer.close()
+
+    def _write_graphs(self, spider):
+        """ private helper.
+        writes the graph of each scraper of the crawl (on the writer thread) """
+
+        # each scraper sharing this crawl (if any) has its own graph
+        for consumer in get_consumers(spider):
+            graph_wrapper = getattr(consumer, 'graph_wrapper', GraphWrapper)
+
+            if spider.settings.getint('FLEET_WORKERS', 1) > 1:
+                # this spider is a worker of a crawl fleet, so only write its graph fragment.
+                # the fragments are merged into the crawl graph once the whole fleet is done
+                graph_wrapper.write_graph_fragment(file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'),
+                                                                      "graphs", f"{consumer.name}",
+                                                                      "fragments"),
+                                                   file_stem_name=consumer.name,
+                                                   worker_index=spider.settings.getint('FLEET_WORKER_INDEX'))
+                continue
+
+            # write the graph to files
+            # this method is explicitly thread/proccess safe, so no need for lock
+            graph_wrapper.write_graph(file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'),
+                                                         "graphs", f"{consumer.name}"),
+                                      file_stem_name=consumer.name)
+
+            # create the page legend file for this graph
+            # this method is explicitly thread/proccess safe, so no need for lock
+            graph_wrapper.create_graph_page_legend(file_dir_path=Path(os.getenv('ED_OUTPUT_PATH'),
+                                                                      "graphs", f"{consumer.name}"),
+                                                   file_stem_name=consumer.name)
             
 
     def process_item(self, dataset, spider):
-        
+        # the scraper which produced this dataset (when several scrapers share a crawl)
+        spider = get_consumer(spider, dataset)
+
         with spider.scraper_graph.graph_lock:
 
             # check if this dataset already exist, i.e. is this somehow a duplicate scrape of the dataset
@@ -129,13 +231,40 @@ class GraphItemPipeline:
 
 
 class DuplicatesPipeline(object):
+    """ pipeline drops the datasets which duplicate a dataset scraped (and
+    written) before, in this crawl or an earlier one, by any scraper, as the
+    deduplicate transformer would (see `edscrapers.scrapers.base.dedup`) """
 
-    def __init__(self):
-        self.ids_seen = set()
+    def __init__(self, stats):
+        self.stats = stats
 
-    def process_item(self, item, spider):
-        if item['id'] in self.ids_seen:
-            raise DropItem("Duplicate dataset found: %s" % item)
-        else:
-            self.ids_seen.add(item['source_url'])
-            return item
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('DEDUP_ENABLED', True):
+            raise NotConfigured
+        return cls(crawler.stats)
+
+    def open_spider(self, spider):
+        self.store = FingerprintStore(get_dedup_store_path())
+
+    def close_spider(self, spider):
+        self.store.close()
+
+    def process_item(self, dataset, spider):
+        # the scraper which produced this dataset (when several scrapers share a crawl)
+        consumer = get_consumer(spider, dataset)
+
+        # the printable versions of the pages are left out of the output anyway
+        if '/print/' in dataset['source_url']:
+            self.stats.inc_value('dedup/print_dropped', spider=spider)
+            raise DropItem(f"Printable page dataset: {dataset['source_url']}")
+
+        dir_path, file_name = get_dataset_file_path(dataset, consumer.name)
+        file_path = f"{dir_path}/{file_name}"
+        saved_as_file = file_path[file_path.find("/scrapers/")+1 : ]
+        duplicated_file = self.store.check(dataset['source_url'], dataset['name'], saved_as_file)
+        if duplicated_file:
+            self.stats.inc_value('dedup/dropped', spider=spider)
+            raise DropItem(f"Duplicate dataset found: {dataset['source_url']} "
+                           f"(already saved as {duplicated_file})")
+        return dataset
@@ -0,0 +1,115 @@
+""" module contains the persistent queue of the requests which failed
+(because of a timeout, a connection error or a 5xx response) during a crawl.
+
+The failed requests are retried with an exponential backoff once the crawl
+has nothing else to do (see `RetryLaneMiddleware`), and can be retried again
+by a later `eds scrape --retry-failed` (see `RetryFailedMiddleware`) """
+
+import os
+import time
+import sqlite3
+from pathlib import Path
+
+
+def get_retry_queue_path(name):
+    """ returns the path of the retry queue database for the 'name' crawl """
+
+    return Path(os.getenv('ED_OUTPUT_PATH'), 'scrapy', 'retry', f'{name}.sqlite')
+
+
+class RetryQueue():
+    """ class provides access to the retry queue of a crawl.
+
+    Each failed url is recorded with what is needed to rebuild its request
+    (referer, depth and crawler rule), the reason of its last failure, the number
+    of failed attempts and when it may be attempted next. Urls are flagged as
+    'scheduled' while their retry is in flight and as 'recovered' once retried successfully """
+
+    def __init__(self, file_path, reset=False):
+        file_path = Path(file_path)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        if file_path.exists() and reset:
+            file_path.unlink()
+
+        # autocommit mode; every statement is its own transaction
+        self.connection = sqlite3.connect(str(file_path), timeout=60, isolation_level=None)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS failed
+                                   (url TEXT PRIMARY KEY, referer TEXT, depth INTEGER,
+                                    rule INTEGER, reason TEXT, attempts INTEGER,
+                                    next_attempt_at REAL, scheduled INTEGER,
+                                    recovered INTEGER)''')
+
+    def record_failure(self, url, reason, backoff, referer=None, depth=0, rule=None):
+        """ record a failed attempt at 'url'. The next attempt is due after
+        'backoff' seconds, doubled for every previous failed attempt """
+
+        row = self.connection.execute('SELECT attempts FROM failed WHERE url = ?',
+                                      (url,)).fetchone()
+        attempts = (row[0] if row else 0) + 1
+        self.connection.execute('''INSERT OR REPLACE INTO failed
+                                   (url, referer, depth, rule, reason, attempts,
+                                    next_attempt_at, scheduled, recovered)
+                                   VALUES (?, ?, ?, ?, ?, ?, ?, 0, 0)''',
+                                (url, referer, depth, rule, reason, attempts,
+                                 time.time() + backoff * 2 ** (attempts - 1)))
+        return attempts
+
+    def record_recovery(self, url):
+        """ flag 'url' as recovered. Returns False if 'url' was not in the queue """
+
+        cursor = self.connection.execute('''UPDATE failed SET recovered = 1, scheduled = 0
+                                            WHERE url = ? AND recovered = 0''', (url,))
+        return cursor.rowcount > 0
+
+    def give_up(self, url, reason):
+        """ record a failed attempt at 'url' which is not worth retrying
+        (e.g. an ignored request). 'url' is no longer scheduled, and is not
+        due for another attempt until the attempts are reset """
+
+        self.connection.execute('''UPDATE failed SET reason = ?, attempts = attempts + 1,
+                                   scheduled = 0, next_attempt_at = NULL
+                                   WHERE url = ? AND recovered = 0''', (reason, url))
+
+    def schedule_due(self, max_attempts, limit=1000):
+        """ flags (at most 'limit') urls which are due for another attempt as scheduled.
+        Returns a list of (url, referer, depth, rule) tuples """
+
+        self.connection.execute('BEGIN IMMEDIATE')
+        rows = self.connection.execute('''SELECT url, referer, depth, rule FROM failed
+                                          WHERE recovered = 0 AND scheduled = 0
+                                          AND attempts < ? AND next_attempt_at <= ?
+                                          ORDER BY next_attempt_at LIMIT ?''',
+                                       (max_attempts, time.time(), limit)).fetchall()
+        self.connection.executemany('UPDATE failed SET scheduled = 1 WHERE url = ?',
+                                    [(row[0],) for row in rows])
+        self.connection.execute('COMMIT')
+        return rows
+
+    def has_pending(self, max_attempts):
+        """ checks if there are urls which are due for another attempt, or will be once
+        their backoff is over. The scheduled urls are not counted: their attempt either
+        recovers them or fails, making them due again """
+
+        return self.connection.execute('''SELECT COUNT(*) FROM failed
+                                          WHERE recovered = 0 AND scheduled = 0
+                                          AND attempts < ? AND next_attempt_at IS NOT NULL''',
+                                       (max_attempts,)).fetchone()[0] > 0
+
+    def reset_attempts(self):
+        """ make all the unrecovered urls due for a new series of attempts.
+        Returns a list of (url, referer, depth, rule) tuples for these urls """
+
+        self.connection.execute('''UPDATE failed SET attempts = 0, scheduled = 1,
+                                   next_attempt_at = 0 WHERE recovered = 0''')
+        return self.connection.execute('''SELECT url, referer, depth, rule FROM failed
+                                          WHERE recovered = 0 ORDER BY url''').fetchall()
+
+    def get_unrecovered(self):
+        """ returns a list of (url, referer, reason, attempts) tuples
+        for the urls which were never recovered """
+
+        return self.connection.execute('''SELECT url, referer, reason, attempts FROM failed
+                                          WHERE recovered = 0 ORDER BY url''').fetchall()
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,220 @@
+""" module contains the segment layout of the scraper output
+(see `eds scrape --output-layout segments`).
+
+Rather than as one (indented) JSON file per dataset, the datasets are appended
+as compact JSON lines to segment files ('segment-00001.jsonl', ...), which are
+rotated once they reach SEGMENT_MAX_BYTES. Each dataset keeps the path it has in
+the file layout (e.g. '<ED_OUTPUT_PATH>/scrapers/nces/<file name>.json') as its id:
+the segment store ('_segments') is in the directory the dataset file would be in,
+and its index maps the file name of each dataset to its segment, offset and length.
+So a dataset is read from its path in either layout (see `read_dataset()`).
+
+Writes are buffered and flushed (and fsync'ed) in batches, the segments before
+the index, so the index never refers to data which is not on disk. A dataset written
+again (e.g. by a later crawl) is appended again, the latest index entry wins.
+Each worker of a crawl fleet writes its own segments and index """
+
+import os
+import json
+import atexit
+import time
+import threading
+from pathlib import Path
+
+STORE_DIR_NAME = '_segments'
+
+# the index of each store read so far, with the sizes of its index files when it was read
+_indexes = dict()
+# the segment files opened for reading
+_segment_files = dict()
+# the writers used by `write_dataset()`, per store
+_writers = dict()
+# guards the above, as datasets may be read from several threads (e.g. read ahead by a transformer)
+_lock = threading.RLock()
+
+
+class SegmentWriter():
+    """ class appends datasets (as JSON lines) to the segments of a store.
+    'worker_index' is set for the writer of a worker of a crawl fleet """
+
+    def __init__(self, store_dir, max_bytes=64 * 1024 * 1024, flush_items=100,
+                 flush_interval=5, worker_index=None):
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.flush_items = flush_items
+        self.flush_interval = flush_interval
+
+        suffix = '' if worker_index is None else f'.worker-{worker_index}'
+        self.segment_prefix = f'segment{suffix}-'
+        self.index_file = open(Path(self.store_dir, f'index{suffix}.tsv'), 'a', encoding='utf-8')
+
+        # carry on with the latest segment of the writer
+        segment_numbers = [int(path.stem[len(self.segment_prefix):])
+                           for path in self.store_dir.glob(f'{self.segment_prefix}*.jsonl')
+                           if path.stem[len(self.segment_prefix):].isdigit()]
+        self.segment_number = max(segment_numbers, default=1)
+        self._open_segment()
+
+        self.buffer = [] # the lines waiting to be written to the segment
+        self.index_buffer = [] # the entries waiting to be written to the index
+        self.flushed_at = time.time()
+
+    def _open_segment(self):
+        """ private helper.
+        opens the current segment (for appending) """
+
+        self.segment_name = f'{self.segment_prefix}{self.segment_number:05d}.jsonl'
+        self.segment_file = open(Path(self.store_dir, self.segment_name), 'ab')
+        self.position = self.segment_file.tell()
+
+    def write(self, file_name, line):
+        """ appends the dataset with the file name 'file_name' (i.e. its
+        name in the file layout) and the JSON (single) 'line' """
+
+        data = line.encode('utf-8') + b'\n'
+        if self.position and self.position + len(data) > self.max_bytes:
+            # the buffered lines belong to the current segment
+            self.flush()
+            self.segment_file.close()
+            self.segment_number += 1
+            self._open_segment()
+
+        self.buffer.append(data)
+        self.index_buffer.append(f'{file_name}\t{self.segment_name}\t{self.position}\t{len(data) - 1}\n')
+        self.position += len(data)
+
+        if len(self.buffer) >= self.flush_items or\
+            time.time() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """ writes the buffered datasets to disk """
+
+        self.flushed_at = time.time()
+        if not self.buffer:
+            return
+
+        self.segment_file.write(b''.join(self.buffer))
+        self.segment_file.flush()
+        os.fsync(self.segment_file.fileno())
+        self.index_file.write(''.join(self.index_buffer))
+        self.index_file.flush()
+        os.fsync(self.index_file.fileno())
+        self.buffer = []
+        self.index_buffer = []
+
+    def close(self):
+        self.flush()
+        self.segment_file.close()
+        self.index_file.close()
+
+
+def get_store_dir(dir_path):
+    """ returns the segment store of the datasets of the 'dir_path' directory """
+
+    return Path(dir_path, STORE_DIR_NAME)
+
+
+def read_index(store_dir):
+    """ returns the index of the 'store_dir' store, i.e. a dict mapping the
+    file name of each dataset to its (segment, offset, length).
+    The index is read again only when its files have changed """
+
+    with _lock:
+        store_dir = Path(store_dir)
+        if store_dir in _writers:
+            # what was written in this process is read too
+            _writers[store_dir].flush()
+
+        try:
+            index_paths = sorted(store_dir.glob('index*.tsv'))
+            sizes = tuple(path.stat().st_size for path in index_paths)
+        except OSError:
+            return dict()
+        if store_dir in _indexes and _indexes[store_dir][0] == sizes:
+            return _indexes[store_dir][1]
+
+        index = dict()
+        for index_path in index_paths:
+            with open(index_path, 'r', encoding='utf-8') as index_file:
+                for line in index_file:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) != 4: # a line which was not completely written
+                        continue
+                    index[fields[0]] = (fields[1], int(fields[2]), int(fields[3]))
+        _indexes[store_dir] = (sizes, index)
+    return index
+
+
+def read_dataset(file_path):
+    """ returns the dataset with the 'file_path' path (in the file
+    layout) from its segment store, or None if it is not in a store """
+
+    file_path = Path(file_path)
+    store_dir = get_store_dir(file_path.parent)
+    entry = read_index(store_dir).get(file_path.name)
+    if entry is None:
+        return None
+
+    segment_name, offset, length = entry
+    segment_path = Path(store_dir, segment_name)
+    with _lock:
+        if segment_path not in _segment_files:
+            _segment_files[segment_path] = open(segment_path, 'rb')
+        segment_file = _segment_files[segment_path]
+        segment_file.seek(offset)
+        line = segment_file.read(length)
+    return json.loads(line)
+
+
+def has_dataset(file_path):
+    """ returns whether the dataset with the 'file_path' path (in the file layout) is in its segment store """
+
+    file_path = Path(file_path)
+    return file_path.name in read_index(get_store_dir(file_path.parent))
+
+
+def write_dataset(file_path, data):
+    """ writes 'data' as the dataset with the 'file_path'
+    path (in the file layout) to its segment store """
+
+    file_path = Path(file_path)
+    store_dir = get_store_dir(file_path.parent)
+    line = json.dumps(data, separators=(',', ':'))
+    with _lock:
+        if store_dir not in _writers:
+            if not _writers:
+                atexit.register(close_writers)
+            _writers[store_dir] = SegmentWriter(store_dir)
+        _writers[store_dir].write(file_path.name, line)
+
+
+def close_writers():
+    """ closes the writers used by `write_dataset()` """
+
+    with _lock:
+        for writer in _writers.values():
+            writer.close()
+        _writers.clear()
+
+
+def iter_dataset_paths(dir_path):
+    """ iterates over the paths (in the file layout) of
+    the datasets in the segment stores below 'dir_path' """
+
+    for store_dir in sorted(Path(dir_path).rglob(STORE_DIR_NAME)):
+        for file_name in read_index(store_dir):
+            yield Path(store_dir.parent, file_name)
+
+
+def export_datasets(dir_path):
+    """ writes each dataset in the segment stores below 'dir_path' to its
+    own (indented) JSON file, as in the file layout. Returns the number of datasets """
+
+    count = 0
+    for file_path in iter_dataset_paths(dir_path):
+        with open(file_path, 'w') as output:
+            output.write(json.dumps(read_dataset(file_path), indent=2))
+        count += 1
+    return count
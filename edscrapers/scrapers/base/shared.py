@@ -0,0 +1,148 @@
+""" module contains the classes and functions used to run several
+scrapers with overlapping scopes (e.g. edgov and edgov_meta) as a single crawl.
+
+Every page is downloaded once and fed to the parser of each scraper
+(i.e. 'consumer') whose rules would have followed the link to it. Each consumer
+keeps its own output directory and graph, as if it had been crawled on its own """
+
+import re
+import importlib
+
+from scrapy.spiders import Rule
+from scrapy.spiders import CrawlSpider
+from scrapy.utils.url import url_has_any_extension
+
+from edscrapers.scrapers.base.graph import GraphWrapper
+from edscrapers.scrapers.base.models import Model
+
+
+def load_crawler(name):
+    """ returns the crawler class for 'name'.
+    'name' can be a comma-separated list of scraper names (e.g. 'edgov,edgov_meta'),
+    in which case a crawler sharing its downloads between the scrapers is returned """
+
+    names = [consumer_name.strip() for consumer_name in name.split(',') if consumer_name.strip()]
+    if len(names) == 1:
+        return importlib.import_module(f'edscrapers.scrapers.{names[0]}').Crawler
+
+    # the throttling profiles of the hosts crawled by the scrapers
+    host_profiles = dict()
+    for consumer_name in names:
+        consumer_class = importlib.import_module(f'edscrapers.scrapers.{consumer_name}').Crawler
+        host_profiles.update((consumer_class.custom_settings or dict()).\
+                             get('ADAPTIVE_THROTTLE_HOSTS', dict()))
+
+    return type('Crawler', (SharedFetchCrawler,),
+                {'name': '+'.join(names), 'consumer_names': names,
+                 'custom_settings': {'ADAPTIVE_THROTTLE_HOSTS': host_profiles}})
+
+
+def get_consumers(spider, url=None):
+    """ returns the consumers of 'spider' (or 'spider' itself if it is
+    not a shared crawler). If 'url' is provided, only the consumers
+    whose scope includes 'url' are returned """
+
+    consumers = getattr(spider, 'consumers', None)
+    if consumers is None:
+        return [spider]
+    if url is None:
+        return consumers
+    return [consumer for consumer in consumers
+            if url in consumer.start_urls or get_consumer_rule(consumer, url)]
+
+
+def get_consumer(spider, item):
+    """ returns the consumer (of 'spider') which produced 'item' """
+
+    consumers = getattr(spider, 'consumers', None)
+    if consumers is None:
+        return spider
+    return next(consumer for consumer in consumers
+                if consumer.name == getattr(item, '_consumer', None))
+
+
+def get_consumer_rule(consumer, url):
+    """ returns the first rule of 'consumer' whose link extractor
+    would have followed a link to 'url', or None """
+
+    allowed_regex = getattr(consumer, 'allowed_regex', None)
+    if allowed_regex and not re.search(allowed_regex, url):
+        return None
+
+    for rule in consumer._rules:
+        extractor = rule.link_extractor
+        if extractor.deny_extensions and url_has_any_extension(url, extractor.deny_extensions):
+            continue
+        if extractor.matches(url):
+            return rule
+    return None
+
+
+class SharedFetchCrawler(CrawlSpider):
+    """ crawler for the union of the scopes of several scrapers ('consumer_names').
+
+    Links are followed if any of the consumers would have followed them,
+    and each downloaded page is parsed by every consumer whose rules accept it.
+    The items produced are tagged with the name of their consumer, so the
+    pipelines can route them to the consumer's output directory and graph """
+
+    consumer_names = []
+
+    def __init__(self):
+
+        self.consumers = []
+        for consumer_name in self.consumer_names:
+            consumer = importlib.import_module(f'edscrapers.scrapers.{consumer_name}').Crawler()
+            # each consumer keeps its own graph
+            consumer.graph_wrapper = GraphWrapper.create_wrapper()
+            consumer.scraper_graph = consumer.graph_wrapper.get_graph()
+            self.consumers.append(consumer)
+
+        self.start_urls = []
+        for consumer in self.consumers:
+            self.start_urls.extend(url for url in consumer.start_urls
+                                   if url not in self.start_urls)
+
+        # the union of the consumers' sitemaps and listings (see `DiscoveryMiddleware`)
+        self.sitemap_urls = []
+        self.listings = []
+        for consumer in self.consumers:
+            self.sitemap_urls.extend(url for url in getattr(consumer, 'sitemap_urls', [])
+                                     if url not in self.sitemap_urls)
+            self.listings.extend(listing for listing in getattr(consumer, 'listings', [])
+                                 if listing not in self.listings)
+
+        # the union of the consumers' offsite filters
+        if all(getattr(consumer, 'allowed_domains', None) for consumer in self.consumers):
+            self.allowed_domains = sorted({domain for consumer in self.consumers
+                                           for domain in consumer.allowed_domains})
+        if all(getattr(consumer, 'allowed_regex', None) for consumer in self.consumers):
+            self.allowed_regex = '|'.join(f'(?:{consumer.allowed_regex})'
+                                          for consumer in self.consumers)
+
+        # Make rules
+        self.rules = [Rule(rule.link_extractor, callback=self.parse_shared, follow=True)
+                      for consumer in self.consumers for rule in consumer._rules]
+
+        # Inherit parent
+        super(SharedFetchCrawler, self).__init__()
+
+    def parse_shared(self, response):
+        """ feeds 'response' to the parser of every consumer whose rules accept it """
+
+        for consumer in self.consumers:
+            rule = get_consumer_rule(consumer, response.url)
+            if rule is None or rule.callback is None:
+                continue
+
+            result = rule.callback(response, **rule.cb_kwargs)
+            if result is None:
+                continue
+            if isinstance(result, dict):
+                result = [result]
+
+            for item in result:
+                if isinstance(item, Model):
+                    # tag the item with the consumer which produced it
+                    item._consumer = consumer.name
+                yield item
@@ -0,0 +1,265 @@
+""" module contains the helpers used to record the responses of a crawl
+in a WARC file (see `WarcRecorderMiddleware`) and to replay them, without
+any network, through the spider middlewares, parsers and pipelines of
+the crawler (see `WarcReplayMiddleware` and `WarcReplayDownloadHandler`).
+
+Each response is recorded as a 'response' record, followed by a 'metadata'
+record (json) with what is needed to replay it: its Referer, the
+(json serializable) meta of its request and the offset of the 'response'
+record in the file. In a '.warc.gz' file, every record is a separate gzip
+member, so a record can be read from its offset alone.
+
+The requests made by the parsers themselves (see `helpers.request_url()`)
+are recorded as 'lookups', which are not replayed as pages of the crawl but
+returned to the parsers when they make the same requests again """
+
+import json
+import gzip
+import uuid
+from pathlib import Path
+from datetime import datetime, timezone
+from http.client import responses as http_reasons
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+
+# the request meta which are not recorded (they are set again when replaying)
+UNRECORDED_META = ('depth_limit', 'replay_offset', 'retry_url')
+
+# the archives opened by `open_archive()`, per path
+_archives = dict()
+
+
+class WarcWriter():
+    """ class writes the responses of a crawl to a WARC (1.0) file,
+    which is gzipped (record by record) if its name ends with '.gz' """
+
+    def __init__(self, file_path):
+        file_path = Path(file_path)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        self.gzipped = file_path.suffix == '.gz'
+        self.file = open(file_path, 'wb')
+        self.count = 0
+
+        self.write_record('warcinfo', None, 'application/warc-fields',
+                          'software: edscrapers\r\nformat: WARC File Format 1.0\r\n'.encode('utf-8'),
+                          extra_headers={'WARC-Filename': file_path.name})
+
+    def write_record(self, record_type, target_uri, content_type, block, extra_headers=None):
+        """ writes a record and returns its (id, offset) """
+
+        record_id = f'<urn:uuid:{uuid.uuid4()}>'
+        headers = {
+            'WARC-Type': record_type,
+            'WARC-Record-ID': record_id,
+            'WARC-Date': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        }
+        if target_uri:
+            headers['WARC-Target-URI'] = target_uri
+        headers.update(extra_headers or {})
+        headers['Content-Type'] = content_type
+        headers['Content-Length'] = str(len(block))
+
+        head = 'WARC/1.0\r\n' + ''.join(f'{key}: {value}\r\n' for key, value in headers.items())
+        data = head.encode('utf-8') + b'\r\n' + block + b'\r\n\r\n'
+        offset = self.file.tell()
+        self.file.write(gzip.compress(data) if self.gzipped else data)
+        return record_id, offset
+
+    def write_response(self, url, status, headers, body, metadata):
+        """ writes the 'response' record (with the (name, value) 'headers')
+        and the 'metadata' record of a response """
+
+        header_lines = [f'HTTP/1.1 {status} {http_reasons.get(status, "")}']
+        header_lines.extend(f'{key}: {value}' for key, value in headers)
+        block = ('\r\n'.join(header_lines) + '\r\n\r\n').encode('latin-1') + body
+
+        record_id, offset = self.write_record('response', url,
+                                              'application/http; msgtype=response', block)
+        metadata = dict(metadata, url=url, response_offset=offset)
+        self.write_record('metadata', url, 'application/json',
+                          json.dumps(metadata).encode('utf-8'),
+                          extra_headers={'WARC-Concurrent-To': record_id})
+
+    def record_response(self, response, referer=None, meta=None):
+        """ records a (Scrapy) 'response' of the crawl """
+
+        headers = [(str(key, encoding='latin-1'), str(value, encoding='latin-1'))
+                   for key, values in response.headers.items()
+                   if key.lower() not in (b'content-length', b'transfer-encoding')
+                   for value in values]
+        # the body has been decompressed already (by the HttpCompressionMiddleware)
+        headers.append(('Content-Length', str(len(response.body))))
+        self.write_response(response.url, response.status, headers, response.body,
+                            {'referer': referer, 'meta': get_recorded_meta(meta or {})})
+        self.count += 1
+
+    def record_lookup(self, method, url, response):
+        """ records the (requests) 'response' of a request made by a parser """
+
+        if method == 'HEAD':
+            # the headers of a HEAD response describe the resource, not a body
+            headers = list(response.headers.items())
+        else:
+            headers = [(key, value) for key, value in response.headers.items()
+                       if key.lower() not in ('content-length', 'content-encoding',
+                                              'transfer-encoding')]
+            # the content has been decompressed already
+            headers.append(('Content-Length', str(len(response.content))))
+        self.write_response(url, response.status_code, headers, response.content,
+                            {'lookup': method})
+
+    def close(self):
+        self.file.close()
+
+
+class WarcArchive():
+    """ class provides the responses recorded in a WARC file: the responses of the
+    crawl (in crawl order) and the responses of the requests made by the parsers """
+
+    def __init__(self, file_path):
+        self.file = open(file_path, 'rb')
+        # the 'metadata' records of the responses of the crawl
+        self.records = []
+        # the offsets of the responses of the parsers' requests, per (method, url)
+        self.lookups = dict()
+        for record in iter_recorded_responses(file_path):
+            if record.get('lookup'):
+                self.lookups[(record['lookup'], record['url'])] = record['response_offset']
+            else:
+                self.records.append(record)
+
+    def read_response(self, offset, request=None):
+        """ returns the (Scrapy) response recorded at 'offset' """
+
+        headers, block = read_record_at(self.file, offset)
+        url = headers['WARC-Target-URI']
+        status, response_headers, body = parse_http_response(block)
+        response_class = responsetypes.from_args(headers=response_headers, url=url, body=body)
+        return response_class(url=url, status=status, headers=response_headers,
+                              body=body, request=request)
+
+    def get_lookup(self, method, url):
+        """ returns the (requests) response recorded for a request made by
+        a parser, or None if the request was not recorded """
+
+        offset = self.lookups.get((method, url))
+        if offset is None:
+            return None
+
+        _, block = read_record_at(self.file, offset)
+        status, headers, body = parse_http_response(block)
+        response = requests.Response()
+        response.url = url
+        response.status_code = status
+        response.headers = CaseInsensitiveDict({str(key, encoding='latin-1'):
+                                                str(b','.join(values), encoding='latin-1')
+                                                for key, values in headers.items()})
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = body
+        return response
+
+    def close(self):
+        self.file.close()
+
+
+def open_archive(file_path):
+    """ returns the WarcArchive of 'file_path', which is opened once
+    (and shared by the replay middleware, download handler and parsers) """
+
+    file_path = str(Path(file_path).resolve())
+    if file_path not in _archives:
+        _archives[file_path] = WarcArchive(file_path)
+    return _archives[file_path]
+
+
+def get_recorded_meta(meta):
+    """ returns the part of the request 'meta' which is recorded,
+    i.e. the json serializable values set by the crawl itself """
+
+    recorded_meta = dict()
+    for key, value in meta.items():
+        if key.startswith('_') or key.startswith('download_') or key in UNRECORDED_META:
+            continue
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            continue
+        recorded_meta[key] = value
+    return recorded_meta
+
+
+def read_record(stream):
+    """ reads the record at the current position of the (uncompressed) 'stream'.
+    Returns a (headers, block) tuple, or None at the end of the stream """
+
+    line = stream.readline()
+    while line in (b'\r\n', b'\n'): # the end of the previous record
+        line = stream.readline()
+    if not line:
+        return None
+    if not line.startswith(b'WARC/'):
+        raise ValueError(f'Invalid WARC record: {line[:50]}')
+
+    headers = dict()
+    for line in iter(stream.readline, b''):
+        line = line.rstrip(b'\r\n')
+        if not line:
+            break
+        key, _, value = str(line, encoding='utf-8').partition(':')
+        headers[key.strip()] = value.strip()
+
+    block = stream.read(int(headers.get('Content-Length', 0)))
+    return headers, block
+
+
+def read_record_at(file, offset):
+    """ reads the record at 'offset' of the (opened) WARC 'file' """
+
+    file.seek(offset)
+    if file.read(2) == b'\x1f\x8b':
+        file.seek(offset)
+        return read_record(gzip.GzipFile(fileobj=file))
+    file.seek(offset)
+    return read_record(file)
+
+
+def iter_records(file_path):
+    """ iterates over the (headers, block) records of a WARC file """
+
+    with open(file_path, 'rb') as file:
+        gzipped = file.read(2) == b'\x1f\x8b'
+    # a gzip file with several members is read as a single stream
+    with (gzip.open(file_path, 'rb') if gzipped else open(file_path, 'rb')) as stream:
+        while True:
+            record = read_record(stream)
+            if record is None:
+                return
+            yield record
+
+
+def iter_recorded_responses(file_path):
+    """ iterates over the 'metadata' records (as dicts)
+    of the responses recorded in a WARC file, in crawl order """
+
+    for headers, block in iter_records(file_path):
+        if headers.get('WARC-Type') == 'metadata' and\
+            headers.get('Content-Type') == 'application/json':
+            yield json.loads(block)
+
+
+def parse_http_response(block):
+    """ returns the (status, Headers, body) of the
+    block of a 'response' record """
+
+    head, _, body = block.partition(b'\r\n\r\n')
+    lines = head.split(b'\r\n')
+    status = int(lines[0].split()[1])
+    headers = Headers()
+    for line in lines[1:]:
+        key, _, value = line.partition(b':')
+        headers.appendlist(key.strip(), value.strip())
+    return status, headers, body
@@ -0,0 +1,101 @@
+""" module contains the background writer of the item pipelines.
+
+The pipelines hand their disk writes (e.g. the JSON of a dataset, serialized on the
+reactor thread) to a writer thread, so the writes overlap with the downloading and
+parsing rather than stall the Twisted reactor. Items are passed on right away while
+fewer than BACKGROUND_WRITER_QUEUE_SIZE writes are pending; past that, an item waits
+for its own write, which keeps it in the scraper slot and, in turn, slows the downloads
+down (back-pressure) until the writer catches up """
+
+import queue
+import threading
+
+from twisted.internet import defer, reactor
+
+from edscrapers.cli import logger
+
+# put in the queue to stop the writer thread
+_STOP = object()
+
+
+class BackgroundWriter():
+    """ class runs the writes submitted to it, in order, in a thread of its own.
+    With 'enabled' unset, the writes are run right away on the calling thread """
+
+    def __init__(self, name, queue_size=100, enabled=True):
+        self.name = name
+        self.queue_size = queue_size
+        self.enabled = enabled
+        self.pending = 0 # the writes submitted and not done yet
+        self.failures = 0
+        self.queue = queue.Queue()
+        self.thread = None
+        if enabled:
+            self.thread = threading.Thread(target=self._run, name=f'{name}-writer', daemon=True)
+            self.thread.start()
+
+    @classmethod
+    def from_settings(cls, name, settings):
+        return cls(name, queue_size=settings.getint('BACKGROUND_WRITER_QUEUE_SIZE', 100),
+                   enabled=settings.getbool('BACKGROUND_WRITER_ENABLED', True))
+
+    @property
+    def is_full(self):
+        """ whether the writes submitted should be waited for """
+
+        return self.pending >= self.queue_size
+
+    def submit(self, write, *args, **kwargs):
+        """ submits the 'write' function (called with 'args' and 'kwargs') to the
+        writer. Returns a Deferred which fires (with None) once it has been run.
+        A failing write is logged, and does not fail the Deferred """
+
+        deferred = defer.Deferred()
+        if not self.enabled:
+            self._call(write, args, kwargs)
+            deferred.callback(None)
+            return deferred
+
+        self.pending += 1
+        self.queue.put((write, args, kwargs, deferred))
+        return deferred
+
+    def close(self):
+        """ stops the writer once the writes submitted are done.
+        Returns a Deferred which fires then """
+
+        if not self.enabled or self.thread is None:
+            return defer.succeed(None)
+        deferred = self.submit(lambda: None)
+        self.queue.put(_STOP)
+        self.thread = None
+        return deferred
+
+    def _call(self, write, args, kwargs):
+        """ private helper.
+        runs a write, logging its failure """
+
+        try:
+            write(*args, **kwargs)
+        except Exception as e:
+            self.failures += 1
+            logger.error(f'The {self.name} writer failed to write: {e!r}')
+
+    def _run(self):
+        """ private helper.
+        the loop of the writer thread """
+
+        while True:
+            task = self.queue.get()
+            if task is _STOP:
+                return
+            write, args, kwargs, deferred = task
+            self._call(write, args, kwargs)
+            reactor.callFromThread(self._done, deferred)
+
+    def _done(self, deferred):
+        """ private helper.
+        called on the reactor thread once a write is done """
+
+        self.pending -= 1
+        deferred.callback(None)
@@ -16,6 +16,20 @@ class Crawler(CrawlSpider):
     allowed_regex = r'^http.*://[w2\.]*ed\.gov/.*$'
     # allowed_domains = ['ed.gov', 'www2.ed.gov']
 
+    # with --discovery, pages are discovered from the sitemaps of www2.ed.gov
+    # (see `DiscoveryMiddleware`)
+    sitemap_urls = [
+        'https://www2.ed.gov/robots.txt',
+        'https://www2.ed.gov/sitemap.xml',
+    ]
+
+    # www2.ed.gov is a legacy host, so go easy on it
+    custom_settings = {
+        'ADAPTIVE_THROTTLE_HOSTS': {
+            'www2.ed.gov': {'target_latency': 3.0, 'min_delay': 0.5, 'max_concurrency': 2},
+        },
+    }
+
     def __init__(self):
 
         self.start_urls = [
@@ -10,11 +10,13 @@ import bs4
 
 from edscrapers.scrapers import base
 import edscrapers.scrapers.base.parser as base_parser
+from edscrapers.scrapers.base.cache import memoize_parse
 from edscrapers.scrapers.edgov.octae import parsers
 
 # contains list of data resources to exclude from dataset
 deny_list = []
 
+@memoize_parse
 def parse(res, publisher={'name': 'octae', 'subOrganizationOf': None}):
     """ function parses content to create a dataset model
     or return None if no resource in content"""
@@ -5,10 +5,12 @@ from datetime import datetime
 
 from edscrapers.cli import logger
 import edscrapers.scrapers.base.parser as base_parser
+from edscrapers.scrapers.base.cache import memoize_parse
 from edscrapers.scrapers.edgov.osers import parsers
 
 deny_list = []
 
+@memoize_parse
 def parse(res, publisher={'name': 'osers', 'subOrganizationOf': None}):
 
     """ function parses content to create a dataset model
@@ -11,6 +11,7 @@ import bs4
 
 from edscrapers.scrapers import base
 import edscrapers.scrapers.base.parser as base_parser
+from edscrapers.scrapers.base.cache import memoize_parse
 from edscrapers.scrapers.edgov import parsers
 from edscrapers.scrapers.edgov.offices_map import offices_map
 from edscrapers.scrapers.base.models import Publisher
@@ -19,11 +20,21 @@ edgov_parsers = ['octae', 'oela', 'oese', 'ope', 'opepd', 'osers']
 
 def parse(res):
     """ function parses content to create a dataset model
-    or return None if no resource in content"""
+    or return None if no resource in content.
+    The url is checked before the memoized `_parse()`,
+    as its cache entries are keyed on the page body """
 
     if '/print/' in res.url:
         return None
 
+    return _parse(res)
+
+
+@memoize_parse
+def _parse(res):
+    """ function is a private helper.
+    function parses the content of a page (see `parse()`) """
+
     soup_parser = bs4.BeautifulSoup(res.text, 'html5lib')
 
     try:
@@ -17,6 +17,20 @@ class Crawler(CrawlSpider):
     allowed_domains = ['studentaid.gov']
     depth = 10
 
+    # with --discovery, pages are discovered from the sitemaps of studentaid.gov
+    # (see `DiscoveryMiddleware`)
+    sitemap_urls = [
+        'https://studentaid.gov/robots.txt',
+        'https://studentaid.gov/sitemap.xml',
+    ]
+
+    # studentaid.gov is a modern, fast host
+    custom_settings = {
+        'ADAPTIVE_THROTTLE_HOSTS': {
+            'studentaid.gov': {'target_latency': 1.0, 'min_delay': 0, 'max_concurrency': 8},
+        },
+    }
+
     def __init__(self):
 
         self.start_urls = [
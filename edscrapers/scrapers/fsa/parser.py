@@ -16,10 +16,12 @@ from edscrapers.cli import logger
 import edscrapers.scrapers.base.helpers as h
 from edscrapers.scrapers import base
 import edscrapers.scrapers.base.parser as base_parser
+from edscrapers.scrapers.base.cache import memoize_parse
 from edscrapers.scrapers.fsa import parsers
 from edscrapers.scrapers.base.models import Dataset
 
 
+@memoize_parse
 def parse(res):
     """ function parses content to create a dataset model
     or return None if no resource in content"""
@@ -16,6 +16,19 @@ class Crawler(CrawlSpider):
     allowed_regex = r'(nces|ies)\.ed\.gov'
     allowed_domains = ['nces.ed.gov','ies.ed.gov']
 
+    # with --discovery, the publications are discovered from the (paginated) results
+    # of the publication search (see `DiscoveryMiddleware`)
+    listings = [{
+        'url': 'https://nces.ed.gov/pubsearch/index.asp?PubSectionID=1&HasSearched=1&pubspagenum=1&sort=3&order=0&L1=&L2=&searchstring=&searchtype=AND&searchcat2=&searchcat=title&pagesize=15&searchmonth=3&searchyear=2018&datetype=ge&pubtype=010&surveyname=&surveyid=&centername=NCES&center=NCES',
+        'page_param': 'pubspagenum',
+        'allow': r'pubsinfo\.asp\?pubid=',
+    }]
+
+    # the data tools (and tables library) are not listed, so their links are still followed
+    custom_settings = {
+        'DISCOVERY_CRAWL_START_URLS': True,
+    }
+
     def __init__(self):
 
         self.start_urls = [
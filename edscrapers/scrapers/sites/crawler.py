@@ -16,6 +16,13 @@ class Crawler(CrawlSpider):
     allowed_regex = r'^http.*://sites\.ed\.gov/.*$'
     # allowed_domains = ['ed.gov', 'www2.ed.gov']
 
+    # with --discovery, pages are discovered from the sitemaps of sites.ed.gov
+    # (see `DiscoveryMiddleware`)
+    sitemap_urls = [
+        'https://sites.ed.gov/robots.txt',
+        'https://sites.ed.gov/sitemap.xml',
+    ]
+
     def __init__(self):
 
         self.start_urls = [
@@ -12,6 +12,7 @@ import bs4
 from edscrapers.scrapers import base
 from edscrapers.scrapers.sites import parsers
 import edscrapers.scrapers.base.parser as base_parser
+from edscrapers.scrapers.base.cache import memoize_parse
 from edscrapers.scrapers.base.models import Publisher
 
 publishers_map = {
@@ -21,13 +22,13 @@ publishers_map = {
 
 def parse(res):
     """ function parses content to create a dataset model
-    or return None if no resource in content"""
+    or return None if no resource in content.
+    The checks of the url (and the publisher taken from it) are done before
+    the memoized `_parse()`, as its cache entries are keyed on the page body """
 
     if '/print/' in res.url:
         return None
 
-    soup_parser = bs4.BeautifulSoup(res.text, 'html5lib')
-
     try:
         publisher = res.url.split('sites.ed.gov')[1].split('/')[1]
     except:
@@ -41,6 +42,15 @@ def parse(res):
             publisher = publishers_map[publisher]
         print('Publisher', publisher, res.url)
 
+    return _parse(res, publisher)
+
+
+@memoize_parse
+def _parse(res, publisher):
+    """ function is a private helper.
+    function parses the content of a page of 'publisher' (see `parse()`) """
+
+    soup_parser = bs4.BeautifulSoup(res.text, 'html5lib')
 
     # check if the content contains any of the extensions
     if soup_parser.body.find(name='a', href=base_parser.resource_checker,
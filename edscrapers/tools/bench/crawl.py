@@ -0,0 +1,219 @@
+""" module contains the end-to-end crawl throughput benchmark.
+
+Each crawler is run, with its spider middlewares, parsers and pipelines, against
+a synthetic mirror of the scraped sites (see `mirror`), in a process of its own.
+The benchmark reports the pages and items per second, the CPU time and the peak
+memory of each crawl, and compares them with the stored baseline, so regressions
+are visible """
+
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import contextlib
+import multiprocessing as mp
+from pathlib import Path
+from urllib.request import urlopen
+
+from scrapy.crawler import CrawlerProcess
+
+from edscrapers.cli import logger
+from edscrapers.tools.bench.mirror import start_mirror
+
+# seconds after which a benchmark crawl is stopped
+CRAWL_TIMEOUT = 600
+
+MIRROR_HANDLER = 'edscrapers.scrapers.base.handlers.MirrorDownloadHandler'
+
+# the (metric, higher is better) pairs compared with the baseline
+METRICS = [('pages_per_second', True), ('items_per_second', True),
+           ('cpu_ms_per_page', False), ('peak_memory_mb', False)]
+
+
+def get_crawler_names():
+    """ returns the names of the crawlers benchmarked by default (i.e. the crawlers
+    of the SPIDER_MODULES, e.g. 'edgov.octae' for 'edscrapers.scrapers.edgov.octae.crawler') """
+
+    from edscrapers.scrapers.base.config import SCRAPY_SETTINGS
+    return [module[len('edscrapers.scrapers.'):-len('.crawler')]
+            for module in SCRAPY_SETTINGS['SPIDER_MODULES']]
+
+
+def run_crawl(name, mirror_url, concurrency, output_path, results):
+    """ runs the 'name' crawler against the mirror at 'mirror_url' and puts
+    its results in 'results'. The crawl output is written to 'output_path' """
+
+    # the crawl must not read (or overwrite) the output of the real crawls
+    os.environ['ED_OUTPUT_PATH'] = output_path
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    from edscrapers.scrapers.base.config import SCRAPY_SETTINGS
+    from edscrapers.scrapers.base.shared import load_crawler
+
+    settings = dict(SCRAPY_SETTINGS)
+    settings.update({
+        'MIRROR_URL': mirror_url,
+        'DOWNLOAD_HANDLERS': {'http': MIRROR_HANDLER, 'https': MIRROR_HANDLER},
+        'LOG_ENABLED': False,
+        'TELNETCONSOLE_ENABLED': False,
+        'HTTPCACHE_ENABLED': False,
+        'PARSE_CACHE_ENABLED': False,
+        # the mirror is local, it needs no throttling
+        'ADAPTIVE_THROTTLE_ENABLED': False,
+        'DOWNLOAD_DELAY': 0,
+        'CONCURRENT_REQUESTS': concurrency,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': concurrency,
+        'CLOSESPIDER_TIMEOUT': CRAWL_TIMEOUT,
+    })
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(load_crawler(name))
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # some parsers print their progress
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        process.crawl(crawler).addErrback(lambda failure: results.put({'error': str(failure.value)}))
+        process.start()
+    end_usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    if crawler.stats is None: # the crawl failed to start (its error was put in 'results')
+        return
+    stats = crawler.stats.get_stats()
+    results.put({
+        'pages': stats.get('response_received_count', 0),
+        'items': stats.get('item_scraped_count', 0),
+        'seconds': (stats['finish_time'] - stats['start_time']).total_seconds(),
+        'cpu_seconds': (end_usage.ru_utime + end_usage.ru_stime) -\
+                       (usage.ru_utime + usage.ru_stime),
+        'peak_memory_mb': end_usage.ru_maxrss / 1024, # kilobytes on linux
+        'finish_reason': stats.get('finish_reason'),
+    })
+
+
+def wait_for_mirror(port, timeout=30):
+    """ waits until the mirror running on 'port' accepts requests """
+
+    started_at = time.time()
+    while True:
+        try:
+            with urlopen(f'http://127.0.0.1:{port}/stats') as response:
+                return json.loads(response.read())
+        except OSError:
+            if time.time() - started_at > timeout:
+                raise
+            time.sleep(0.2)
+
+
+def run_benchmark(names=None, depth=3, fanout=5, dataset_ratio=0.3,
+                  latency=0, concurrency=16, port=8769):
+    """ runs the crawl benchmark for the 'names' crawlers (all of
+    them if None). Returns a list with a dict of results for each crawler """
+
+    names = names or get_crawler_names()
+    context = mp.get_context('spawn')
+    mirror_process = start_mirror(port, depth=depth, fanout=fanout,
+                                  dataset_ratio=dataset_ratio, latency=latency)
+    benchmark = []
+    try:
+        wait_for_mirror(port)
+        for name in names:
+            with tempfile.TemporaryDirectory(prefix='eds-bench-') as output_path:
+                results = context.Queue()
+                crawl_process = context.Process(target=run_crawl,
+                                                args=(name, f'http://127.0.0.1:{port}',
+                                                      concurrency, output_path, results))
+                crawl_process.start()
+                # allow for the start up and shut down of the crawl
+                stats = results.get(timeout=CRAWL_TIMEOUT + 60)
+                crawl_process.join()
+
+            if 'error' in stats:
+                logger.error(f"The {name} crawl failed: {stats['error']}")
+                continue
+            result = {
+                'crawler': name,
+                'pages': stats['pages'],
+                'items': stats['items'],
+                'seconds': round(stats['seconds'], 3),
+                'pages_per_second': round(stats['pages'] / stats['seconds'], 2),
+                'items_per_second': round(stats['items'] / stats['seconds'], 2),
+                'cpu_seconds': round(stats['cpu_seconds'], 3),
+                'cpu_ms_per_page': round(1000 * stats['cpu_seconds'] / max(stats['pages'], 1), 2),
+                'peak_memory_mb': round(stats['peak_memory_mb'], 1),
+            }
+            if stats['finish_reason'] != 'finished':
+                logger.warning(f"The {name} crawl did not finish ({stats['finish_reason']})")
+            logger.info(f"{name}: {result['pages_per_second']} pages/sec, "\
+                        f"{result['items_per_second']} items/sec")
+            benchmark.append(result)
+    finally:
+        mirror_process.terminate()
+        mirror_process.join()
+
+    return benchmark
+
+
+def get_benchmark_dir_path():
+    """ returns the directory the benchmark results (and baseline) are written to """
+
+    file_dir_path = Path(os.getenv('ED_OUTPUT_PATH'), 'tools', 'bench')
+    file_dir_path.mkdir(parents=True, exist_ok=True)
+    return file_dir_path
+
+
+def read_baseline():
+    """ returns the stored baseline (a dict with the 'site' benchmarked
+    and the 'results' per crawler), or None if there is none """
+
+    file_path = Path(get_benchmark_dir_path(), 'crawl_baseline.json')
+    if not file_path.exists():
+        return None
+    with open(file_path, 'r') as baseline_file:
+        return json.load(baseline_file)
+
+
+def compare_with_baseline(benchmark, site, baseline, tolerance=0.2):
+    """ adds the change of each metric since the 'baseline' to the results of the
+    'benchmark' (as a ratio, e.g. -0.2 for 20% less) and flags the results where a
+    metric got worse by more than 'tolerance' as regressions.
+    Results are only compared with a baseline of the same 'site' """
+
+    if not baseline or baseline['site'] != site:
+        return
+    for result in benchmark:
+        baseline_result = baseline['results'].get(result['crawler'])
+        if not baseline_result:
+            continue
+        result['changes'] = dict()
+        result['regressions'] = []
+        for metric, higher_is_better in METRICS:
+            if not baseline_result.get(metric):
+                continue
+            change = (result[metric] - baseline_result[metric]) / baseline_result[metric]
+            result['changes'][metric] = round(change, 3)
+            if (-change if higher_is_better else change) > tolerance:
+                result['regressions'].append(metric)
+
+
+def write_benchmark(benchmark, site, save_baseline=False):
+    """ writes the 'benchmark' results (and, if 'save_baseline'
+    is set, the new baseline). Returns the path of the results file """
+
+    file_dir_path = get_benchmark_dir_path()
+    file_path = Path(file_dir_path, 'crawl.json')
+    with open(file_path, 'w') as output_file:
+        json.dump({'site': site, 'results': benchmark}, output_file, indent=2)
+
+    if save_baseline:
+        baseline = read_baseline()
+        if not baseline or baseline['site'] != site:
+            baseline = {'site': site, 'results': dict()}
+        # the crawlers which were not benchmarked keep their baseline
+        baseline['results'].update({result['crawler']: {key: value for key, value in result.items()
+                                                        if key not in ('changes', 'regressions')}
+                                    for result in benchmark})
+        with open(Path(file_dir_path, 'crawl_baseline.json'), 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2)
+    return file_path
@@ -0,0 +1,359 @@
+""" module contains the benchmark of the datajson transformer.
+
+The models of the datasets (see `transformers.datajson.models`) are measured on a synthetic
+corpus (100000 datasets by default, with 10 distributions each): the memory they take per
+dataset (over a sample of the datasets, held at once), and the time to build each dataset
+and to serialize it to the JSON of the data.json. This is done with the slotted models,
+encoded straight from their fields, and with the 'legacy' models (kept below for
+reference), whose instances each had a dict and which were encoded by `json.dumps()`
+of their `to_dict()`. The JSON they produce is checked to be identical.
+
+The titles and identifiers of the datasets are made unique (see
+`transformers.datajson.transform._set_unique_title_and_identifier()`) as they are
+added to the catalog. This is measured on synthetic datasets of growing sizes (many of
+which share their title or identifier, as the datasets scraped from the same pages do),
+with the sets the datajson stage keeps of the titles and identifiers taken so far, and with
+the 'legacy' lists it kept before (kept below for reference), whose look-ups get slower as
+the lists grow. The time per dataset shows how each scales (it stays flat for linear
+time). The legacy lists are only measured up to 'legacy_max' datasets, as they take
+quadratic time, and what the two produce is checked to be identical """
+
+import os
+import json
+import time
+import random
+import hashlib
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+from edscrapers.cli import logger
+from edscrapers.transformers.base import helpers as h
+from edscrapers.transformers.datajson.models import Dataset, Resource, Organization
+from edscrapers.transformers.datajson.transform import _set_unique_title_and_identifier
+
+# the implementations of the benchmark, per step
+IMPLEMENTATIONS = {'models': ['slotted', 'legacy'],
+                   'unique': ['sets', 'legacy']}
+
+TITLE_WORDS = ['enrollment', 'schools', 'grade', 'national', 'finance', 'teachers',
+               'graduation', 'data', 'students', 'district', 'report', 'survey']
+
+
+def build_datasets(datasets=10000, duplicates=0.2, seed=0):
+    """ returns a list of 'datasets' datasets (as the datajson stage has them before
+    their title and identifier are made unique), a 'duplicates' share of which
+    have the title or identifier of another """
+
+    rnd = random.Random(seed)
+    corpus = []
+    for index in range(datasets):
+        dataset = Dataset()
+        dataset.scraped_from = f'https://www2.ed.gov/about/offices/list/page-{index // 5}.html'
+        dataset.title = ' '.join(rnd.choice(TITLE_WORDS).title() for _ in range(4)) + f' {index}'
+        dataset.identifier = f'dataset-{index}'
+        if corpus and rnd.random() < duplicates:
+            dataset.title = rnd.choice(corpus).title
+        if corpus and rnd.random() < duplicates:
+            dataset.identifier = rnd.choice(corpus).identifier
+        corpus.append(dataset)
+    return corpus
+
+
+def legacy_set_unique_title_and_identifier(dataset, dataset_title_list, dataset_identifier_list):
+    """ makes the title and identifier of 'dataset' unique, as the
+    datajson transformer did, with lists of those taken so far """
+
+    title = dataset.title
+    # ensure datasets have a unique title
+    if title and title not in dataset_title_list:
+        dataset_title_list.append(title)
+    else:
+        dataset.title = h.transform_dataset_title(title, dataset.scraped_from)
+
+    identifier = dataset.identifier
+    # ensure datasets have a unique identifier
+    if identifier in dataset_identifier_list:
+        identifier = h.transform_dataset_identifier(title, dataset.scraped_from)
+    dataset.identifier = identifier
+    dataset_identifier_list.append(identifier)
+
+
+def build_model(models, index, distributions=10):
+    """ returns the dataset 'index' of the corpus, built with
+    'models' (the Dataset, Resource and Organization classes) """
+
+    dataset_class, resource_class, organization_class = models
+    dataset = dataset_class()
+    dataset.modified = '2020-01-01' # as the legacy ones are built on the same day
+    dataset.title = f'{TITLE_WORDS[index % len(TITLE_WORDS)].title()} Data, School Year {index}'
+    dataset.identifier = f'dataset-{index}'
+    dataset.scraped_from = f'https://www2.ed.gov/about/offices/list/page-{index}.html'
+    dataset.keyword = [TITLE_WORDS[(index + offset) % len(TITLE_WORDS)] for offset in range(3)]
+    dataset.description = f'Data about the {dataset.keyword[0]} of the schools, for the year {index}.'
+    dataset.publisher = organization_class()
+    dataset.publisher.name = 'nces'
+    dataset.contactPoint = {'@type': 'vcard:Contact', 'fn': 'n/a', 'hasEmail': 'mailto:nces@ed.gov'}
+    dataset.bureauCode = ['018:00']
+    dataset.programCode = ['018:000']
+    dataset.theme = ['Elementary and Secondary Education']
+    dataset.levelOfData = ['national', 'state']
+    for distribution_index in range(distributions):
+        distribution = resource_class()
+        distribution.downloadURL = f'https://www2.ed.gov/files/{index}/table-{distribution_index}.xls'
+        distribution.title = f'Table {distribution_index}: {dataset.title}'
+        distribution.resource_format = 'xls'
+        distribution.mediaType = h.get_media_type('xls')
+        dataset.distribution.append(distribution)
+    return dataset
+
+
+def run_models_benchmark(datasets=100000, distributions=10, memory_sample=10000):
+    """ runs the benchmark of the models, over 'datasets' datasets with 'distributions'
+    distributions each. Returns a list with a dict of results for each implementation """
+
+    models = {'slotted': (Dataset, Resource, Organization),
+              'legacy': (LegacyDataset, LegacyResource, LegacyOrganization)}
+    serialize = {'slotted': lambda dataset: dataset.dump_json('\n    '),
+                 'legacy': lambda dataset: json.dumps(dataset.to_dict(), indent=2)\
+                     .replace('\n', '\n    ')}
+    benchmark = []
+    for implementation in IMPLEMENTATIONS['models']:
+        # the memory of a sample of the datasets, held at once
+        tracemalloc.start()
+        sample = [build_model(models[implementation], index, distributions)
+                  for index in range(min(memory_sample, datasets))]
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del sample
+
+        build_seconds = serialize_seconds = 0
+        digest = hashlib.md5()
+        for index in range(datasets):
+            started_at = time.perf_counter()
+            dataset = build_model(models[implementation], index, distributions)
+            built_at = time.perf_counter()
+            dataset_json = serialize[implementation](dataset)
+            serialize_seconds += time.perf_counter() - built_at
+            build_seconds += built_at - started_at
+            digest.update(dataset_json.encode('utf-8'))
+
+        result = {'step': 'models', 'implementation': implementation, 'count': datasets,
+                  'bytes_per_dataset': round(memory / min(memory_sample, datasets)),
+                  'build_microseconds_per_dataset': round(1000000 * build_seconds / datasets, 2),
+                  'serialize_microseconds_per_dataset': round(1000000 * serialize_seconds / datasets, 2),
+                  'digest': digest.hexdigest()}
+        logger.info(f"models {implementation}: {result['bytes_per_dataset']} bytes/dataset, "
+                    f"{result['serialize_microseconds_per_dataset']} us/dataset serialized")
+        benchmark.append(result)
+
+    identical = len({result.pop('digest') for result in benchmark}) == 1
+    for result in benchmark:
+        result['identical'] = identical
+    if not identical:
+        logger.error(f'The implementations produced different JSON!')
+    return benchmark
+
+
+def run_benchmark(sizes=(5000, 10000, 20000, 40000), legacy_max=20000, repeat=3):
+    """ runs the benchmark over datasets of each of 'sizes'. Returns a list
+    with a dict of results for each (step, implementation, size) """
+
+    unique = {'sets': (_set_unique_title_and_identifier, set),
+              'legacy': (legacy_set_unique_title_and_identifier, list)}
+    benchmark = []
+    for size in sizes:
+        outputs = dict()
+        results = []
+        for implementation in IMPLEMENTATIONS['unique']:
+            if implementation == 'legacy' and size > legacy_max:
+                continue
+            set_unique, container = unique[implementation]
+            seconds = 0
+            for _ in range(repeat):
+                datasets = build_datasets(size)
+                titles, identifiers = container(), container()
+                started_at = time.perf_counter()
+                for dataset in datasets:
+                    set_unique(dataset, titles, identifiers)
+                seconds += time.perf_counter() - started_at
+            outputs[implementation] = [(dataset.title, dataset.identifier) for dataset in datasets]
+            seconds /= repeat
+            result = {'step': 'unique', 'implementation': implementation, 'count': size,
+                      'milliseconds': round(1000 * seconds, 1),
+                      'microseconds_per_dataset': round(1000000 * seconds / size, 2)}
+            logger.info(f"unique {implementation} ({size} datasets): "
+                        f"{result['microseconds_per_dataset']} us/dataset")
+            results.append(result)
+
+        identical = all(output == outputs['sets'] for output in outputs.values())
+        for result in results:
+            result['identical'] = identical
+        if not identical:
+            logger.error(f'The implementations produced different titles or identifiers!')
+        benchmark.extend(results)
+    return benchmark
+
+
+class LegacyOrganization():
+
+    organization_type = str()
+    name = str()
+    sub_organization_of = None
+
+    def __init__(self):
+
+        self.organization_type = "org:Organization"
+
+    def to_dict(self):
+
+        if not self.name:
+            return None
+
+        org_dict = {
+            "@type": self.organization_type,
+            "name": self.name
+        }
+
+        if self.sub_organization_of is not None:
+            org_dict["subOrganizationOf"] = self.sub_organization_of
+
+        return org_dict
+
+
+class LegacyDataset():
+
+    dataset_type = str()
+    title = str()
+    description = str()
+    keyword = list()
+    modified = None
+    scraped_from = str()
+    publisher = LegacyOrganization()
+    contactPoint = dict()
+    identifier = str()
+    accessLevel = str()
+    bureauCode = list()
+    programCode = list()
+    dataset_license = str()
+    spatial = str()
+    temporal = str()
+    theme = list()
+    distribution = list() # resources list
+    levelOfData = str()
+    source = list() # list of Sources
+    collection = list() # list of Collections
+
+    def __init__(self):
+
+        self.dataset_type = "dcat:Dataset"
+        self.accessLevel = "public"
+        # set license to cc-zero
+        self.dataset_license = "https://creativecommons.org/publicdomain/zero/1.0/"
+        self.spatial = "United States"
+        self.description = "n/a"
+        self.modified = datetime.now().strftime("%Y-%m-%d")
+        self.distribution = list()
+        self.source = list()
+        self.collection = list()
+
+    def to_dict(self):
+
+        dataset_dict = {}
+
+        if self.dataset_type:
+            dataset_dict["@type"] = self.dataset_type
+        if self.title:
+            dataset_dict["title"] = self.title
+        if self.description:
+            dataset_dict["description"] = self.description
+        if len(self.keyword) > 0:
+            dataset_dict["keyword"] = self.keyword
+        if self.modified:
+            dataset_dict["modified"] = self.modified
+        if self.publisher.to_dict():
+            dataset_dict["publisher"] = self.publisher.to_dict()
+        if self.scraped_from:
+            dataset_dict["scraped_from"] = self.scraped_from
+        if self.contactPoint:
+            dataset_dict["contactPoint"] = self.contactPoint
+        if self.identifier:
+            dataset_dict["identifier"] = self.identifier
+        if self.accessLevel:
+            dataset_dict["accessLevel"] = self.accessLevel
+        if len(self.bureauCode) > 0:
+            dataset_dict["bureauCode"] = self.bureauCode
+        if len(self.programCode) > 0:
+            dataset_dict["programCode"] = self.programCode
+        if self.dataset_license:
+            dataset_dict["license"] = self.dataset_license
+        if self.spatial:
+            dataset_dict["spatial"] = self.spatial
+        if self.temporal:
+            dataset_dict["temporal"] = self.temporal
+        if len(self.theme) > 0:
+            dataset_dict["theme"] = self.theme
+        if len(self.distribution) > 0:
+            dataset_dict["distribution"] = [resource.to_dict() for resource in self.distribution]
+        if self.levelOfData:
+            dataset_dict['levelOfData'] = self.levelOfData
+        if len(self.source) > 0:
+            dataset_dict['source'] = [source.id for source in self.source]
+        if len(self.collection) > 0:
+            dataset_dict['collection'] = [collection.id for collection in self.collection]
+
+        return dataset_dict
+
+
+class LegacyResource():
+
+    resource_type = str()
+    description = str()
+    title = str()
+    resource_format = str()
+    mediaType = str()
+    accessURL = str()
+    downloadURL = str()
+    headerMetadata = dict()
+
+    def __init__(self):
+        self.resource_type = "dcat:Distribution"
+        self.description = "n/a"
+        self.resource_format = "txt"
+        self.mediaType = h.get_media_type(self.resource_format)
+        self.headerMetadata = dict()
+
+    def to_dict(self):
+
+        resource_dict = {}
+
+        if self.resource_type:
+            resource_dict["@type"] = self.resource_type
+        if self.title:
+            resource_dict["title"] = self.title
+        if self.description:
+            resource_dict["description"] = self.description
+        if self.downloadURL:
+            resource_dict["downloadURL"] = self.downloadURL
+        if self.accessURL:
+            resource_dict["accessURL"] = self.accessURL
+        if self.resource_format:
+            resource_dict["format"] = self.resource_format
+        if self.mediaType:
+            resource_dict["mediaType"] = self.mediaType
+        if len(list(self.headerMetadata.keys())) > 0:
+            resource_dict["headerMetadata"] = self.headerMetadata
+
+        return resource_dict
+
+
+def write_benchmark(benchmark):
+    """ writes the 'benchmark' results to the tools output directory.
+    Returns the path of the file written """
+
+    file_dir_path = Path(os.getenv('ED_OUTPUT_PATH'), 'tools', 'bench')
+    file_dir_path.mkdir(parents=True, exist_ok=True)
+    file_path = Path(file_dir_path, 'datajson.json')
+    with open(file_path, 'w') as output_file:
+        json.dump(benchmark, output_file, indent=2)
+    return file_path
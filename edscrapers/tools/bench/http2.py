@@ -0,0 +1,148 @@
+""" module contains the benchmark comparing HTTP/2 downloads
+(see `edscrapers.scrapers.base.handlers.Http2DownloadHandler`) with HTTP/1.1.
+
+Each mode crawls the synthetic site of a local test server (see `server`) and
+reports the pages downloaded per second and the number of connections the
+server accepted. The HTTP/2 handler is also run against a server which only
+negotiates HTTP/1.1, to check (and time) its fall back """
+
+import os
+import ssl
+import json
+import time
+import multiprocessing as mp
+from pathlib import Path
+from urllib.request import urlopen
+
+import scrapy
+from scrapy.crawler import CrawlerProcess
+from scrapy.linkextractors import LinkExtractor
+
+from edscrapers.cli import logger
+from edscrapers.tools.bench.server import start_server
+
+# seconds after which a benchmark crawl is considered as failed
+CRAWL_TIMEOUT = 600
+
+HTTP2_HANDLER = 'edscrapers.scrapers.base.handlers.Http2DownloadHandler'
+
+# the (label, handler, server negotiates HTTP/2) benchmark modes
+MODES = [('http/1.1', None, True),
+         ('http/2', HTTP2_HANDLER, True),
+         ('http/2 (fallback)', HTTP2_HANDLER, False)]
+
+
+class BenchSpider(scrapy.Spider):
+    """ spider follows all the links of the synthetic site """
+
+    name = 'bench_http2'
+    link_extractor = LinkExtractor()
+
+    def parse(self, response):
+        for link in self.link_extractor.extract_links(response):
+            yield scrapy.Request(link.url, callback=self.parse)
+
+
+def run_crawl(start_url, handler, concurrency, results):
+    """ crawls the synthetic site from 'start_url' with the 'handler' https download
+    handler (or the default one if None) and puts the crawl stats in 'results' """
+
+    settings = {
+        'LOG_ENABLED': False,
+        'TELNETCONSOLE_ENABLED': False,
+        'ROBOTSTXT_OBEY': False,
+        'CONCURRENT_REQUESTS': concurrency,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': concurrency,
+        'DOWNLOAD_DELAY': 0,
+    }
+    if handler:
+        settings['DOWNLOAD_HANDLERS'] = {'https': handler}
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(BenchSpider)
+    process.crawl(crawler, start_urls=[start_url])
+    process.start()
+
+    stats = crawler.stats.get_stats()
+    results.put({key: (value.timestamp() if hasattr(value, 'timestamp') else value)
+                 for key, value in stats.items()})
+
+
+def get_server_stats(port):
+    """ returns the stats of the test server running on 'port' """
+
+    # the test server uses a self-signed certificate
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    with urlopen(f'https://localhost:{port}/stats', context=context) as response:
+        return json.loads(response.read())
+
+
+def wait_for_server(port, timeout=30):
+    """ waits until the test server running on 'port' accepts requests """
+
+    started_at = time.time()
+    while True:
+        try:
+            return get_server_stats(port)
+        except OSError:
+            if time.time() - started_at > timeout:
+                raise
+            time.sleep(0.2)
+
+
+def run_benchmark(pages=500, fanout=10, latency=0.05, concurrency=16, port=8443):
+    """ runs the HTTP/2 benchmark. Returns a list with a dict of results for each mode """
+
+    context = mp.get_context('spawn')
+    benchmark = []
+    for label, handler, server_http2 in MODES:
+        server_process = start_server(port, pages=pages, fanout=fanout,
+                                      latency=latency, http2=server_http2)
+        try:
+            wait_for_server(port)
+            start_connections = get_server_stats(port)['connections']
+
+            results = context.Queue()
+            crawl_process = context.Process(target=run_crawl,
+                                            args=(f'https://localhost:{port}/page/0',
+                                                  handler, concurrency, results))
+            crawl_process.start()
+            # a crawl of the test site should never take that long
+            stats = results.get(timeout=CRAWL_TIMEOUT)
+            crawl_process.join()
+
+            # discount the connections made by the benchmark itself
+            connections = get_server_stats(port)['connections'] - start_connections - 1
+        finally:
+            server_process.terminate()
+            server_process.join()
+
+        elapsed = stats['finish_time'] - stats['start_time']
+        result = {
+            'mode': label,
+            'pages': stats.get('response_received_count', 0),
+            'seconds': round(elapsed, 3),
+            'pages_per_second': round(stats.get('response_received_count', 0) / elapsed, 2),
+            'connections': connections,
+            'http2_requests': stats.get('http2/request_count', 0),
+            'http11_requests': stats.get('http2/http11_request_count', 0),
+        }
+        logger.info(f"{label}: {result['pages_per_second']} pages/sec, "\
+                    f"{result['connections']} connections")
+        benchmark.append(result)
+
+    return benchmark
+
+
+def write_benchmark(benchmark):
+    """ writes the 'benchmark' results to the tools output directory.
+    Returns the path of the file written """
+
+    file_dir_path = Path(os.getenv('ED_OUTPUT_PATH'), 'tools', 'bench')
+    file_dir_path.mkdir(parents=True, exist_ok=True)
+    file_path = Path(file_dir_path, 'http2.json')
+    with open(file_path, 'w') as output_file:
+        json.dump(benchmark, output_file, indent=2)
+    return file_path
@@ -0,0 +1,156 @@
+""" module contains the allocation benchmark of the item models
+(see `edscrapers.scrapers.base.models`).
+
+A dataset page with many resources (500 by default) is built and serialized,
+for both output layouts, with the item models and with 'legacy' items (scrapy Items,
+which wrap a dict of their values and have an instance dict, serialized through
+a `default` which reads it, as the models were). Each step reports the memory blocks and kilobytes its result holds, the
+peak of the memory it allocates on the way (both traced with tracemalloc), and its time """
+
+import os
+import gc
+import json
+import time
+import tracemalloc
+from pathlib import Path
+
+from scrapy import Item, Field
+
+from edscrapers.cli import logger
+from edscrapers.scrapers.base.models import Dataset, Resource, Publisher
+
+# the models of the benchmark, per label
+MODELS = ['models', 'legacy']
+
+
+class LegacyDataset(Item):
+    """ item is the Dataset model as it was, a scrapy Item """
+
+    source_url = Field()
+    title = Field()
+    name = Field()
+    notes = Field()
+    date = Field()
+    contact_person_name = Field()
+    contact_person_email = Field()
+    tags = Field()
+    resources = Field()
+    collection = Field()
+    saved_as_file = Field()
+    publisher = Field()
+
+    def toJSON(self, indent=2, separators=None):
+        # the collection field was deleted from the item
+        if self.__dict__['_values'].get('collection', None):
+            del self.__dict__['_values']['collection']
+        return json.dumps(self, default=lambda o: o.__dict__['_values'],
+                          sort_keys=False, indent=indent, separators=separators)
+
+
+class LegacyResource(Item):
+    """ item is the Resource model as it was, a scrapy Item """
+
+    name = Field()
+    url = Field()
+    source_url = Field()
+    description = Field()
+    format = Field()
+    headers = Field()
+
+
+class LegacyPublisher(Item):
+    """ item is the Publisher model as it was, a scrapy Item """
+
+    name = Field()
+    subOrganizationOf = Field()
+
+
+def build_dataset(model, resources=500):
+    """ returns a dataset of a page with 'resources' resources, built with the 'model' items """
+
+    dataset_class, resource_class, publisher_class = (Dataset, Resource, Publisher)\
+        if model == 'models' else (LegacyDataset, LegacyResource, LegacyPublisher)
+
+    source_url = 'https://nces.ed.gov/programs/digest/d19/tables/dt19_203.10.asp'
+    dataset = dataset_class()
+    dataset['source_url'] = source_url
+    dataset['title'] = 'Enrollment in public elementary and secondary schools, by level and grade'
+    dataset['name'] = 'enrollment-in-public-elementary-and-secondary-schools'
+    dataset['notes'] = 'Enrollment in public elementary and secondary schools, by level and grade: '\
+                       'selected years, fall 1980 through fall 2029'
+    dataset['tags'] = 'enrollment, schools, grade'
+    dataset['date'] = '2019-12-01'
+    dataset['contact_person_name'] = 'NCES'
+    dataset['contact_person_email'] = 'nces@ed.gov'
+    dataset['publisher'] = publisher_class(name='National Center for Education Statistics',
+                                           subOrganizationOf='Institute of Education Sciences')
+    dataset['collection'] = [{'collection_title': 'Digest of Education Statistics'}]
+    dataset['resources'] = [resource_class(source_url=source_url,
+                                           url=f'https://nces.ed.gov/programs/digest/d19/tables/'
+                                               f'xls/tabn203.{index}.xls',
+                                           name=f'Table 203.{index}',
+                                           description=f'Table 203.{index} of the digest',
+                                           format='xls')
+                            for index in range(resources)]
+    return dataset
+
+
+def measure(step, prepare=None, repeat=20):
+    """ returns the memory (blocks and kilobytes) held by the result of 'step', the peak
+    of the memory allocated by 'step', and its time (averaged over 'repeat' runs).
+    'step' is called with the result of 'prepare' (if any), which is not measured """
+
+    def run():
+        argument = prepare() if prepare else None
+        started_at = time.perf_counter()
+        result = step(argument) if prepare else step()
+        return result, time.perf_counter() - started_at
+
+    gc.collect()
+    argument = prepare() if prepare else None
+    tracemalloc.start()
+    start = tracemalloc.take_snapshot()
+    result = step(argument) if prepare else step()
+    end = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    held = [stat for stat in end.compare_to(start, 'filename') if stat.size_diff > 0]
+    measurement = {'blocks': sum(stat.count_diff for stat in held),
+                   'kilobytes': round(sum(stat.size_diff for stat in held) / 1024, 1),
+                   'peak_kilobytes': round(peak / 1024, 1)}
+    del result, argument
+
+    seconds = sum(run()[1] for _ in range(repeat))
+    measurement['milliseconds'] = round(1000 * seconds / repeat, 3)
+    return measurement
+
+
+def run_benchmark(resources=500, repeat=20):
+    """ runs the allocation benchmark. Returns a list with a dict of results for each (model, step) """
+
+    benchmark = []
+    for model in MODELS:
+        prepare = lambda: build_dataset(model, resources)
+        steps = [('build', prepare, None),
+                 ('serialize (files)', lambda dataset: dataset.toJSON(), prepare),
+                 ('serialize (segments)', lambda dataset: dataset.toJSON(indent=None, separators=(',', ':')),
+                  prepare)]
+        for label, step, step_prepare in steps:
+            result = {'model': model, 'step': label, 'resources': resources}
+            result.update(measure(step, prepare=step_prepare, repeat=repeat))
+            logger.info(f"{model} {label}: {result['peak_kilobytes']} KB peak, "
+                        f"{result['kilobytes']} KB held, {result['milliseconds']} ms")
+            benchmark.append(result)
+    return benchmark
+
+
+def write_benchmark(benchmark):
+    """ writes the 'benchmark' results to the tools output directory.
+    Returns the path of the file written """
+
+    file_dir_path = Path(os.getenv('ED_OUTPUT_PATH'), 'tools', 'bench')
+    file_dir_path.mkdir(parents=True, exist_ok=True)
+    file_path = Path(file_dir_path, 'items.json')
+    with open(file_path, 'w') as output_file:
+        json.dump(benchmark, output_file, indent=2)
+    return file_path
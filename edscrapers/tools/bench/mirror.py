@@ -0,0 +1,264 @@
+""" module contains the synthetic ed.gov mirror used by the crawl benchmark (see `crawl`).
+
+The mirror serves, for any host, a tree of pages below each requested path (e.g.
+below the start urls of the crawlers): every page links to 'fanout' child pages, down
+to 'depth' levels below the path, and a share ('dataset_ratio') of the pages list
+resource files. Pages are generated from their url, so a site is the same from one
+run to the next, and follow the structure of the scraped sites:
+
+- nces.ed.gov and ies.ed.gov: 'nces' table pages, and paginated
+  publication listings (i.e. 'pubsearch/index.asp')
+- ocrdata.ed.gov: accordion pages
+- sites.ed.gov: wordpress pages
+- any other host: ed.gov pages, with the 'ED.office' meta tag of the office of their path
+
+A page links back to its Referer (i.e. the collection it was reached from), as the
+breadcrumbs of the scraped sites do. The mirror is requested as
+'<mirror url>/<host>/<path>' (see `helpers.get_mirror_url()`) """
+
+import re
+import json
+import zlib
+import mimetypes
+import multiprocessing as mp
+from urllib.parse import urlsplit
+
+from twisted.web import server, resource
+from twisted.internet import reactor
+
+# the offices of the ed.gov pages, per (path or host) keyword
+OFFICES = [
+    (('ovae', 'octae'), 'Office of Career, Technical and Adult Education (OCTAE)'),
+    (('oela', 'ncela'), 'Office of English Language Acquisition (OELA)'),
+    (('opepd',), 'Office of Planning, Evaluation and Program Development (OPEPD)'),
+    (('oese',), 'Office of Elementary and Secondary Education (OESE)'),
+    (('osers', 'osep', 'idea'), 'Office of Special Education and Rehabilitative Services (OSERS)'),
+    (('ope/', 'iegpsnrc'), 'Office of Postsecondary Education (OPE)'),
+]
+DEFAULT_OFFICE = 'Office of Communications and Outreach (OCO)'
+
+RESOURCE_EXTENSIONS = ['csv', 'xls', 'zip', 'xlsx', 'sas7bdat']
+RESOURCES_PER_PAGE = 3
+LISTING_PAGE_SIZE = 15
+
+RESOURCE_BODY = b'id,state,year,value\n' + b''.join(f'{i},S{i % 50},20{i % 20:02},{i * 7}\n'.encode('utf-8')
+                                                      for i in range(100))
+
+
+class MirrorResource(resource.Resource):
+    """ resource serves the pages of the mirrored sites (i.e. '/<host>/<path>') """
+
+    isLeaf = True
+
+    def __init__(self, depth, fanout, dataset_ratio, latency):
+        super().__init__()
+        self.depth = depth
+        self.fanout = fanout
+        self.dataset_ratio = dataset_ratio
+        self.latency = latency
+        self.counts = {'pages': 0, 'resources': 0, 'lookups': 0}
+
+    def render_GET(self, request):
+        if request.path == b'/stats':
+            request.setHeader(b'Content-Type', b'application/json')
+            return json.dumps(self.counts).encode('utf-8')
+
+        host, _, path = request.uri.decode('utf-8').lstrip('/').partition('/')
+        if (request.getHeader('User-Agent') or '').startswith('python-requests'):
+            # the requests the parsers make themselves (e.g. for collection pages)
+            self.counts['lookups'] += 1
+
+        content_type, body = self.get_content(host, '/' + path, request.getHeader('Referer'))
+        if body is None:
+            request.setResponseCode(404)
+            return b'Not Found'
+
+        def write_content():
+            if request.finished or request.channel is None:
+                return
+            request.setHeader(b'Content-Type', content_type.encode('utf-8'))
+            request.setHeader(b'Last-Modified', b'Wed, 01 Jan 2020 00:00:00 GMT')
+            request.write(body)
+            request.finish()
+
+        if not self.latency:
+            write_content()
+        else:
+            reactor.callLater(self.latency, write_content)
+        return server.NOT_DONE_YET
+
+    def get_content(self, host, path, referer=None):
+        """ returns the (content type, body) of the page at 'path' of 'host',
+        or (None, None) if there is none """
+
+        url_path = urlsplit(path).path
+        if url_path.endswith(('/robots.txt', '/sitemap.xml')):
+            return None, None
+
+        extension = url_path.rsplit('.', 1)[-1].lower() if '.' in url_path.rsplit('/', 1)[-1] else ''
+        if extension in RESOURCE_EXTENSIONS:
+            self.counts['resources'] += 1
+            return mimetypes.guess_type(url_path)[0] or 'application/octet-stream', RESOURCE_BODY
+
+        self.counts['pages'] += 1
+        page = Page(host, path, referer, self)
+        return 'text/html; charset=utf-8', page.render().encode('utf-8')
+
+
+class Page():
+    """ class generates the html of a page of a mirrored site """
+
+    def __init__(self, host, path, referer, site):
+        self.host = host
+        self.path = path
+        self.url_path = urlsplit(path).path
+        self.referer = referer
+        self.site = site
+
+        self.level = len([segment for segment in self.url_path.split('/')
+                          if re.match(r'^s\d+$', segment)])
+        seed = zlib.crc32(f'{host}{path}'.encode('utf-8'))
+        self.is_dataset = self.level > 0 and seed % 100 < site.dataset_ratio * 100
+        self.extension_offset = seed
+        self.title = f'{host} {self.url_path.strip("/") or "home"}'.replace('/', ' ')
+        if self.referer:
+            # as on the scraped sites, the description mentions the collection of the page
+            self.description = f'{self.title}, part of {urlsplit(self.referer).path}'
+        else:
+            self.description = self.title
+
+    @property
+    def directory(self):
+        """ the path below which the child pages (and resources) of the page are """
+
+        last_segment = self.url_path.rsplit('/', 1)[-1]
+        if not last_segment:
+            return self.url_path
+        if '.' in last_segment:
+            return self.url_path[:-len(last_segment)]
+        return self.url_path + '/'
+
+    def get_links(self):
+        """ returns the (path, text) links of the page to its child pages """
+
+        if self.level >= self.site.depth:
+            return []
+        return [(f'{self.directory}s{index}/index.html', f'Section {index}')
+                for index in range(1, self.site.fanout + 1)]
+
+    def get_resources(self):
+        """ returns the (path, text) links of the page to resource files """
+
+        if not self.is_dataset:
+            return []
+        return [(f'{self.directory}data/file{index}.'\
+                 f'{RESOURCE_EXTENSIONS[(self.extension_offset + index) % len(RESOURCE_EXTENSIONS)]}',
+                 f'Data file {index}')
+                for index in range(1, RESOURCES_PER_PAGE + 1)]
+
+    def render(self):
+        if self.host in ('nces.ed.gov', 'ies.ed.gov'):
+            if self.url_path.endswith('/pubsearch/index.asp'):
+                return self.render_listing()
+            if self.url_path.endswith('/pubsearch/pubsinfo.asp'):
+                # the publications of a listing are dataset pages, without child pages
+                self.level = self.site.depth
+                self.is_dataset = True
+            return self.render_nces()
+        if self.host == 'ocrdata.ed.gov':
+            return self.render_ocr()
+        if self.host == 'sites.ed.gov':
+            return self.render_sites()
+        return self.render_edgov()
+
+    def render_head(self, extra=''):
+        return f'<head><title>{self.title}</title>'\
+               f'<meta name="DC.title" content="{self.title}">'\
+               f'<meta name="DC.description" content="{self.description}">'\
+               f'<meta name="keywords" content="education, data, {self.host}">'\
+               f'<meta name="DC.date.valid" content="2020-01-01">{extra}</head>'
+
+    def render_breadcrumb(self):
+        if not self.referer:
+            return ''
+        return f'<div class="breadcrumb"><a href="{self.referer}">Back to '\
+               f'{urlsplit(self.referer).path}</a></div>'
+
+    def render_edgov(self):
+        keywords = f'{self.host}{self.url_path}'.lower()
+        office = next((office for office_keywords, office in OFFICES
+                       if any(keyword in keywords for keyword in office_keywords)), DEFAULT_OFFICE)
+        links = ''.join(f'<li><a href="{path}">{text}</a></li>' for path, text in self.get_links())
+        resources = ''.join(f'<li><a href="{path}">{text}</a></li>'
+                            for path, text in self.get_resources())
+        return '<html>' + self.render_head(f'<meta name="ED.office" content="{office}">') +\
+               f'<body><div class="container"><div id="maincontent" class="content">{self.render_breadcrumb()}'\
+               f'<h1>{self.title}</h1><p>{self.description}</p><ul>{links}</ul>'\
+               f'<div class="headersLevel1">Data files</div><div class="contentText">'\
+               f'<p>The data files of {self.title}</p><ul>{resources}</ul></div>'\
+               f'</div></div></body></html>'
+
+    def render_nces(self):
+        links = ' | '.join(f'<a href="{path}">{text}</a>' for path, text in self.get_links())
+        table = ''
+        if self.get_resources():
+            rows = ''.join(f'<tr><td>{text}</td><td><a href="{path}">{path.rsplit("/", 1)[-1]}</a></td></tr>'
+                           for path, text in self.get_resources())
+            table = f'<table><tr><th class="title">{self.title}</th></tr>{rows}</table>'
+        return '<html>' + self.render_head() +\
+               f'<body><div class="nces">{self.render_breadcrumb()}<h1>{self.title}</h1>'\
+               f'<div class="nav">{links}</div>{table}</div></body></html>'
+
+    def render_listing(self):
+        match = re.search(r'pubspagenum=(\d+)', self.path)
+        page = int(match.group(1)) if match else 1
+        # the listing has 'fanout' pages, the pages after the last one list no publication
+        publications = '' if page > self.site.fanout else ''.join(f'<li><a href="/pubsearch/pubsinfo.asp?pubid=2018{page:03}{index:02}">'
+                               f'Publication {page}.{index}</a></li>'
+                               for index in range(1, LISTING_PAGE_SIZE + 1))
+        next_page = ''
+        if page < self.site.fanout:
+            next_url = re.sub(r'pubspagenum=\d+', f'pubspagenum={page + 1}', self.path)\
+                if match else f'{self.url_path}?pubspagenum={page + 1}'
+            next_page = f'<a href="{next_url}">Next</a>'
+        return '<html>' + self.render_head() +\
+               f'<body><div class="nces"><h1>{self.title}</h1><ul>{publications}</ul>'\
+               f'{next_page}</div></body></html>'
+
+    def render_sites(self):
+        links = ''.join(f'<li><a href="{path}">{text}</a></li>' for path, text in self.get_links())
+        resources = ''.join(f'<li><a href="{path}">{text}</a></li>'
+                            for path, text in self.get_resources())
+        return '<html>' + self.render_head() +\
+               f'<body><div id="page"><header><p class="site-title">{self.title}</p>'\
+               f'<p class="site-description">{self.description}</p></header>'\
+               f'{self.render_breadcrumb()}<ul>{links}</ul><ul>{resources}</ul></div></body></html>'
+
+    def render_ocr(self):
+        links = ''.join(f'<li><a href="{path}">{text}</a></li>' for path, text in self.get_links())
+        accordions = ''.join(f'<div class="accordiontitle"><span class="accordionheader">'\
+                             f'{self.title} {text}</span><p>{self.description}</p>'\
+                             f'<a href="{path}">{text}</a></div>'
+                             for path, text in self.get_resources())
+        return '<html>' + self.render_head() +\
+               f'<body><div id="container"><div id="maincontent">{self.render_breadcrumb()}'\
+               f'<h1>{self.title}</h1><ul>{links}</ul>{accordions}</div></div></body></html>'
+
+
+def run_mirror(port, depth=3, fanout=5, dataset_ratio=0.3, latency=0):
+    """ runs the mirror on 'port' until its process is terminated """
+
+    site = server.Site(MirrorResource(depth, fanout, dataset_ratio, latency))
+    reactor.listenTCP(port, site, interface='127.0.0.1')
+    reactor.run()
+
+
+def start_mirror(port, depth=3, fanout=5, dataset_ratio=0.3, latency=0):
+    """ starts the mirror in a new process, which is returned """
+
+    # spawn (rather than fork) the mirror, so it gets a fresh twisted reactor
+    process = mp.get_context('spawn').Process(target=run_mirror,
+                                              args=(port, depth, fanout, dataset_ratio, latency),
+                                              daemon=True)
+    process.start()
+    return process
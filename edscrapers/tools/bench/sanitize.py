@@ -0,0 +1,440 @@
+""" module contains the throughput benchmark of the sanitize transformer
+(see `edscrapers.transformers.sanitize.rules`).
+
+A synthetic corpus of datasets (5000 by default, each with 10 resources) is built,
+whose titles, tags, publishers, resource names and urls and collections trigger each
+of the sanitize rules. It is sanitised with the compiled rule set, and with the
+'legacy' passes (one pass per rule, as the transformer ran them, kept below for
+reference). The group matching is also measured on its own, over a corpus of resources
+(300000 by default, many of which link to the same urls, as they do across the pages of
+a site): with the legacy scan of all the url prefixes, with the automaton of the rule
+set, and with the automaton and the memoized groups of the rule set. Each is timed over
+'repeat' runs, on fresh copies of the corpus (and with no groups memoized yet), and what
+they produce is checked to be identical """
+
+import os
+import re
+import json
+import time
+import random
+import urllib.parse
+from pathlib import Path
+
+from edscrapers.cli import logger
+from edscrapers.transformers.base import helpers as h
+from edscrapers.transformers.sanitize.helpers import categories as group_map
+from edscrapers.transformers.sanitize.transform import RULES
+
+# the implementations of the benchmark, per step
+IMPLEMENTATIONS = {'datasets': ['rules', 'legacy'],
+                   'groups': ['automaton+memo', 'automaton', 'legacy']}
+
+TITLE_WORDS = ['enrollment', 'schools', 'grade', 'national', 'conference', 'awards', 'user guide',
+               'applications', 'photos', 'foto', 'finance', 'teachers', 'graduation', 'data']
+PUBLISHERS = ['nces', 'ocr', 'edgov', 'oese', 'opepd']
+
+
+def build_corpus(datasets=5000, resources=10, seed=0):
+    """ returns a list of 'datasets' datasets, with 'resources' resources each """
+
+    rnd = random.Random(seed)
+    states = h.get_country_states(None)
+    base_urls = [base_url for urls in group_map.values() for base_url in urls]
+    corpus = []
+    for index in range(datasets):
+        title = ' '.join(rnd.choice(TITLE_WORDS).title() for _ in range(rnd.randint(2, 6)))
+        if rnd.random() < 0.3:
+            title = f'Table {rnd.randint(1, 300)}{rnd.choice(["", "a", "-b"])}. {title}'
+        source_url = f'https://{rnd.choice(base_urls)}page-{index}.html'
+        dataset = {'source_url': source_url,
+                   'title': f' {title} ',
+                   'name': f'dataset-{index}',
+                   'tags': ';'.join(rnd.sample(TITLE_WORDS, 3)),
+                   'publisher': {'name': rnd.choice(PUBLISHERS)} if rnd.random() < 0.8\
+                       else rnd.choice(PUBLISHERS),
+                   'resources': []}
+        for resource_index in range(resources):
+            name = ' '.join(rnd.choice(TITLE_WORDS) for _ in range(3))
+            if rnd.random() < 0.2:
+                name = f'{rnd.choice(states)} {name}'
+            url = f'file-{resource_index}.xls' if rnd.random() < 0.5\
+                else f'https://{rnd.choice(base_urls)}file-{resource_index}.csv'
+            dataset['resources'].append({'name': name, 'url': url, 'source_url': source_url})
+        if rnd.random() < 0.2:
+            dataset['groups'] = [rnd.choice(list(group_map))]
+        if rnd.random() < 0.3:
+            dataset['collection'] = {'collection_title': title} if rnd.random() < 0.5\
+                else [{'collection_title': title}]
+        if rnd.random() < 0.1: # sanitised before
+            dataset['_clean_data'] = {'tags': dataset['tags'] + ';awards'}
+        corpus.append(dataset)
+    return corpus
+
+
+def legacy_sanitize(dataset):
+    """ sanitises 'dataset' with the legacy passes, as the transformer did """
+
+    data = _mark_private(dataset, search_words=['conference', 'awards',
+                                                'user guide', 'applications'])
+    data = _remove_dataset(data, search_words=['photo', 'foto', 'photos', 'fotos'])
+    data = _strip_unwanted_string(data, r'^table [0-9a-z]+(-?[a-z])?\.', dict_key='title')
+    data = _set_dataset_level_of_data(data)
+    data = _set_dataset_groups(data)
+    data = _remove_old_sources_collections(data)
+    return data
+
+
+def build_resources(resources=300000, seed=0):
+    """ returns a list of 'resources' (source url, url) of resources, which link to
+    (a quarter as many) distinct urls, whether relative or absolute """
+
+    rnd = random.Random(seed)
+    base_urls = [base_url for urls in group_map.values() for base_url in urls]
+    hosts = ['www2.ed.gov/about/offices/', 'www.ed.gov/', 'sites.ed.gov/'] + base_urls
+    distinct = []
+    for index in range(max(resources // 4, 1)):
+        source_url = f'https://{rnd.choice(hosts)}page-{rnd.randrange(resources // 20 + 1)}.html'
+        url = f'data/file-{index}.xls' if rnd.random() < 0.5\
+            else f'https://{rnd.choice(hosts)}files/file-{index}.csv'
+        distinct.append((source_url, url))
+    return rnd.choices(distinct, k=resources)
+
+
+def legacy_find_groups(source_url, url):
+    """ returns the groups of a resource, as the legacy pass found them """
+
+    url = urllib.parse.urljoin(source_url, url)
+    groups = []
+    for key in group_map.keys():
+        for base_url in group_map[key]:
+            if base_url in url:
+                groups.append(key)
+    return groups
+
+
+def run_benchmark(datasets=5000, resources=10, group_resources=300000, repeat=3):
+    """ runs the throughput benchmark. Returns a list with a dict
+    of results for each (step, implementation) """
+
+    corpus = json.dumps(build_corpus(datasets, resources))
+    sanitize = {'rules': RULES.apply, 'legacy': legacy_sanitize}
+    benchmark = _run_step('datasets', lambda implementation, datasets: [
+        sanitize[implementation](dataset) for dataset in datasets],
+        lambda: json.loads(corpus), datasets, repeat)
+
+    resource_urls = build_resources(group_resources)
+    find_groups = {'automaton+memo': RULES.resource_groups,
+                   'automaton': lambda source_url, url: RULES.find_groups(
+                       urllib.parse.urljoin(source_url, url)),
+                   'legacy': legacy_find_groups}
+    benchmark.extend(_run_step('groups', lambda implementation, resource_urls: [
+        list(find_groups[implementation](source_url, url)) for source_url, url in resource_urls],
+        lambda: resource_urls, group_resources, repeat))
+    return benchmark
+
+
+def _run_step(step, run, prepare, count, repeat):
+    """ private helper.
+    times each implementation of 'step': 'run' is called with the implementation and
+    the result of 'prepare', which is not timed, and returns what the implementation produced """
+
+    outputs = dict()
+    benchmark = []
+    for implementation in IMPLEMENTATIONS[step]:
+        seconds = 0
+        for _ in range(repeat):
+            corpus = prepare()
+            RULES.resource_groups.cache_clear()
+            started_at = time.perf_counter()
+            output = run(implementation, corpus)
+            seconds += time.perf_counter() - started_at
+        outputs[implementation] = json.dumps(output)
+        seconds /= repeat
+        result = {'step': step, 'implementation': implementation, 'count': count,
+                  'milliseconds': round(1000 * seconds, 1),
+                  'per_second': round(count / seconds)}
+        logger.info(f"{step} {implementation}: {result['per_second']} {step}/sec")
+        benchmark.append(result)
+
+    identical = len(set(outputs.values())) == 1
+    for result in benchmark:
+        result['identical'] = identical
+    if not identical:
+        logger.error(f'The implementations produced different {step}!')
+    return benchmark
+
+
+def write_benchmark(benchmark):
+    """ writes the 'benchmark' results to the tools output directory.
+    Returns the path of the file written """
+
+    file_dir_path = Path(os.getenv('ED_OUTPUT_PATH'), 'tools', 'bench')
+    file_dir_path.mkdir(parents=True, exist_ok=True)
+    file_path = Path(file_dir_path, 'sanitize.json')
+    with open(file_path, 'w') as output_file:
+        json.dump(benchmark, output_file, indent=2)
+    return file_path
+
+
+def _mark_private(dataset: dict, search_words=[], add_word_tag=True,
+                  mark_as_private=True) -> dict:
+    """ private helper function.
+    FUNCTION ONLY adds/modifies the '_clean_data' key of 'dataset' during operations.
+
+    searches the dataset title for provided search_words.
+    if any search_words are found, will OPTIONALLY marks the datasets as private and
+    adds the search word as a tag to the list of keywords"""
+
+    if dataset.get('title') is None:
+        return dataset
+    
+    dataset['title'] = dataset['title'].strip()
+
+    # get the '_clean_data' key of dataset
+    clean_data = dataset.setdefault('_clean_data', {})
+    # get the title key from clean_data or use those from dataset
+    title = clean_data.get('title', dataset['title'].strip())
+    # get the tags key from clean_data or use those from dataset
+    tags = clean_data.get('tags', dataset.get('tags', '').strip())
+
+
+    for word in search_words:
+        # check if word is in dataset title
+        if re.search('\\b'+ re.escape(word) + '\\b', title, re.IGNORECASE):
+            # word is in title
+            if add_word_tag and word.lower().replace(' ', '-')\
+                not in h.transform_keywords(tags):
+                # word needs to be added to tag
+                tags = h.transform_keywords(tags)
+                tags.append(word.lower().replace(' ', '-'))
+                tags = ';'.join(tags)
+                clean_data['tags'] = tags
+            # mark dataset as 'private;
+            if mark_as_private:
+                clean_data['accessLevel'] = 'non-public'
+
+    if len(clean_data.keys()) > 0: # if '_clean_data' has keys
+        dataset['_clean_data'] = clean_data # update dataset
+    else: # else no keys
+        del dataset['_clean_data'] # delete '_clean_data' key from dataset
+
+    return dataset
+
+
+def _remove_dataset(dataset: dict, search_words=[]) -> dict:
+    """ private helper function.
+    FUNCTION ONLY adds/modifies the '_clean_data' key of 'dataset' during operations.
+
+    searches the dataset title for provided search_words.
+    if any search_words are found, will flag the dataset for deletion/removal i.e.
+    dataset should NOT be harvested.
+    
+    A dataset is flagged for deletion by adding the _remove_dataset key to the 
+    _clean_data key/dict pair """
+
+    if dataset.get('title') is None:
+        return dataset
+    
+    dataset['title'] = dataset['title'].strip()
+
+    # get the '_clean_data' key of dataset
+    clean_data = dataset.setdefault('_clean_data', {})
+    # get the title key from clean_data or use those from dataset
+    title = clean_data.get('title', dataset['title'].strip())
+     # if dataset already flagged for deletion/removal
+    if clean_data.get('_remove_dataset') and\
+        clean_data['_remove_dataset'] is True:
+        return dataset # exit function
+
+
+    for word in search_words:
+        # check if word is in dataset title
+        if re.search('\\b'+ re.escape(word) + '\\b', title, re.IGNORECASE):
+            # word is in title, so flag datset for removal/deletion
+            clean_data['_remove_dataset'] = True
+            break # exit foor loop since dataset has been marked
+
+    # Temporary fix for removing the 'edgov' datasets from the resulting datajson file
+    # FIXME set this to True once parsing / sanitizing for the publisher is improved
+    try:
+        if dataset['publisher'].get('name') == 'edgov':
+            clean_data['_remove_dataset'] = True
+    except:
+        if dataset['publisher'] == 'edgov':
+            clean_data['_remove_dataset'] = True
+
+    if len(clean_data.keys()) > 0: # if '_clean_data' has keys
+        dataset['_clean_data'] = clean_data # update dataset
+    else: # else no keys
+        del dataset['_clean_data'] # delete '_clean_data' key from dataset
+
+    return dataset
+
+
+def _strip_unwanted_string(dataset: dict, regex_str: str,
+                           dict_key='title', count=0) -> dict:
+    """ private helper function.
+    FUNCTION ONLY adds/modifies the '_clean_data' key of 'dataset' during operations.
+
+    performs a case-insensitive search for 'regex_str' on the specified
+    dataset key (dict_key) and removes the regex_str from dataset[dict_key] value.
+
+    'count' represents the number of types 'regex_str' will be removed from
+    dataset[dict_key]. 0 (the defualt) means remove all occurrences of 'regex_str'
+    
+    NOTE: the value of dataset[dict_key] MUST BE a string
+    """
+
+    if dataset.get(dict_key) is None:
+        return dataset
+    
+    # get the '_clean_data' key of dataset
+    clean_data = dataset.setdefault('_clean_data', {})
+
+    # get the dict_key value from clean_data or use those from dataset
+    dict_key_val = clean_data.get(dict_key, dataset[dict_key]).strip()
+
+    # remove regex_str from dict_key_val
+    clean_key = re.sub(regex_str, '', dict_key_val,
+                                  count=count, flags=re.IGNORECASE)
+
+    if clean_key != dataset.get(dict_key):
+        clean_data[dict_key] = clean_key
+
+    if len(clean_data.keys()) > 0: # if '_clean_data' has keys
+        dataset['_clean_data'] = clean_data # update dataset
+    else: # else no keys
+        del dataset['_clean_data'] # delete '_clean_data' key from dataset
+    
+    return dataset
+
+
+def _set_dataset_level_of_data(dataset: dict) -> dict:
+    """ private helper function.
+    FUNCTION ONLY adds/modifies the '_clean_data' key of 'dataset' during operations.
+    
+    function sets the 'level_of_data' for the dataset.
+    
+    possible values are: ['national', 'state', 
+    'district', 'school', 'individual', 
+    'Institution of Higher Education', 
+    'Accreditor', 'Grantee', 'Zip Code', 
+    'Census Block', 'Census Tract']
+
+    level of data is determined by examining each resource 'name' in the dataset.
+    """
+    if dataset.get('resources') is None:
+        return dataset
+    
+    # get the '_clean_data' key of dataset
+    clean_data = dataset.setdefault('_clean_data', {})
+
+    level_of_data = set()
+
+    # get the state names (used to determine if level of data is 'state')
+    list_of_states = list(map(lambda state: state.lower(), h.get_country_states(None)))
+
+    # loop through resources
+    for resource in dataset['resources']:
+        # if level_of_data already contain 'national' and 'state', no need to continue
+        if 'national' in level_of_data and 'state' in level_of_data:
+            break
+        else:
+            # if the string 'national' is found in the resource name or dataset title
+            if 'national' not in level_of_data and\
+                ('national' in resource.get('name', '').lower() or\
+                    'national' in dataset.get('title', '').lower()):
+                level_of_data.add('national') # add 'national'to level of data
+
+            # loop through each State name in list_of_states
+            for state in list_of_states:
+                # check if State name is contained in resource name
+                if state in resource.get('name', '').lower():
+                    level_of_data.add('state')  # add 'state' to level of data
+                    break # leave list_of_states loop
+
+    # update 'level_of_data'
+    if len(level_of_data) > 0:
+        clean_data['level_of_data'] = list(level_of_data)
+    
+    if len(clean_data.keys()) > 0: # if 'clean_data' has keys
+        dataset['_clean_data'] = clean_data # update dataset
+    else: # else no keys
+        del dataset['_clean_data'] # delete '_clean_data' key from dataset
+    
+    return dataset
+
+
+def _set_dataset_groups(dataset: dict) -> dict:
+    """ private helper function.
+    FUNCTION ONLY adds/modifies the '_clean_data' key of 'dataset' during operations.
+    
+    function sets the 'groups' for the dataset.
+    
+    groups are collected from a mapping, produced following the structure
+    in this page: https://www2.ed.gov/rschstat/catalog/index.html
+    """
+
+    def find_groups(url):
+        """returns a set of group names, if applicable"""
+        groups = []
+        keys = group_map.keys()
+        for key in keys:
+            for base_url in group_map[key]:
+                if base_url in url:
+                    # print(f'Found: {base_url} in {url} for {key}')
+                    groups.append(key)
+                # else:
+                #     print(f'Not found: {base_url} in {url} for {key}')
+        return groups
+
+    # get the '_clean_data' key of dataset
+    clean_data = dataset.setdefault('_clean_data', {})
+    # (copied, as the rule set does: the pass extended the 'groups' of the dataset itself)
+    groups = list(dataset.get('groups') or [])
+    new_groups = None
+
+    if dataset.get('resources'):
+        for resource in dataset['resources']:
+            url = urllib.parse.urljoin(resource['source_url'], resource['url'])
+            new_groups = find_groups(url)
+            if new_groups:
+                groups.extend(new_groups)
+
+    if new_groups:
+        clean_data['groups'] = list(set(groups))
+
+    if len(clean_data.keys()) > 0: # if '_clean_data' has keys
+        dataset['_clean_data'] = clean_data # update dataset
+    else: # else no keys
+        del dataset['_clean_data'] # delete '_clean_data' key from dataset
+
+    return dataset
+
+
+def _remove_old_sources_collections(dataset: dict) -> dict:
+    """ private helper function.
+    removes sources and collections that were produced by earlier
+    implementations of their respective transformers"""
+
+    if dataset.get('collection') is None or dataset.get('source'):
+        return dataset
+
+    # get the '_clean_data' key of dataset
+    clean_data = dataset.setdefault('_clean_data', {})
+    # get the title key from clean_data or use those from dataset
+    collection = clean_data.get('collection', dataset.get('collection', []))
+    # get the tags key from clean_data or use those from dataset
+    source = clean_data.get('source', dataset.get('source', []))
+
+    if type(collection) == dict:
+        clean_data['collection'] = None
+    if type(source) == dict:
+        clean_data['source'] = None
+
+    if len(clean_data.keys()) > 0: # if '_clean_data' has keys
+        dataset['_clean_data'] = clean_data # update dataset
+    else: # else no keys
+        del dataset['_clean_data'] # delete '_clean_data' key from dataset
+
+    return dataset
@@ -0,0 +1,126 @@
+""" module contains the local test server used by the benchmarks.
+
+The server serves a synthetic site of 'pages' html pages (a tree in which
+each page links to 'fanout' child pages) over TLS, negotiating HTTP/2 (or only HTTP/1.1) with ALPN.
+Each response is delayed by 'latency' seconds, to emulate a remote host, and
+the server counts the connections it accepts (see the '/stats' page) """
+
+import json
+import datetime
+import multiprocessing as mp
+
+from twisted.web import server, resource
+from twisted.internet import ssl, reactor
+from twisted.protocols.policies import WrappingFactory
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+
+class PageResource(resource.Resource):
+    """ resource serves the pages of the synthetic site (i.e. '/page/<index>') """
+
+    isLeaf = True
+
+    def __init__(self, factory, pages, fanout, latency):
+        super().__init__()
+        self.factory = factory
+        self.pages = pages
+        self.fanout = fanout
+        self.latency = latency
+
+    def render_GET(self, request):
+        if request.path == b'/stats':
+            request.setHeader(b'Content-Type', b'application/json')
+            return json.dumps({'connections': self.factory.connections,
+                               'requests': self.factory.requests}).encode('utf-8')
+
+        path_segments = request.path.decode('utf-8').strip('/').split('/')
+        if len(path_segments) != 2 or path_segments[0] != 'page' or\
+            not path_segments[1].isdigit() or int(path_segments[1]) >= self.pages:
+            request.setResponseCode(404)
+            return b'Not Found'
+
+        self.factory.requests += 1
+        index = int(path_segments[1])
+        links = ''.join(f'<a href="/page/{link_index}">Page {link_index}</a>'
+                        for link_index in range(index * self.fanout + 1,
+                                                min((index + 1) * self.fanout + 1, self.pages)))
+        body = f'<html><head><title>Page {index}</title></head>'\
+               f'<body><h1>Page {index}</h1>{links}</body></html>'.encode('utf-8')
+
+        def write_page():
+            if request.finished or request.channel is None:
+                return
+            request.setHeader(b'Content-Type', b'text/html; charset=utf-8')
+            request.write(body)
+            request.finish()
+
+        reactor.callLater(self.latency, write_page)
+        return server.NOT_DONE_YET
+
+
+class CountingFactory(WrappingFactory):
+    """ factory counts the connections (and page requests) received by the wrapped site.
+
+    The protocols offered with ALPN are set once on the TLS context (see `run_server()`),
+    rather than asked to the site for every connection """
+
+    connections = 0
+    requests = 0
+
+    def buildProtocol(self, addr):
+        self.connections += 1
+        return super().buildProtocol(addr)
+
+
+def create_certificate(hostname='localhost'):
+    """ returns a self-signed (twisted) PrivateCertificate for 'hostname' """
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048,
+                                           backend=default_backend())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, hostname)])
+    now = datetime.datetime.utcnow()
+    certificate = x509.CertificateBuilder().subject_name(name).issuer_name(name).\
+        public_key(private_key.public_key()).serial_number(x509.random_serial_number()).\
+        not_valid_before(now - datetime.timedelta(days=1)).\
+        not_valid_after(now + datetime.timedelta(days=1)).\
+        add_extension(x509.SubjectAlternativeName([x509.DNSName(hostname)]), critical=False).\
+        sign(private_key, hashes.SHA256(), default_backend())
+
+    key_pem = private_key.private_bytes(encoding=serialization.Encoding.PEM,
+                                        format=serialization.PrivateFormat.TraditionalOpenSSL,
+                                        encryption_algorithm=serialization.NoEncryption())
+    certificate_pem = certificate.public_bytes(serialization.Encoding.PEM)
+    return ssl.PrivateCertificate.loadPEM(key_pem + certificate_pem)
+
+
+def run_server(port, pages=500, fanout=10, latency=0.05, http2=True):
+    """ runs the test server on 'port' until its process is terminated.
+    If 'http2' is False, the server only negotiates HTTP/1.1 """
+
+    site = server.Site(None)
+    factory = CountingFactory(site)
+    site.resource = PageResource(factory, pages, fanout, latency)
+
+    certificate = create_certificate()
+    protocols = [b'h2', b'http/1.1'] if http2 else [b'http/1.1']
+    context_factory = ssl.CertificateOptions(privateKey=certificate.privateKey.original,
+                                             certificate=certificate.original,
+                                             acceptableProtocols=protocols)
+    reactor.listenSSL(port, factory, context_factory, interface='127.0.0.1')
+    reactor.run()
+
+
+def start_server(port, pages=500, fanout=10, latency=0.05, http2=True):
+    """ starts the test server in a new process, which is returned """
+
+    # spawn (rather than fork) the server, so it gets a fresh twisted reactor
+    process = mp.get_context('spawn').Process(target=run_server,
+                                              args=(port, pages, fanout, latency, http2),
+                                              daemon=True)
+    process.start()
+    return process
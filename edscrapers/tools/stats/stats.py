@@ -11,7 +11,7 @@ import requests
 
 from json.decoder import JSONDecodeError
 
-from  edscrapers.transformers.base.helpers import traverse_output
+from  edscrapers.transformers.base.helpers import traverse_output, read_file
 from edscrapers.cli import logger
 
 class Statistics():
@@ -114,17 +114,16 @@ class Statistics():
                 if 'data.json' in str(fp):
                     continue
 
-                with open(fp, 'r') as json_file:
-                    try:
-                        j = json.load(json_file)
-                        j = [{
-                            'url': abs_url(r['url'], r['source_url']),
-                            'source_url': r['source_url'],
-                            'scraper': fp.parent.name
-                        } for r in j['resources'] if r['source_url'].find('/print/') == -1]
-                        dfs.append(pd.read_json(json.dumps(j)))
-                    except:
-                        logger.warning(f'Could not parse file {json_file} as JSON!')
+                try:
+                    j = read_file(fp)
+                    j = [{
+                        'url': abs_url(r['url'], r['source_url']),
+                        'source_url': r['source_url'],
+                        'scraper': fp.parent.name
+                    } for r in j['resources'] if r['source_url'].find('/print/') == -1]
+                    dfs.append(pd.read_json(json.dumps(j)))
+                except:
+                    logger.warning(f'Could not parse file {fp} as JSON!')
             df = pd.concat(dfs, ignore_index=True)
             df.to_csv(df_dump, index=False)
 
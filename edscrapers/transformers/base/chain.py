@@ -0,0 +1,136 @@
+""" module contains the engine running a chain of transformers
+(e.g. `eds transform deduplicate,sanitize,datajson`) in a single pass.
+
+The transformers which work dataset by dataset (deduplicate, sanitize, datajson)
+expose a `Stage` class. Each scraped dataset is read once and streamed through the
+stages of the chain, in order. A stage does its work on a dataset in two steps:
+ - `prepare()` (optional) does the work which only depends on the dataset itself
+ (e.g. sanitising it). It returns the dataset (possibly changed) for the next stage,
+ and what the stage prepared from it (e.g. the datajson Dataset), if anything.
+ It may run in a worker process (see `eds transform --jobs`), so it must not change
+ the stage, and what it returns must be picklable.
+ - `process()` does the rest (e.g. keeping the titles unique, writing the dataset)
+ with what was prepared. It is called in this process, dataset by dataset, in file
+ order, and returns the dataset, or None to drop it (e.g. a duplicate).
+Once all the datasets went through, each stage writes its output (e.g. the
+deduplicated list or the data.json). The datasets are read with their '_clean_data'
+from the overlay store, if any (see `transformers.base.overlay`).
+
+The other transformers of the chain run as a whole: those listed before the stages
+(e.g. sources and collections, which the datajson stage reads) before the pass, and
+those listed after them (e.g. rag, which reads the data.json) after it """
+
+import importlib
+import inspect
+
+from edscrapers.cli import logger
+from edscrapers.transformers.base import helpers as h
+from edscrapers.transformers.base.overlay import read_dataset
+from edscrapers.transformers.base.executor import ProcessMap, read_ahead
+
+
+def get_file_list(name=None, input_file=None):
+    """ returns the dataset files to transform: the files listed in
+    'input_file' if given, or else the output of the 'name' scraper """
+
+    if input_file is None:
+        return h.traverse_output(name)
+    try:
+        with open(input_file, 'r') as fp:
+            return [line.rstrip() for line in fp]
+    except:
+        logger.warning(f'Cannot read from list of output files at {input_file}, falling back to all collected data!')
+        return h.traverse_output(name)
+
+
+def run_stages(stages, file_list, jobs=1):
+    """ streams the datasets of the files in 'file_list' through the 'stages',
+    then has each stage write its output. The datasets are prepared in 'jobs' processes """
+
+    logger.debug(f'{len(file_list)} files to transform.')
+    # the workers are started before the threads reading ahead
+    with ProcessMap(prepare_dataset, stages, jobs=jobs) as process_map:
+        for file_path, prepared in process_map.map(_read_datasets(file_list)):
+            for stage, (data, result) in zip(stages, prepared):
+                if not data: # no data or the dataset was dropped by the previous stage
+                    break
+                if stage.process(file_path, data, result) is None:
+                    break
+
+    for stage in stages:
+        stage.finish()
+
+
+def prepare_dataset(stages, dataset):
+    """ returns the (file path, prepared) of a ('file path', data) 'dataset', where
+    prepared is the list of what each of the 'stages' prepared, as (data, result) """
+
+    file_path, data = dataset
+    prepared = []
+    for stage in stages:
+        result = None
+        if data and hasattr(stage, 'prepare'):
+            data, result = stage.prepare(file_path, data)
+        prepared.append((data, result))
+    return file_path, prepared
+
+
+def _read_datasets(file_list):
+    """ private helper.
+    iterates over the (file path, data) of the files in 'file_list', which are read ahead """
+
+    for file_path, data, error in read_ahead(file_list, read_dataset):
+        if error is not None:
+            logger.warning(f'Failed to parse file {file_path} as JSON!')
+            continue
+        yield file_path, data
+
+
+def run_transformer(module, name=None, input_file=None, **options):
+    """ runs the transformer of 'module' as a whole, with the 'options'
+    (e.g. 'jobs') it takes """
+
+    return module.transform(name, input_file, **_get_supported(module.transform, options))
+
+
+def _get_supported(function, options):
+    """ private helper.
+    returns the 'options' which 'function' takes as keyword arguments """
+
+    parameters = inspect.signature(function).parameters
+    return {option: value for option, value in options.items() if option in parameters}
+
+
+def transform(transformers, name=None, input_file=None, jobs=1, overlay=False):
+    """ runs the chain of 'transformers' (a list of transformer names) on the
+    output of the 'name' scraper (or the files listed in 'input_file'),
+    in 'jobs' processes. With 'overlay', the sanitize transformer keeps
+    its changes in the overlay store """
+
+    modules = [importlib.import_module(f'edscrapers.transformers.{transformer}.transform')
+               for transformer in transformers]
+    streamed = [index for index, module in enumerate(modules) if hasattr(module, 'Stage')]
+    if not streamed:
+        for module in modules:
+            run_transformer(module, name, input_file, jobs=jobs, overlay=overlay)
+        return
+
+    first, last = streamed[0], streamed[-1]
+    for transformer, module in zip(transformers[first:last], modules[first:last]):
+        if not hasattr(module, 'Stage'):
+            raise ValueError(f'The {transformer} transformer does not work dataset by dataset, '\
+                             f'so it can only be chained before or after the others')
+
+    for module in modules[:first]:
+        run_transformer(module, name, input_file, jobs=jobs, overlay=overlay)
+
+    # the last stage is the only one whose datasets go no further
+    stages = [module.Stage(name, downstream=(index != last),
+                           **_get_supported(module.Stage, {'overlay': overlay}))
+              for index, module in enumerate(modules) if index in streamed]
+    logger.info(f"Streaming the datasets through {', '.join(transformers[first:last + 1])}")
+    run_stages(stages, get_file_list(name, input_file), jobs=jobs)
+
+    # the transformers after the stages work on their output (e.g. the data.json)
+    for module in modules[last + 1:]:
+        run_transformer(module, name, jobs=jobs, overlay=overlay)
@@ -0,0 +1,124 @@
+""" module contains the parallel execution of the transformers (see `eds transform --jobs`).
+
+The dataset files are read ahead, in order, by a few threads (see `read_ahead()`),
+as reading them is mostly waiting on the disk. The CPU-heavy work done on each dataset
+on its own is mapped over a pool of worker processes (see `ProcessMap`), by batches of
+datasets, and comes back in order too. So the work which depends on the datasets before
+(e.g. the unique titles of the datajson transformer) is done in this process, dataset by
+dataset in file order, as with a single job: the output is the same whatever the number
+of jobs """
+
+import collections
+import itertools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# the number of files read ahead, and the threads reading them
+READ_AHEAD = 64
+READ_THREADS = 4
+# the number of datasets sent to a worker process at once
+BATCH_SIZE = 32
+
+# the context of the functions mapped in a worker process (see `ProcessMap`)
+_context = None
+
+
+def map_ordered(executor, function, items, window):
+    """ iterates over the results of 'function' for each of 'items', in order.
+    The calls are submitted to 'executor', at most 'window' at a time """
+
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def read_ahead(file_list, read, size=READ_AHEAD, threads=READ_THREADS):
+    """ iterates over the files of 'file_list' as (file path, data, error) tuples, in order,
+    where data is what 'read' returns for the file, or error the exception it raised.
+    Up to 'size' files are read ahead of the one iterated over """
+
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='read-ahead') as executor:
+        yield from map_ordered(executor, lambda file_path: _read(read, file_path),
+                               file_list, size)
+
+
+def _read(read, file_path):
+    """ private helper.
+    reads a file for `read_ahead()` """
+
+    try:
+        return file_path, read(file_path), None
+    except Exception as e:
+        return file_path, None, e
+
+
+class ProcessMap():
+    """ class maps 'function' over items, in 'jobs' worker processes.
+    'function' is called with 'context' (e.g. the stages of a transformer chain),
+    which is sent once to each worker, and an item. It must be a module-level function,
+    and the items and its results must be picklable. With a single job, the
+    items are mapped in this process.
+
+    To be used as a context manager, which starts the workers (before any thread,
+    e.g. of `read_ahead()`, is started, as they are forked) and stops them """
+
+    def __init__(self, function, context=None, jobs=1, batch_size=BATCH_SIZE):
+        self.function = function
+        self.context = context
+        self.jobs = jobs
+        self.batch_size = batch_size
+        self.executor = None
+
+    def __enter__(self):
+        if self.jobs > 1:
+            # the workers are forked where possible, so the context need not be pickled
+            mp_context = multiprocessing.get_context('fork')\
+                if 'fork' in multiprocessing.get_all_start_methods() else None
+            self.executor = ProcessPoolExecutor(max_workers=self.jobs, mp_context=mp_context,
+                                                initializer=_set_context,
+                                                initargs=(self.context,))
+            # the workers are all started at the first submission
+            self.executor.submit(int).result()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def map(self, items):
+        """ iterates over the results of the function for each of 'items', in order """
+
+        if self.executor is None:
+            for item in items:
+                yield self.function(self.context, item)
+            return
+
+        items = iter(items)
+        batches = iter(lambda: list(itertools.islice(items, self.batch_size)), [])
+        call = _BatchCall(self.function)
+        for results in map_ordered(self.executor, call, batches, window=2 * self.jobs):
+            yield from results
+
+
+class _BatchCall():
+    """ private helper.
+    calls a function over a batch of items in a worker process """
+
+    def __init__(self, function):
+        self.function = function
+
+    def __call__(self, batch):
+        return [self.function(_context, item) for item in batch]
+
+
+def _set_context(context):
+    """ private helper.
+    sets the context of the functions mapped in a worker process """
+
+    global _context
+    _context = context
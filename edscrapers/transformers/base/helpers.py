@@ -2,12 +2,14 @@ import os
 import json
 from pathlib import Path
 import re
+import itertools
 
 from slugify import slugify
 from urllib.parse import urlparse
 from urllib.parse import urljoin
 
 from edscrapers.cli import logger
+from edscrapers.scrapers.base import segments
 
 OUTPUT_DIR = os.getenv('ED_OUTPUT_PATH')
 
@@ -132,28 +134,59 @@ def get_media_type(format):
 
 def traverse_output(target=None):
     if target is None:
-        results = Path(os.path.join(OUTPUT_DIR, 'scrapers')).rglob('*.json')
+        output_dir = Path(os.path.join(OUTPUT_DIR, 'scrapers'))
     else:
         if target in ['oese', 'osers', 'oela', 'octae', 'ope', 'opepd']:
-            results = Path(os.path.join(OUTPUT_DIR, 'scrapers', 'edgov', target)).glob('**/*.json')
+            output_dir = Path(os.path.join(OUTPUT_DIR, 'scrapers', 'edgov', target))
         else:
-            results = Path(os.path.join(OUTPUT_DIR, 'scrapers', target)).glob('**/*.json')
+            output_dir = Path(os.path.join(OUTPUT_DIR, 'scrapers', target))
+    results = output_dir.glob('**/*.json')
+
+    # the datasets written to segments (see `scrapers.base.segments`) are
+    # listed with their path in the file layout, which is read as well
+    results = dict.fromkeys(itertools.chain(results, segments.iter_dataset_paths(output_dir)))
 
     files_list = [f for f in results
                   if 'print' not in str(f).split('/')[-1].split('-')]
     return files_list
 
 def read_file(file_path):
-    with open(file_path, 'r') as fl:
-        data = json.load(fl)
+    try:
+        with open(file_path, 'r') as fl:
+            data = json.load(fl)
+            return data
+    except FileNotFoundError:
+        # the dataset may be in the segments of the 'segments' output layout
+        data = segments.read_dataset(file_path)
+        if data is None:
+            raise
         return data
 
 
 def write_file(file_path, data, mode='w'):
-    """ write data to a file as json """
+    """ write data to a file as json.
+    A file (over)written is replaced at once, through a temporary file,
+    so it is never left half-written (e.g. if the process is killed) """
+
+    if mode == 'w' and not Path(file_path).exists() and segments.has_dataset(file_path):
+        # the dataset is (re)written to its segments
+        segments.write_dataset(file_path, data)
+        return
+
+    if mode != 'w':
+        with open(file_path, mode) as fl:
+            json.dump(data, fl, indent=2)
+        return
 
-    with open(file_path, mode) as fl:
-        json.dump(data, fl, indent=2)
+    temp_file_path = f'{file_path}.{os.getpid()}.tmp'
+    try:
+        with open(temp_file_path, 'w') as fl:
+            json.dump(data, fl, indent=2)
+        os.replace(temp_file_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+        raise
 
 
 
@@ -173,8 +206,8 @@ def transform_keywords(tags_string):
 
     # split keywords using regex
     keywords = re.split(r'[,;]+', tags_string, flags=re.IGNORECASE)
-    keywords = set(keywords) # remove duplicates
-    keywords.discard('') # remove any empty strings from the set
+    keywords = dict.fromkeys(keywords) # remove duplicates, keeping the order of the tags
+    keywords.pop('', None) # remove any empty strings
     
     keywords = list(keywords)
 
@@ -0,0 +1,132 @@
+""" module contains the overlay store of the sanitize transformer
+(see `eds transform --overlay sanitize`).
+
+Rather than in the scraped datasets themselves, the changes the sanitize transformer
+makes to a dataset (its '_clean_data') may be kept in this store, keyed on the path
+of the dataset (relative to ED_OUTPUT_PATH, as its `saved_as_file`), so the scraper
+output is left as it was scraped. A dataset read with `read_dataset()` (as the
+transformers working dataset by dataset read them) has the '_clean_data' of the
+store, which takes precedence over the one in the dataset file, if any """
+
+import os
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+from edscrapers.transformers.base import helpers as h
+
+# the store used by `read_dataset()`, once it exists
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_overlay_store_path():
+    """ returns the path of the database of the overlay store """
+
+    return Path(os.getenv('ED_OUTPUT_PATH'), 'transformers', 'sanitize', 'overlay.sqlite')
+
+
+def get_dataset_key(file_path):
+    """ returns the key of the dataset with 'file_path' in the store """
+
+    file_path = os.path.abspath(file_path)
+    output_path = os.path.abspath(os.getenv('ED_OUTPUT_PATH')) + os.sep
+    if file_path.startswith(output_path):
+        return file_path[len(output_path):]
+    return file_path # not in the output
+
+
+class OverlayStore():
+    """ class provides access to the overlay store.
+
+    Changes are buffered and only written by `flush()` (or `close()`),
+    which is done every 'commit_every' changes """
+
+    def __init__(self, file_path, commit_every=100):
+        file_path = Path(file_path)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        # the store is read from the threads reading the datasets ahead
+        self.connection = sqlite3.connect(str(file_path), timeout=60, check_same_thread=False)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS overlay
+                                   (file TEXT PRIMARY KEY, clean_data TEXT) WITHOUT ROWID''')
+        self.connection.commit()
+        self.lock = threading.Lock()
+        self.commit_every = commit_every
+        self.pending = dict()
+
+    def get(self, file_path):
+        """ returns the '_clean_data' (as JSON, 'null' for none) of the dataset
+        with 'file_path', or None if the store does not have the dataset """
+
+        key = get_dataset_key(file_path)
+        with self.lock:
+            if key in self.pending:
+                return self.pending[key]
+            row = self.connection.execute('SELECT clean_data FROM overlay WHERE file = ?',
+                                          (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, file_path, clean_data):
+        """ sets the '_clean_data' (a dict, or None) of the dataset with 'file_path' """
+
+        with self.lock:
+            self.pending[get_dataset_key(file_path)] = json.dumps(clean_data)
+            if len(self.pending) >= self.commit_every:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        """ private helper.
+        writes the pending changes, with the lock held """
+
+        self.connection.executemany('INSERT OR REPLACE INTO overlay (file, clean_data) VALUES (?, ?)',
+                                    self.pending.items())
+        self.connection.commit()
+        self.pending = dict()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+def get_store(create=False):
+    """ returns the overlay store, or None if it does not exist (unless 'create' is set) """
+
+    global _store
+    with _store_lock:
+        if _store is None and (create or get_overlay_store_path().exists()):
+            _store = OverlayStore(get_overlay_store_path())
+        return _store
+
+
+def close_store():
+    """ closes the store used by `read_dataset()` """
+
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+            _store = None
+
+
+def read_dataset(file_path):
+    """ returns the dataset with 'file_path' (read with `helpers.read_file()`),
+    with its '_clean_data' from the overlay store, if the store has the dataset """
+
+    data = h.read_file(file_path)
+    store = get_store()
+    if store is None or not isinstance(data, dict):
+        return data
+
+    clean_data = store.get(file_path)
+    if clean_data is not None:
+        clean_data = json.loads(clean_data)
+        if clean_data:
+            data['_clean_data'] = clean_data
+        else:
+            data.pop('_clean_data', None)
+    return data
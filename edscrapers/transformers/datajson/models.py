@@ -1,53 +1,156 @@
+""" module contains the models of the datajson output (the data.json catalog).
+
+The models keep their attributes in slots (no instance dict), and each instance has
+its own lists and dicts. A model lists the keys of its JSON (leaving out those with no
+value) in `json_fields()`, from which `to_dict()` is built. The models are encoded to
+JSON straight from their fields by `dump_json()`, without building their dicts first """
+
+import os
 import json
 from datetime import datetime
 
 from edscrapers.transformers.base import helpers as h 
 
-class Organization():
+# the encoder of the strings, as json.dumps escapes them (the C one, where available)
+_encode_string = json.encoder.encode_basestring_ascii
+# the (string) keys kept encoded, with their separator, and their number at most
+ENCODED_KEYS_SIZE = 1000
+_encoded_keys = dict()
+
+
+def dump_json(value, newline='\n'):
+    """ function returns the JSON of 'value' (a model, or what json.dumps encodes)
+    as `json.dumps(value, indent=2)` returns it (of the dict of a model).
+    'newline' is the line break of the indentation 'value' is nested at """
+
+    if isinstance(value, str):
+        return _encode_string(value)
+    if isinstance(value, dict):
+        fields = value.items()
+    elif isinstance(value, _Model):
+        fields = value.json_fields()
+    elif isinstance(value, (list, tuple)):
+        if not value:
+            return '[]'
+        inner = newline + '  '
+        return '[' + inner + (',' + inner).join([
+            _encode_string(item) if item.__class__ is str else dump_json(item, inner)
+            for item in value]) + newline + ']'
+    else: # numbers, booleans and None
+        return json.dumps(value)
+
+    if not fields:
+        return '{}'
+    inner = newline + '  '
+    # the strings (most of the values) are encoded right away
+    return '{' + inner + (',' + inner).join([
+        (_encoded_keys.get(key) or _encode_key(key))
+        + (_encode_string(item) if item.__class__ is str else dump_json(item, inner))
+        for key, item in fields]) + newline + '}'
+
+
+def _encode_key(key):
+    """ function is a private helper.
+    function returns the JSON of a dict 'key', as json.dumps encodes it, with its separator.
+    The keys of the models (and the first ENCODED_KEYS_SIZE string keys) are kept encoded """
+
+    if isinstance(key, str):
+        if len(_encoded_keys) < ENCODED_KEYS_SIZE:
+            _encoded_keys[key] = _encode_string(key) + ': '
+        return _encode_string(key) + ': '
+    if key is None or isinstance(key, (bool, int, float)):
+        return _encode_string(json.dumps(key)) + ': '
+    raise TypeError(f'keys must be str, int, float, bool or None, not {key.__class__.__name__}')
+
+
+def _to_dict(value):
+    """ function is a private helper.
+    function returns 'value', with the models in it as their dicts """
+
+    if isinstance(value, _Model):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [_to_dict(item) for item in value]
+    return value
+
+
+class _Model():
+    """ class is the base of the models """
+
+    __slots__ = ()
+
+    def json_fields(self):
+        """ function returns the list of the (key, value) of the JSON of the model """
+        raise NotImplementedError
+
+    def to_dict(self):
+        return {key: _to_dict(value) for key, value in self.json_fields()}
+
+    def dump_json(self, newline='\n'):
+        return dump_json(self, newline)
 
-    organization_type = str()
-    name = str()
-    sub_organization_of = None
+
+class Organization(_Model):
+
+    __slots__ = ('organization_type', 'name', 'sub_organization_of')
 
     def __init__(self):
 
         self.organization_type = "org:Organization"
+        self.name = str()
+        self.sub_organization_of = None
 
-    def to_dict(self):
-
-        if not self.name:
-            return None
+    def json_fields(self):
 
-        org_dict = {
-            "@type": self.organization_type,
-            "name": self.name
-        }
+        fields = [("@type", self.organization_type), ("name", self.name)]
 
         if self.sub_organization_of is not None:
-            org_dict["subOrganizationOf"] = self.sub_organization_of
+            fields.append(("subOrganizationOf", self.sub_organization_of))
+
+        return fields
 
-        return org_dict
+    def to_dict(self):
+
+        if not self.name:
+            return None
 
-class Catalog():
+        return super().to_dict()
 
-    catalog_id = str()
-    catalog_type = str()
-    context = str()
-    conformsTo = str()
-    describedBy = str()
-    datasets = list() # datasets list
-    sources = list() # Sources list
-    collections = list() # Collection list
+class Catalog(_Model):
 
+    __slots__ = ('catalog_id', 'catalog_type', 'context', 'conformsTo', 'describedBy',
+                 'datasets', 'sources', 'collections', 'dropped_links')
 
     def __init__(self):
         
+        self.catalog_id = str()
         self.catalog_type = "dcat:Catalog"
         self.context = "https://project-open-data.cio.gov/v1.1/schema/catalog.jsonld"
         self.conformsTo = "https://project-open-data.cio.gov/v1.1/schema"
         self.describedBy = "https://project-open-data.cio.gov/v1.1/schema/catalog.json"
+        self.datasets = list() # datasets list
+        self.sources = list() # Sources list
+        self.collections = list() # Collection list
+        # the number of invalid links removed by the validation, per type
+        self.dropped_links = {'collection_sources': 0, 'dataset_sources': 0,
+                              'dataset_collections': 0}
 
-    def to_dict(self):
+    def json_fields(self):
+
+        fields = list(self.dump_header().items())
+
+        if len(self.datasets) > 0:
+            fields.append(("dataset", self.datasets))
+        
+        if len(self.sources) > 0:
+            fields.append(('source', self.sources))
+
+        if len(self.collections) > 0:
+            fields.append(('collection', self.collections))
+
+        return fields
+
+    def dump_header(self):
 
         catalog_dict = {}
 
@@ -66,47 +169,19 @@ class Catalog():
         if self.describedBy:
             catalog_dict["describedBy"] = self.describedBy
 
-        if len(self.datasets) > 0:
-            catalog_dict["dataset"] = self.dump_datasets()
-        
-        if len(self.sources) > 0:
-            catalog_dict['source'] = self.dump_sources()
-
-        if len(self.collections) > 0:
-            catalog_dict['collection'] = self.dump_collections() 
-
         return catalog_dict
 
     def dump_datasets(self):
-
-        datasets_lst = []
-
-        for dataset in self.datasets:
-            datasets_lst.append(dataset.to_dict())
-
-        return datasets_lst
+        return _to_dict(self.datasets)
     
     def dump_sources(self):
-
-        sources_lst = []
-
-        for source in self.sources:
-            sources_lst.append(source.to_dict())
-
-        return sources_lst
+        return _to_dict(self.sources)
 
     def dump_collections(self):
-
-        collections_lst = []
-
-        for collection in self.collections:
-            collections_lst.append(collection.to_dict())
-
-        return collections_lst
-
+        return _to_dict(self.collections)
     
     def dump(self):
-        return json.dumps(self.to_dict(), sort_keys=False, indent=2)
+        return self.dump_json()
     
     def validate_catalog(self, pls_fix: bool = True):
         """ function is used to validate the entire catalog object to ensure it
@@ -155,33 +230,10 @@ class Catalog():
         `catalog.validate_catalog()`
         """
 
-        # get a mapped list of sources that belong to this catalog
-        mapped_sources = list(map(lambda source: source.id, self.sources))
-
-        # loop through the list of collections in this catalog object
-        for collection in self.collections:
-            remove_collection_sources = [] # holds the list of collection sources to be removed
-            # loop through the list of sources in each collection
-            for collection_source in collection.sources:
-                # check if this collection source is in the list of Sources within this catalog
-                if collection_source.id not in mapped_sources: # collection source not in catalog sources
-                    # check if this validation error should be fixed
-                    if pls_fix is False: # do not fix
-                        return False # validation failed
-                    elif pls_fix is True: # try to fix
-                        # flag/collect the 'failed' collection_source for removal/unlinking
-                        remove_collection_sources.append(collection_source)
-                    else:
-                        raise TypeError("wrong type for parameter 'pls_fix'. expecting bool")
-            # after looping through collection sources, check if there are any collection sources within the catalog that need to be deleted
-            if len(remove_collection_sources) > 0:
-                # remove invalid collection sources for this catalog
-                for remove_collection_source in remove_collection_sources:
-                    try:
-                        collection.sources.remove(remove_collection_source)
-                    except:
-                        pass
-        return True # validation completed
+        # get the set of the ids of the sources that belong to this catalog
+        mapped_sources = {source.id for source in self.sources}
+        return self._validate_links('collection_sources', self.collections, 'sources',
+                                    mapped_sources, pls_fix)
     
     def validate_dataset_sources(self, pls_fix: bool = True):
         """
@@ -194,33 +246,10 @@ class Catalog():
         `catalog.validate_catalog()`
         """
 
-        # get a mapped list of sources that belong to this catalog
-        mapped_sources = list(map(lambda source: source.id, self.sources))
-
-        # loop through the list of datasets in this catalog object
-        for dataset in self.datasets:
-            remove_dataset_sources = [] # holds the list of dataset sources to be removed
-            # loop through the list of sources in each dataset
-            for dataset_source in dataset.source:
-                # check if this dataset source is in the list of Sources within this catalog
-                if dataset_source.id not in mapped_sources: # dataset source not in catalog sources
-                    # check if this validation error should be fixed
-                    if pls_fix is False: # do not fix
-                        return False # validation failed
-                    elif pls_fix is True: # try to fix
-                        # flag/collect the 'failed' dataset_source for removal/unlinking
-                        remove_dataset_sources.append(dataset_source)
-                    else:
-                        raise TypeError("wrong type for parameter 'pls_fix'. expecting bool")
-            # after looping through dataset sources, check if there are any dataset sources within the catalog that need to be deleted
-            if len(remove_dataset_sources) > 0:
-                # remove invalid dataset sources for this catalog
-                for remove_dataset_source in remove_dataset_sources:
-                    try:
-                        dataset.source.remove(remove_dataset_source)
-                    except:
-                        pass
-        return True # validation completed
+        # get the set of the ids of the sources that belong to this catalog
+        mapped_sources = {source.id for source in self.sources}
+        return self._validate_links('dataset_sources', self.datasets, 'source',
+                                    mapped_sources, pls_fix)
     
     def validate_dataset_collections(self, pls_fix: bool = True):
         """
@@ -233,264 +262,297 @@ class Catalog():
         `catalog.validate_catalog()`
         """
 
-        # get a mapped list of collections that belong to this catalog
-        mapped_collections = list(map(lambda collection: collection.id, self.collections))
-
-        # loop through the list of datasets in this catalog object
-        for dataset in self.datasets:
-            remove_dataset_collections = [] # holds the list of dataset collections to be removed
-            # loop through the list of collections in each dataset
-            for dataset_collection in dataset.collection:
-                # check if this dataset collection is in the list of Collections within this catalog
-                if dataset_collection.id not in mapped_collections: # dataset collection not in catalog collections
-                    # check if this validation error should be fixed
-                    if pls_fix is False: # do not fix
-                        return False # validation failed
-                    elif pls_fix is True: # try to fix
-                        # flag/collect the 'failed' dataset_source for removal/unlinking
-                        remove_dataset_collections.append(dataset_collection)
-                    else:
-                        raise TypeError("wrong type for parameter 'pls_fix'. expecting bool")
-            # after looping through dataset collections,
-            # check if there are any dataset collections within the catalog that need to be deleted
-            if len(remove_dataset_collections) > 0:
-                # remove invalid dataset collections for this catalog
-                for remove_dataset_collection in remove_dataset_collections:
-                    try:
-                        dataset.collection.remove(remove_dataset_collection)
-                    except:
-                        pass
+        # get the set of the ids of the collections that belong to this catalog
+        mapped_collections = {collection.id for collection in self.collections}
+        return self._validate_links('dataset_collections', self.datasets, 'collection',
+                                    mapped_collections, pls_fix)
+
+    def _validate_links(self, link_type, items, attribute, ids, pls_fix):
+        """ function is a private helper.
+        function validates that the links of each of 'items' (its 'attribute' list,
+        e.g. the `source` of a dataset) are to one of 'ids'. With 'pls_fix', the
+        links which are not are removed, and counted in `dropped_links[link_type]`.
+        Return value is the same as `catalog.validate_catalog()` """
+
+        for item in items:
+            links = getattr(item, attribute)
+            valid_links = [link for link in links if link.id in ids]
+            if len(valid_links) == len(links): # all the links are valid
+                continue
+            # check if this validation error should be fixed
+            if pls_fix is False: # do not fix
+                return False # validation failed
+            elif pls_fix is True: # fix, by keeping the valid links only
+                setattr(item, attribute, valid_links)
+                self.dropped_links[link_type] += len(links) - len(valid_links)
+            else:
+                raise TypeError("wrong type for parameter 'pls_fix'. expecting bool")
         return True # validation completed
 
 
-class Source():
+
+class CatalogWriter():
+    """ class writes a catalog to a data.json file as its datasets are added
+    (see `write_dataset()`), rather than once they are all held in the catalog.
+    The file is the same as `Catalog.dump()` writes of the catalog with all the
+    datasets, validated with `Catalog.validate_catalog(pls_fix=True)`.
+
+    The Sources and Collections of the catalog must be set before. The links of each
+    dataset to those are validated (and fixed) against the sets of their ids, as the
+    dataset is written, so only the dataset being written is held at once. The links
+    removed are counted in the `dropped_links` of the catalog. The file
+    is written to a temporary file, which replaces it once complete (see `close()`) """
+
+    def __init__(self, catalog: Catalog, file_path):
+        self.catalog = catalog
+        self.file_path = file_path
+        self.source_ids = {source.id for source in catalog.sources}
+        self.collection_ids = {collection.id for collection in catalog.collections}
+        self.datasets_number = 0
+        self.output = None
+
+    def open(self):
+        self.output = open(f'{self.file_path}.tmp', 'w')
+        header = dump_json(self.catalog.dump_header())
+        self.output.write(header[:-len('\n}')]) # the other keys follow
+
+    def write_dataset(self, dataset):
+        """ validates the links of 'dataset' to the Sources and Collections
+        of the catalog, removing those which are not in it, and writes it """
+
+        self.catalog._validate_links('dataset_sources', [dataset], 'source', self.source_ids, True)
+        self.catalog._validate_links('dataset_collections', [dataset], 'collection',
+                                     self.collection_ids, True)
+
+        self.output.write(',\n    ' if self.datasets_number else ',\n  "dataset": [\n    ')
+        self.output.write(dataset.dump_json('\n    '))
+        self.datasets_number += 1
+
+    def close(self):
+        """ writes the Sources and Collections of the catalog, and completes the file """
+
+        catalog = self.catalog
+        if self.datasets_number:
+            self.output.write('\n  ]')
+
+        # validate the Collections link to Sources in the catalog
+        catalog.validate_collection_sources(pls_fix=True)
+        if len(catalog.sources) > 0:
+            self.output.write(',\n  "source": ' + dump_json(catalog.sources, '\n  '))
+        if len(catalog.collections) > 0:
+            self.output.write(',\n  "collection": ' + dump_json(catalog.collections, '\n  '))
+
+        self.output.write('\n}')
+        self.output.close()
+        os.replace(f'{self.file_path}.tmp', self.file_path)
+
+
+class Source(_Model):
     
-    id = str()
-    url = str()
-    title = str()
+    __slots__ = ('id', 'url', 'title')
 
-    def to_dict(self):
+    def __init__(self):
+
+        self.id = str()
+        self.url = str()
+        self.title = str()
+
+    def json_fields(self):
         
-        source_dict = {}
+        fields = []
 
         if self.id:
-            source_dict['id'] = self.id
+            fields.append(('id', self.id))
         
         if self.title:
-            source_dict['title'] = self.title
+            fields.append(('title', self.title))
 
         if self.url:
-            source_dict['scraped_from'] = self.url
+            fields.append(('scraped_from', self.url))
         
-        return source_dict
+        return fields
 
-class Collection():
+class Collection(_Model):
 
-    id = str()
-    url = str()
-    title = str()
-    sources = list()
+    __slots__ = ('id', 'url', 'title', 'sources')
 
     def __init__(self):
+
+        self.id = str()
+        self.url = str()
+        self.title = str()
         self.sources = list()
 
-    def to_dict(self):
+    def json_fields(self):
 
-        collection_dict = {}
+        fields = []
         
         if self.id:
-            collection_dict['id'] = self.id
+            fields.append(('id', self.id))
         
         if self.title:
-            collection_dict['title'] = self.title
+            fields.append(('title', self.title))
 
         if self.url:
-            collection_dict['scraped_from'] = self.url
+            fields.append(('scraped_from', self.url))
         
         if len(self.sources) > 0:
-            collection_dict['source'] = self.dump_sources()
+            fields.append(('source', self.dump_sources()))
         
-        return collection_dict
+        return fields
     
     def dump_sources(self):
-        
-        sources_list = []
-        for source in self.sources:
-            sources_list.append(source.id)
-        return sources_list
-
+        return [source.id for source in self.sources]
 
-class Dataset():
+class Dataset(_Model):
     
-    dataset_type = str()
-    title = str()
-    description = str()
-    keyword = list()
-    modified = None
-    scraped_from = str()
-    publisher = Organization()
-    contactPoint = dict()
-    identifier = str()
-    accessLevel = str()
-    bureauCode = list()
-    programCode = list()
-    dataset_license = str()
-    spatial = str()
-    temporal = str()
-    theme = list()
-    distribution = list() # resources list
-    levelOfData = str()
-    source = list() # list of Sources
-    collection = list() # list of Collections
+    __slots__ = ('dataset_type', 'title', 'description', 'keyword', 'modified', 'scraped_from',
+                 'publisher', 'contactPoint', 'identifier', 'accessLevel', 'bureauCode',
+                 'programCode', 'dataset_license', 'spatial', 'temporal', 'theme',
+                 'distribution', 'levelOfData', 'source', 'collection')
 
     def __init__(self):
         
         self.dataset_type = "dcat:Dataset"
+        self.title = str()
+        self.description = "n/a"
+        self.keyword = list()
+        self.modified = datetime.now().strftime("%Y-%m-%d")
+        self.scraped_from = str()
+        self.publisher = Organization()
+        self.contactPoint = dict()
+        self.identifier = str()
         self.accessLevel = "public"
+        self.bureauCode = list()
+        self.programCode = list()
         # set license to cc-zero
         self.dataset_license = "https://creativecommons.org/publicdomain/zero/1.0/"
         #self.dataset_license = "notspecified"
         self.spatial = "United States"
-        self.description = "n/a"
-        self.modified = datetime.now().strftime("%Y-%m-%d")
-        self.distribution = list()
-        self.source = list()
-        self.collection = list()
+        self.temporal = str()
+        self.theme = list()
+        self.distribution = list() # resources list
+        self.levelOfData = str()
+        self.source = list() # list of Sources
+        self.collection = list() # list of Collections
 
-    def to_dict(self):
+    def json_fields(self):
 
-        dataset_dict = {}
+        fields = []
 
         if self.dataset_type:
-            dataset_dict["@type"] = self.dataset_type
+            fields.append(("@type", self.dataset_type))
         
         if self.title:
-            dataset_dict["title"] = self.title
+            fields.append(("title", self.title))
         
         if self.description:
-            dataset_dict["description"] = self.description
+            fields.append(("description", self.description))
 
         if len(self.keyword) > 0:
-            dataset_dict["keyword"] = self.keyword
+            fields.append(("keyword", self.keyword))
 
         if self.modified:
-            dataset_dict["modified"] = self.modified
+            fields.append(("modified", self.modified))
 
-        if self.publisher.to_dict():
-            dataset_dict["publisher"] = self.publisher.to_dict()
+        if self.publisher.name: # the publisher has a dict
+            fields.append(("publisher", self.publisher))
 
         if self.scraped_from:
-            dataset_dict["scraped_from"] = self.scraped_from
+            fields.append(("scraped_from", self.scraped_from))
 
         if self.contactPoint:
-            dataset_dict["contactPoint"] = self.contactPoint
+            fields.append(("contactPoint", self.contactPoint))
 
         if self.identifier:
-            dataset_dict["identifier"] = self.identifier
+            fields.append(("identifier", self.identifier))
 
         if self.accessLevel:
-            dataset_dict["accessLevel"] = self.accessLevel
+            fields.append(("accessLevel", self.accessLevel))
 
         if len(self.bureauCode) > 0:
-            dataset_dict["bureauCode"] = self.bureauCode
+            fields.append(("bureauCode", self.bureauCode))
 
         if len(self.programCode) > 0:
-            dataset_dict["programCode"] = self.programCode
+            fields.append(("programCode", self.programCode))
 
         if self.dataset_license:
-            dataset_dict["license"] = self.dataset_license
+            fields.append(("license", self.dataset_license))
 
         if self.spatial:
-            dataset_dict["spatial"] = self.spatial
+            fields.append(("spatial", self.spatial))
 
         if self.temporal:
-            dataset_dict["temporal"] = self.temporal
+            fields.append(("temporal", self.temporal))
 
         if len(self.theme) > 0:
-            dataset_dict["theme"] = self.theme
+            fields.append(("theme", self.theme))
 
         if len(self.distribution) > 0:
-            dataset_dict["distribution"] = self.dump_resources()
+            fields.append(("distribution", self.distribution))
         
         if self.levelOfData:
-            dataset_dict['levelOfData'] = self.levelOfData
+            fields.append(('levelOfData', self.levelOfData))
         
         if len(self.source) > 0:
-            dataset_dict['source'] = self.dump_sources()
+            fields.append(('source', self.dump_sources()))
         
         if len(self.collection) > 0:
-            dataset_dict['collection'] = self.dump_collections()
+            fields.append(('collection', self.dump_collections()))
 
-        return dataset_dict
+        return fields
 
     def dump_resources(self):
-
-        resources_lst = []
-
-        for resource in self.distribution:
-            resources_lst.append(resource.to_dict())
-
-        return resources_lst
+        return _to_dict(self.distribution)
     
     def dump_sources(self):
-        sources_list = []
-
-        for source in self.source:
-            sources_list.append(source.id)
-        return sources_list
+        return [source.id for source in self.source]
     
     def dump_collections(self):
-        collections_list = []
-
-        for collection in self.collection:
-            collections_list.append(collection.id)
-        return collections_list
+        return [collection.id for collection in self.collection]
             
 
-class Resource():
+class Resource(_Model):
 
-    resource_type = str()
-    description = str()
-    title = str()
-    resource_format = str()
-    mediaType = str()
-    accessURL = str()
-    downloadURL = str()
-    headerMetadata = dict()
+    __slots__ = ('resource_type', 'description', 'title', 'resource_format', 'mediaType',
+                 'accessURL', 'downloadURL', 'headerMetadata')
 
     def __init__(self):    
         self.resource_type = "dcat:Distribution"
         self.description = "n/a"
+        self.title = str()
         self.resource_format = "txt"
         self.mediaType = h.get_media_type(self.resource_format)
+        self.accessURL = str()
+        self.downloadURL = str()
         self.headerMetadata = dict()
 
-    def to_dict(self):
+    def json_fields(self):
 
-        resource_dict = {}
+        fields = []
 
         if self.resource_type:
-            resource_dict["@type"] = self.resource_type
+            fields.append(("@type", self.resource_type))
 
         if self.title:
-            resource_dict["title"] = self.title
+            fields.append(("title", self.title))
         
         if self.description:
-            resource_dict["description"] = self.description
+            fields.append(("description", self.description))
 
         if self.downloadURL:
-            resource_dict["downloadURL"] = self.downloadURL
+            fields.append(("downloadURL", self.downloadURL))
 
         if self.accessURL:
-            resource_dict["accessURL"] = self.accessURL
+            fields.append(("accessURL", self.accessURL))
 
         if self.resource_format:
-            resource_dict["format"] = self.resource_format
+            fields.append(("format", self.resource_format))
 
         if self.mediaType:
-            resource_dict["mediaType"] = self.mediaType
+            fields.append(("mediaType", self.mediaType))
         
-        if len(list(self.headerMetadata.keys())) > 0:
-            resource_dict["headerMetadata"] = self.headerMetadata
+        if self.headerMetadata:
+            fields.append(("headerMetadata", self.headerMetadata))
 
-        return resource_dict
+        return fields
@@ -6,7 +6,8 @@ from urllib.parse import urljoin
 import edscrapers.transformers.base.helpers as h
 from edscrapers.cli import logger
 from edscrapers.transformers.base.helpers import traverse_output, read_file
-from edscrapers.transformers.datajson.models import Catalog, Dataset, Resource, Organization, Source, Collection
+from edscrapers.transformers.base.chain import run_stages, get_file_list
+from edscrapers.transformers.datajson.models import Catalog, CatalogWriter, Dataset, Resource, Organization, Source, Collection
 
 OUTPUT_DIR = os.getenv('ED_OUTPUT_PATH')
 resources_common_names = ['excel', 'doc', 'download excel', 'download se excel',
@@ -14,98 +15,100 @@ resources_common_names = ['excel', 'doc', 'download excel', 'download se excel',
                         'download this table as a microsoft excel spreadsheet',
                         'excel download', 'download standard error excel']
 
-dataset_title_list = []
-dataset_identifier_list = []
 
+def transform(name, input_file=None, jobs=1):
 
-def transform(name, input_file=None):
-    if input_file is None:
-        file_list = traverse_output(name)
-    else:
-        try:
-            with open(input_file, 'r') as fp:
-                file_list = [line.rstrip() for line in fp]
-        except:
-            logger.warning(f'Cannot read from list of output files at {input_file}, falling back to all collected data!')
-            file_list = traverse_output(name)
+    run_stages([Stage(name)], get_file_list(name, input_file), jobs=jobs)
 
-    logger.debug(f'{len(file_list)} files to transform.')
 
-    catalog = Catalog()
-    catalog.catalog_id = "datopian_data_json_" + (name or 'all')
+class Stage():
+    """ class is the datajson stage of a transformer chain (see `transformers.base.chain`).
+    The datasets are written to the data.json as they go through (see `CatalogWriter`),
+    after the Sources and Collections of the catalog are read. Their titles and
+    identifiers are made unique in file order, as they are written """
 
+    def __init__(self, name=None, downstream=False):
+        self.name = name
+        self.catalog = Catalog()
+        self.catalog.catalog_id = "datopian_data_json_" + (name or 'all')
+        # the titles and identifiers taken so far
+        self.titles = set()
+        self.identifiers = set()
+        # the data.json is opened with the first dataset (see `_get_writer()`)
+        self.writer = None
 
-    # keep track/stata for item transformed
-    datasets_number = 0
-    resources_number = 0
-    sources_number = 0
-    collections_number = 0
+        # keep track/stata for item transformed
+        self.datasets_number = 0
+        self.resources_number = 0
 
-    # loop through the list of filepaths to be transformed
-    for file_path in file_list:
-
-        data = read_file(file_path)
-        if not data:
-            continue
+        catalog = self.catalog
+        # get the list of Sources for this catalog
+        catalog_sources = list()
+        try:
+            # read the list of preprocessed (but still 'raw') Sources from file
+            catalog_sources = read_file(f"{h.get_output_path('sources')}/{(name or 'all')}.sources.json")
+            # transform the list of preprocessed Sources to a list of Source objects acceptable for the catalog object
+            catalog_sources = _transform_preprocessed_sources(catalog_sources)
+        except:
+            logger.warning(f'"sources transformer" output file ({(name or "all")}.sources.json) not found. This datajson output will have no "source" field')
+        
+        # add the list of Source objects to the catalog
+        catalog.sources = catalog_sources or []
+        
+        # get the list of Collections for this catalog
+        catalog_collections = list()
+        try:
+            # read the list of preprocessed (but still 'raw') Collections from file
+            catalog_collections = read_file(f"{h.get_output_path('collections')}/{(name or 'all')}.collections.json")
+            # transform the list of preprocessed Collections to a list of Collection objects acceptable for the catalog object
+            catalog_collections = _transform_preprocessed_collections(catalog_collections)
+        except:
+            logger.warning(f'"sources transformer" output file ({(name or "all")}.collections.json) not found. This datajson output will have no "collection" field')
+        
+        # add the list of Collection objects to the catalog
+        catalog.collections = catalog_collections or []
 
-        dataset = _transform_scraped_dataset(data, name)
+    def prepare(self, file_path, data):
+        return data, _transform_scraped_dataset(data, self.name)
 
+    def process(self, file_path, data, dataset=None):
         if not dataset: # no dataset was returned (i.e. dataset probably marked for removal)
-            continue
+            return None
         
-        catalog.datasets.append(dataset)
-
-        datasets_number += 1
-        resources_number += len(dataset.distribution)
-
-    # TODO WORK FROM BELOW HERE
-    # get the list of Sources for this catalog
-    catalog_sources = list()
-    try:
-        # read the list of preprocessed (but still 'raw') Sources from file
-        catalog_sources = read_file(f"{h.get_output_path('sources')}/{(name or 'all')}.sources.json")
-        # transform the list of preprocessed Sources to a list of Source objects acceptable for the catalog object
-        catalog_sources = _transform_preprocessed_sources(catalog_sources)
-    except:
-        logger.warning(f'"sources transformer" output file ({(name or "all")}.sources.json) not found. This datajson output will have no "source" field')
-    
-    # add the list of Source objects to the catalog
-    catalog.sources = catalog_sources or []
-    # update the number fo transformed Sources
-    sources_number = len(catalog_sources or [])
-    
-    # get the list of Collections for this catalog
-    catalog_collections = list()
-    try:
-        # read the list of preprocessed (but still 'raw') Collections from file
-        catalog_collections = read_file(f"{h.get_output_path('collections')}/{(name or 'all')}.collections.json")
-        # transform the list of preprocessed Collections to a list of Collection objects acceptable for the catalog object
-        catalog_collections = _transform_preprocessed_collections(catalog_collections)
-    except:
-        logger.warning(f'"sources transformer" output file ({(name or "all")}.collections.json) not found. This datajson output will have no "collection" field')
-    
-    # add the list of Collection objects to the catalog
-    catalog.collections = catalog_collections or []
-    # update the number fo transformed Collections
-    collections_number = len(catalog_collections or [])
-
-    # validate the catalog object
-    if not catalog.validate_catalog(pls_fix=True):
-        logger.error(f"catalog validation Failed! Ending transform process")
-        return
-
-    logger.debug('{} Sources transformed.'.format(sources_number))
-    logger.debug('{} Collections transformed.'.format(collections_number))
-    logger.debug('{} datasets transformed.'.format(datasets_number))
-    logger.debug('{} resources transformed.'.format(resources_number))
-
-    output_path = h.get_output_path('datajson')
-    file_path = os.path.join(output_path, f'{(name or "all")}.data.json')
-    with open(file_path, 'w') as output:
-        output.write(catalog.dump())
-        logger.debug(f'Output file: {file_path}')
-
-    h.upload_to_s3_if_configured(file_path, f'{(name or "all")}.data.json')
+        _set_unique_title_and_identifier(dataset, self.titles, self.identifiers)
+        self._get_writer().write_dataset(dataset)
+
+        self.datasets_number += 1
+        self.resources_number += len(dataset.distribution)
+        return data
+
+    def _get_writer(self):
+        """ private helper.
+        returns the writer of the data.json, which is opened on the first call
+        (in this process, once the workers preparing the datasets are started) """
+
+        if self.writer is None:
+            output_path = h.get_output_path('datajson')
+            file_path = os.path.join(output_path, f'{(self.name or "all")}.data.json')
+            self.writer = CatalogWriter(self.catalog, file_path)
+            self.writer.open()
+        return self.writer
+
+    def finish(self):
+        name = self.name
+        writer = self._get_writer()
+        writer.close()
+
+        logger.debug('{} Sources transformed.'.format(len(self.catalog.sources)))
+        logger.debug('{} Collections transformed.'.format(len(self.catalog.collections)))
+        logger.debug('{} datasets transformed.'.format(self.datasets_number))
+        logger.debug('{} resources transformed.'.format(self.resources_number))
+        for link_type, dropped in self.catalog.dropped_links.items():
+            if dropped:
+                logger.info(f"{dropped} {link_type.replace('_', ' ')} links dropped by the validation.")
+        logger.debug(f'Output file: {writer.file_path}')
+
+        h.upload_to_s3_if_configured(writer.file_path, f'{(name or "all")}.data.json')
 
 
 def _transform_scraped_dataset(data: dict, target_dept='all'):
@@ -129,20 +132,9 @@ def _transform_scraped_dataset(data: dict, target_dept='all'):
     dataset.scraped_from = scraped_from
     
     ### removing leading and trailing withespaces from title
-    title = data.get('title').strip()
-    # ensure datasets have a unique title
-    if title and title not in dataset_title_list:
-        dataset.title = title
-        dataset_title_list.append(title)
-    else:
-        dataset.title = h.transform_dataset_title(title, scraped_from)
-
-    identifier = data.get('name')
-    # ensure datasets have a unique identifier
-    if identifier in dataset_identifier_list:
-        identifier = h.transform_dataset_identifier(title, scraped_from)
-    dataset.identifier = identifier
-    dataset_identifier_list.append(identifier)
+    # (both are made unique by `_set_unique_title_and_identifier()`)
+    dataset.title = data.get('title').strip()
+    dataset.identifier = data.get('name')
 
     if data.get('groups'):
         dataset.theme = data.get('groups')
@@ -230,6 +222,28 @@ def _transform_scraped_dataset(data: dict, target_dept='all'):
     
     return dataset
 
+
+def _set_unique_title_and_identifier(dataset, titles, identifiers):
+    """ function is a private helper.
+    function ensures the title and identifier of 'dataset' are not those of a
+    dataset transformed before, which are in the 'titles' and 'identifiers' sets
+    (the title or identifier of 'dataset' is added to them, as it is taken) """
+
+    title = dataset.title
+    # ensure datasets have a unique title
+    if title and title not in titles:
+        titles.add(title)
+    else:
+        dataset.title = h.transform_dataset_title(title, dataset.scraped_from)
+
+    identifier = dataset.identifier
+    # ensure datasets have a unique identifier
+    if identifier in identifiers:
+        identifier = h.transform_dataset_identifier(title, dataset.scraped_from)
+    dataset.identifier = identifier
+    identifiers.add(identifier)
+
+
 def _transform_scraped_resource(target_dept, resource):
 
     distribution = Resource()
@@ -10,13 +10,14 @@ from pathlib import Path
 
 import edscrapers.transformers.base.helpers as h
 from edscrapers.cli import logger
+from edscrapers.transformers.base.executor import ProcessMap, read_ahead
 from edscrapers.transformers.rag import DATASET_WEIGHTING_SYS, TOTAL_WEIGHT # import weighting system & total weight
 
 # get the output directory
 OUTPUT_DIR = h.get_output_path('rag')
 
 
-def transform(name=None, input_file=None, use_raw_datasets=False) -> pd.DataFrame:
+def transform(name=None, input_file=None, use_raw_datasets=False, jobs=1) -> pd.DataFrame:
     """ function transforms the datajson/datasets into
     a dataframe/csv containig data to be used for RAG analyses on
     the efficacy of the scraping toolkit to get viable/usable structured data from
@@ -38,6 +39,8 @@ def transform(name=None, input_file=None, use_raw_datasets=False) -> pd.DataFram
     input_file: if provided mut be a file with list of datajson or dataset files
     to read.
 
+    jobs: the number of processes scoring the raw datasets (which are read ahead).
+
     If no parameters are provided, which is the default behaviour;
     then all datajson files contained in datajson subdirectory of
     'ED_OUTPUT_PATH/transformers' will be read.
@@ -84,13 +87,9 @@ def transform(name=None, input_file=None, use_raw_datasets=False) -> pd.DataFram
                     file_list.extend(Path(h.get_output_path('datajson')).glob('*.json'))
 
     if use_raw_datasets == True: # work on raw datasets
-        # read the contents in file_list
-        for file_path in file_list:
-            # read json from the file using helper
-            data = h.read_file(file_path)
-            # compute the weight score of the dataset
-            compute_score(data, append_score=True, use_raw_datasets=True)
-            datasets_list.append(data)
+        # read the contents in file_list and compute the weight score of each dataset
+        with ProcessMap(_score_raw_dataset, jobs=jobs) as process_map:
+            datasets_list.extend(process_map.map(_read_raw_datasets(file_list)))
     else: # work with processed json data
         # read the contents in the file_list
         for file_path in file_list:
@@ -161,6 +160,24 @@ def transform(name=None, input_file=None, use_raw_datasets=False) -> pd.DataFram
 
 
 
+def _read_raw_datasets(file_list):
+    """ private helper function.
+    iterates over the raw datasets of the files in 'file_list', which are read ahead """
+
+    for file_path, data, error in read_ahead(file_list, h.read_file):
+        if error is not None:
+            raise error
+        yield data
+
+
+def _score_raw_dataset(context, dataset: dict) -> dict:
+    """ private helper function.
+    returns the raw 'dataset' with its weighted score (computed in a worker process) """
+
+    compute_score(dataset, append_score=True, use_raw_datasets=True)
+    return dataset
+
+
 def compute_score(dataset: dict, append_score=True, use_raw_datasets=False) -> dict:
     """ function computed the weighted score for the provided dataset.
     It uses the WEIGHTING SYSTEM provided in this package/module.
@@ -0,0 +1,263 @@
+""" module contains the rule engine of the sanitize transformer.
+
+The rules of the sanitising (see `RULES` in the transform module) are declared
+once and compiled into a `RuleSet`: the words searched in the titles into a single
+regular expression (which rules out most titles at once), the State names searched in
+the resource names into an Aho-Corasick automaton (see `Automaton`), and so on. A
+dataset is then sanitised in a single pass (see `RuleSet.apply()`), with the same
+result as the former passes, one per rule, each of which looked up and cleaned up
+the '_clean_data' of the dataset on its own.
+
+The groups of a dataset come from the urls of its resources: the url prefixes of all
+the groups are compiled into an automaton too, which finds all the prefixes in a url
+in one scan of it. The groups of each resource url are memoized, as many resources
+(e.g. the same file linked from many pages) are found in many datasets """
+
+import re
+import functools
+import collections
+import urllib.parse
+
+from edscrapers.transformers.base import helpers as h
+
+# the number of resource urls whose groups are memoized
+URL_CACHE_SIZE = 100000
+
+
+class Automaton():
+    """ class is an Aho-Corasick automaton, which finds which of
+    'words' are contained in a text in a single scan of the text """
+
+    def __init__(self, words):
+        self.transitions = [dict()] # the transitions of each state, per character
+        self.outputs = [()] # the words found when reaching each state
+
+        for word in words:
+            state = 0
+            for character in word:
+                if character not in self.transitions[state]:
+                    self.transitions.append(dict())
+                    self.outputs.append(())
+                    self.transitions[state][character] = len(self.transitions) - 1
+                state = self.transitions[state][character]
+            self.outputs[state] = (word,)
+
+        # the fallback of a state is the longest suffix of its word which is a state too.
+        # Each state takes on the transitions of its fallback, so a text is scanned
+        # with a single transition per character
+        fallbacks = [0] * len(self.transitions)
+        queue = collections.deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            # the fallback is shallower, so its transitions are complete already
+            fallback_transitions = self.transitions[fallbacks[state]]
+            for character, next_state in self.transitions[state].items():
+                queue.append(next_state)
+                fallbacks[next_state] = fallback_transitions.get(character, 0)
+                self.outputs[next_state] += self.outputs[fallbacks[next_state]]
+            self.transitions[state] = {**fallback_transitions, **self.transitions[state]}
+
+    def find(self, text):
+        """ returns the words contained in 'text', in the order they end in it """
+
+        transitions, outputs = self.transitions, self.outputs
+        found = []
+        state = 0
+        for character in text:
+            state = transitions[state].get(character, 0)
+            if outputs[state]:
+                found.extend(outputs[state])
+        return found
+
+    def search(self, text):
+        """ returns whether any of the words is contained in 'text' """
+
+        transitions, outputs = self.transitions, self.outputs
+        state = 0
+        for character in text:
+            state = transitions[state].get(character, 0)
+            if outputs[state]:
+                return True
+        return False
+
+
+class RuleSet():
+    """ class is the compiled set of the rules of the sanitising.
+
+    - 'private_words': the datasets with any of these words in their title are
+    marked as private, and the word is added to their tags
+    - 'removal_words': the datasets with any of these words in their title (or
+    published by 'edgov') are marked for removal
+    - 'unwanted_title_strings': the regular expressions removed from the titles
+    - 'states': the State names, by which a resource holds State-level data
+    - 'group_map': the url prefixes of each group """
+
+    def __init__(self, private_words=(), removal_words=(), unwanted_title_strings=(),
+                 states=(), group_map=None):
+        self.private_words = [(word.lower().replace(' ', '-'), _compile_words([word]))
+                              for word in private_words]
+        self.private_pattern = _compile_words(private_words)
+        self.removal_pattern = _compile_words(removal_words)
+        self.unwanted_title_patterns = [re.compile(regex_str, re.IGNORECASE)
+                                        for regex_str in unwanted_title_strings]
+        self.states = Automaton([state.lower() for state in states])
+        self.group_urls = [(base_url, group) for group, base_urls in (group_map or {}).items()
+                           for base_url in base_urls]
+        # the indexes (in group_urls) of each url prefix
+        self.group_indexes = collections.defaultdict(list)
+        for index, (base_url, _) in enumerate(self.group_urls):
+            self.group_indexes[base_url].append(index)
+        self.group_automaton = Automaton(self.group_indexes)
+        # the groups of a resource, memoized per (source url, url)
+        self.resource_groups = functools.lru_cache(maxsize=URL_CACHE_SIZE)(self._get_resource_groups)
+
+    def apply(self, dataset: dict) -> dict:
+        """ sanitises 'dataset'. Returns the dataset, with the
+        changes to be made in its '_clean_data' key """
+
+        clean_data = dataset.setdefault('_clean_data', dict())
+
+        # an empty '_clean_data' is dropped (and added again at the
+        # end of the dataset, once it has keys) as it was after each pass
+        if dataset.get('title') is not None:
+            dataset['title'] = dataset['title'].strip()
+            self._mark_private(dataset, clean_data)
+            if not clean_data:
+                del dataset['_clean_data']
+            self._remove_dataset(dataset, clean_data)
+            self._strip_unwanted_strings(dataset, clean_data)
+        if dataset.get('resources') is not None:
+            self._set_level_of_data(dataset, clean_data)
+            if not clean_data:
+                dataset.pop('_clean_data', None)
+        self._set_groups(dataset, clean_data)
+        self._remove_old_sources_collections(dataset, clean_data)
+
+        if clean_data:
+            dataset['_clean_data'] = clean_data
+        else:
+            dataset.pop('_clean_data', None)
+        return dataset
+
+    def _mark_private(self, dataset, clean_data):
+        """ private helper.
+        marks the dataset as private (and tags it) if its title has any of the private words """
+
+        title = clean_data.get('title', dataset['title'])
+        tags = clean_data.get('tags', dataset.get('tags', '').strip())
+        if not self.private_pattern.search(title):
+            return
+
+        for tag, pattern in self.private_words:
+            if pattern.search(title):
+                # word is in title
+                keywords = h.transform_keywords(tags)
+                if tag not in keywords:
+                    # word needs to be added to tag
+                    keywords.append(tag)
+                    tags = ';'.join(keywords)
+                    clean_data['tags'] = tags
+                # mark dataset as 'private'
+                clean_data['accessLevel'] = 'non-public'
+
+    def _remove_dataset(self, dataset, clean_data):
+        """ private helper.
+        flags the dataset for removal if its title has any of the removal words """
+
+        if clean_data.get('_remove_dataset') is True: # dataset already flagged for removal
+            return
+
+        title = clean_data.get('title', dataset['title'])
+        if self.removal_pattern.search(title):
+            clean_data['_remove_dataset'] = True
+
+        # Temporary fix for removing the 'edgov' datasets from the resulting datajson file
+        # FIXME set this to True once parsing / sanitizing for the publisher is improved
+        publisher = dataset['publisher']
+        if (publisher.get('name') if isinstance(publisher, dict) else publisher) == 'edgov':
+            clean_data['_remove_dataset'] = True
+
+    def _strip_unwanted_strings(self, dataset, clean_data):
+        """ private helper.
+        removes the unwanted strings from the title """
+
+        for pattern in self.unwanted_title_patterns:
+            title = pattern.sub('', clean_data.get('title', dataset['title']).strip())
+            if title != dataset['title']:
+                clean_data['title'] = title
+
+    def _set_level_of_data(self, dataset, clean_data):
+        """ private helper.
+        sets the level of data ('national' and/or 'state') from the resource names """
+
+        level_of_data = set()
+        national_title = None # whether 'national' is in the title, once looked up
+        for resource in dataset['resources']:
+            # if level_of_data already contain 'national' and 'state', no need to continue
+            if 'national' in level_of_data and 'state' in level_of_data:
+                break
+            name = resource.get('name', '').lower()
+            if 'national' not in level_of_data:
+                if 'national' not in name and national_title is None:
+                    national_title = 'national' in dataset.get('title', '').lower()
+                if 'national' in name or national_title:
+                    level_of_data.add('national')
+            if self.states.search(name):
+                level_of_data.add('state')
+
+        if level_of_data:
+            clean_data['level_of_data'] = list(level_of_data)
+
+    def _set_groups(self, dataset, clean_data):
+        """ private helper.
+        sets the groups of the dataset from the urls of its resources.
+        As the former pass, the groups are set when the last resource has any """
+
+        groups = list(dataset.get('groups') or []) # the groups of the dataset are left as they are
+        new_groups = None
+        for resource in dataset.get('resources') or []:
+            new_groups = self.resource_groups(resource['source_url'], resource['url'])
+            if new_groups:
+                groups.extend(new_groups)
+
+        if new_groups:
+            clean_data['groups'] = list(set(groups))
+
+    def find_groups(self, url):
+        """ returns the groups of 'url', in the order of the group map
+        (a group is repeated for each of its prefixes in it) """
+
+        indexes = sorted(index for base_url in set(self.group_automaton.find(url))
+                         for index in self.group_indexes[base_url])
+        return [self.group_urls[index][1] for index in indexes]
+
+    def _get_resource_groups(self, source_url, url):
+        """ private helper.
+        returns the groups of the resource with 'url', found on 'source_url' """
+
+        return tuple(self.find_groups(urllib.parse.urljoin(source_url, url)))
+
+    def _remove_old_sources_collections(self, dataset, clean_data):
+        """ private helper.
+        removes sources and collections that were produced by earlier
+        implementations of their respective transformers """
+
+        if dataset.get('collection') is None or dataset.get('source'):
+            return
+
+        collection = clean_data.get('collection', dataset.get('collection', []))
+        source = clean_data.get('source', dataset.get('source', []))
+        if type(collection) == dict:
+            clean_data['collection'] = None
+        if type(source) == dict:
+            clean_data['source'] = None
+
+
+def _compile_words(words):
+    """ private helper.
+    returns the (case-insensitive) regular expression of any of 'words', as whole words """
+
+    if not words:
+        return re.compile(r'(?!)') # matches nothing
+    return re.compile(r'\b(?:' + '|'.join(re.escape(word) for word in words) + r')\b',
+                      re.IGNORECASE)